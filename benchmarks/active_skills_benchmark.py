@@ -0,0 +1,84 @@
+"""
+ActiveSkillTracker vs the list of [skill_id, ts] pairs ConverseTracker
+used before, at thousands of tracked skills
+
+    python benchmarks/active_skills_benchmark.py --skills 100 1000 5000
+
+each run activates every skill, then does --ops random bumps and lookups
+"""
+from ovos_utils.intents.active_skills import ActiveSkillTracker
+import argparse
+import random
+import time
+
+
+class ListTracker:
+    """ the previous ConverseTracker algorithm """
+
+    def __init__(self, timeout=300):
+        self.timeout = timeout
+        self.active_skills = []
+
+    def check(self, skill_id):
+        self.expire()
+        for skill in list(self.active_skills):
+            if skill[0] == skill_id:
+                return True
+        return False
+
+    def expire(self):
+        for skill in list(self.active_skills):
+            if time.time() - skill[1] > self.timeout:
+                self.remove(skill[0])
+
+    def remove(self, skill_id):
+        for skill in list(self.active_skills):
+            if skill[0] == skill_id:
+                self.active_skills.remove(skill)
+
+    def add(self, skill_id):
+        self.remove(skill_id)
+        self.active_skills.insert(0, [skill_id, time.time()])
+
+    def shutdown(self):
+        pass
+
+
+def run(tracker, skills, ops):
+    ids = ["skill-{n}".format(n=n) for n in range(skills)]
+    rnd = random.Random(1)
+    start = time.perf_counter()
+    for skill_id in ids:
+        tracker.add(skill_id)
+    fill = time.perf_counter() - start
+    picks = [rnd.choice(ids) for _ in range(ops)]
+    start = time.perf_counter()
+    for skill_id in picks:
+        tracker.add(skill_id)
+    bump = time.perf_counter() - start
+    start = time.perf_counter()
+    for skill_id in picks:
+        tracker.check(skill_id)
+    check = time.perf_counter() - start
+    tracker.shutdown()
+    return {"fill ms": fill * 1000,
+            "bump us": bump / ops * 1e6,
+            "check us": check / ops * 1e6}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--skills", type=int, nargs="+",
+                        default=[100, 1000, 5000])
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+
+    columns = ["fill ms", "bump us", "check us"]
+    print("{:<10}{:>8}".format("tracker", "skills") +
+          "".join("{:>12}".format(c) for c in columns))
+    for n in args.skills:
+        for name, tracker in (("list", ListTracker()),
+                              ("indexed", ActiveSkillTracker())):
+            r = run(tracker, n, args.ops)
+            print("{:<10}{:>8}".format(name, n) +
+                  "".join("{:>12.2f}".format(r[c]) for c in columns))
@@ -0,0 +1,212 @@
+"""
+throughput and latency of the ovos_utils.messagebus primitives
+
+starts a local websocket bus stand-in and drives N concurrent clients
+through send_message, wait_for_reply, BusService, BusQuery and
+BusFeedConsumer, results are printed as a table and optionally saved as
+json to compare runs
+
+    python benchmarks/bus_benchmark.py --clients 8 --requests 200 \\
+        --json results.json
+    python benchmarks/bus_benchmark.py --transport local
+"""
+from ovos_utils.messagebus import Message, get_websocket, send_message, \
+    wait_for_reply, BusService, BusQuery, BusFeedProvider, BusFeedConsumer, \
+    ReplyRouter
+from ovos_utils.messagebus.loadgen import percentile
+from ovos_utils.messagebus.local import LocalBus
+from ovos_utils.messagebus.server import LocalMessageBusServer
+from threading import Thread
+import argparse
+import json
+import time
+
+
+def answered(response):
+    """ a request only counts if a reply with data arrived, timeouts
+    return None or an empty Message depending on the helper """
+    return response is not None and bool(response.data)
+
+
+def summarize(name, latencies, errors, elapsed):
+    ok = len(latencies)
+    return {"scenario": name,
+            "requests": ok + errors,
+            "errors": errors,
+            "elapsed": elapsed,
+            "throughput": ok / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": max(latencies) * 1000 if latencies else 0.0}
+
+
+class Benchmark:
+    def __init__(self, clients=4, requests=100, transport="websocket",
+                 timeout=5):
+        self.n_clients = clients
+        self.n_requests = requests
+        self.transport = transport
+        self.timeout = timeout
+        self.server = None
+        self.responder = None
+        self.clients = []
+        self.routers = []
+        self.results = []
+
+    # setup
+    def _connect(self):
+        if self.transport == "local":
+            return self.local_bus
+        bus = get_websocket(self.server.host, self.server.port, "/core")
+        bus.connected_event.wait(self.timeout)
+        return bus
+
+    def setup(self):
+        if self.transport == "local":
+            self.local_bus = LocalBus()
+        else:
+            self.server = LocalMessageBusServer(port=0).start()
+        self.responder = self._connect()
+        self.clients = [self._connect() for _ in range(self.n_clients)]
+
+        # echo for wait_for_reply
+        self.responder.on("benchmark.ping", lambda m: self.responder.emit(
+            m.response({"pong": True})))
+        # BusService / BusQuery target
+        self.service = BusService(Message("benchmark.service.reply",
+                                          {"value": 42}),
+                                  trigger_messages=["benchmark.service"],
+                                  bus=self.responder)
+        # BusFeedProvider / BusFeedConsumer
+        self.provider = BusFeedProvider("benchmark.feed.request",
+                                        bus=self.responder)
+        self.provider.set_data_gatherer(
+            lambda m: self.provider.update({"ts": time.time()}))
+
+    def teardown(self):
+        for router in self.routers:
+            router.shutdown()
+        self.service.shutdown()
+        self.provider.shutdown()
+        if self.transport != "local":
+            for bus in self.clients + [self.responder]:
+                bus.close()
+            self.server.stop()
+
+    # runner
+    def run_scenario(self, name, make_worker):
+        """ make_worker(bus) returns a callable doing one request, the
+        callable returns False if the request failed """
+        latencies = []
+        errors = [0]
+        workers = [make_worker(bus) for bus in self.clients]
+
+        def drive(worker):
+            for _ in range(self.n_requests):
+                start = time.time()
+                try:
+                    ok = worker()
+                except Exception:
+                    ok = False
+                if ok is False:
+                    errors[0] += 1
+                else:
+                    latencies.append(time.time() - start)
+
+        threads = [Thread(target=drive, args=(w,)) for w in workers]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        result = summarize(name, latencies, errors[0], time.time() - start)
+        self.results.append(result)
+        return result
+
+    # scenarios
+    def bench_send_message(self):
+        def make(bus):
+            msg = Message("benchmark.send", {"utterance": "hello"})
+            return lambda: send_message(msg, bus=bus)
+        return self.run_scenario("send_message", make)
+
+    def bench_wait_for_reply(self):
+        def make(bus):
+            return lambda: answered(wait_for_reply(Message("benchmark.ping"),
+                                                   "benchmark.ping.response",
+                                                   timeout=self.timeout,
+                                                   bus=bus))
+        return self.run_scenario("wait_for_reply", make)
+
+    def bench_bus_service(self):
+        # every client waits for the same reply type, match replies to
+        # requests by correlation id so no client takes another one's reply
+        def make(bus):
+            router = ReplyRouter(bus)
+            self.routers.append(router)
+            return lambda: answered(router.send(
+                Message("benchmark.service"), "benchmark.service.reply",
+                timeout=self.timeout))
+        return self.run_scenario("BusService", make)
+
+    def bench_bus_query(self):
+        def make(bus):
+            query = BusQuery(Message("benchmark.service"), bus=bus)
+            return lambda: answered(query.send("benchmark.service.reply",
+                                               self.timeout))
+        return self.run_scenario("BusQuery", make)
+
+    def bench_feed_consumer(self):
+        def make(bus):
+            consumer = BusFeedConsumer(Message("benchmark.feed.request"),
+                                       timeout=self.timeout, bus=bus)
+            return lambda: bool(consumer.request())
+        return self.run_scenario("BusFeedConsumer", make)
+
+    def run(self):
+        self.setup()
+        try:
+            self.bench_send_message()
+            self.bench_wait_for_reply()
+            self.bench_bus_service()
+            self.bench_bus_query()
+            self.bench_feed_consumer()
+        finally:
+            self.teardown()
+        return self.results
+
+
+def print_table(results):
+    header = "{:<16} {:>9} {:>7} {:>11} {:>9} {:>9} {:>9}"
+    row = "{:<16} {:>9d} {:>7d} {:>11.1f} {:>9.2f} {:>9.2f} {:>9.2f}"
+    print(header.format("scenario", "requests", "errors", "req/s",
+                        "p50 ms", "p95 ms", "p99 ms"))
+    for r in results:
+        print(row.format(r["scenario"], r["requests"], r["errors"],
+                         r["throughput"], r["p50_ms"], r["p95_ms"],
+                         r["p99_ms"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100,
+                        help="requests per client and scenario")
+    parser.add_argument("--transport", choices=["websocket", "local"],
+                        default="websocket")
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("--json", help="also save results to this file")
+    args = parser.parse_args()
+
+    bench = Benchmark(args.clients, args.requests, args.transport,
+                      args.timeout)
+    results = bench.run()
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"clients": args.clients,
+                       "requests": args.requests,
+                       "transport": args.transport,
+                       "timestamp": time.time(),
+                       "results": results}, f, indent=2)
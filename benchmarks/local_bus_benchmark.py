@@ -0,0 +1,56 @@
+"""
+dispatch rate of the in process LocalBus vs the websocket client talking
+to a local websocket stand-in
+
+    python benchmarks/local_bus_benchmark.py --messages 5000
+"""
+from ovos_utils.messagebus import Message, get_websocket
+from ovos_utils.messagebus.local import LocalBus
+from ovos_utils.messagebus.server import LocalMessageBusServer
+from threading import Event
+import argparse
+import time
+
+
+def dispatch_rate(bus, n, timeout=60):
+    """ messages per second from emit() until the handler saw them all """
+    received = [0]
+    done = Event()
+
+    def handler(message):
+        received[0] += 1
+        if received[0] >= n:
+            done.set()
+
+    bus.on("benchmark.dispatch", handler)
+    message = Message("benchmark.dispatch", {"utterance": "hello world",
+                                             "lang": "en-us"})
+    start = time.time()
+    for _ in range(n):
+        bus.emit(message)
+    done.wait(timeout)
+    elapsed = time.time() - start
+    bus.remove("benchmark.dispatch", handler)
+    return received[0] / elapsed if elapsed else float("inf")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    args = parser.parse_args()
+
+    local = dispatch_rate(LocalBus(), args.messages)
+
+    server = LocalMessageBusServer(port=0).start()
+    try:
+        ws = get_websocket(server.host, server.port, route="/core")
+        ws.connected_event.wait(5)
+        websocket = dispatch_rate(ws, args.messages)
+        ws.close()
+    finally:
+        server.stop()
+
+    print("{:<12} {:>14}".format("bus", "msg/s"))
+    print("{:<12} {:>14.1f}".format("LocalBus", local))
+    print("{:<12} {:>14.1f}".format("websocket", websocket))
+    print("speedup: {:.1f}x".format(local / websocket))
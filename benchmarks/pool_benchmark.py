@@ -0,0 +1,54 @@
+"""
+compare messages per second of the bus=None helpers with and without
+connection pooling, against a local websocket stand-in
+
+    python benchmarks/pool_benchmark.py --messages 200
+"""
+from ovos_utils.messagebus import Message, get_websocket
+from ovos_utils.messagebus.pool import BusConnectionPool
+from ovos_utils.messagebus.server import LocalMessageBusServer
+import argparse
+import time
+
+
+def unpooled(server, n):
+    # what send_message(msg) used to do, new connection per message
+    for i in range(n):
+        bus = get_websocket(server.host, server.port, route="/core")
+        bus.emit(Message("benchmark.unpooled", {"n": i}))
+        bus.close()
+
+
+def pooled(server, n):
+    # what send_message(msg) does now
+    pool = BusConnectionPool(get_websocket)
+    for i in range(n):
+        bus = pool.acquire(server.host, server.port, "/core", False)
+        bus.emit(Message("benchmark.pooled", {"n": i}))
+        pool.release(bus)
+    pool.close_all()
+
+
+def run(func, server, n):
+    start = time.time()
+    func(server, n)
+    elapsed = time.time() - start
+    return n / elapsed if elapsed else float("inf")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    server = LocalMessageBusServer(port=0).start()
+    try:
+        without_pool = run(unpooled, server, args.messages)
+        with_pool = run(pooled, server, args.messages)
+    finally:
+        server.stop()
+
+    print("{:<12} {:>12}".format("mode", "msg/s"))
+    print("{:<12} {:>12.1f}".format("unpooled", without_pool))
+    print("{:<12} {:>12.1f}".format("pooled", with_pool))
+    print("speedup: {:.1f}x".format(with_pool / without_pool))
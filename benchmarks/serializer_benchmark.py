@@ -0,0 +1,68 @@
+"""
+encode / decode speed and frame size of every installed serializer
+
+    python benchmarks/serializer_benchmark.py --iterations 20000
+"""
+from ovos_utils.messagebus import Message
+from ovos_utils.messagebus.serialization import FrameCodec, \
+    available_serializers
+import argparse
+import time
+
+SAMPLES = {
+    "eyes.setpixel": Message("enclosure.eyes.setpixel",
+                             {"idx": 7, "r": 255, "g": 0, "b": 128},
+                             {"source": "enclosure"}),
+    "viseme_list": Message("enclosure.mouth.viseme_list",
+                           {"start": 1612345678.5,
+                            "visemes": [[i % 7, i * 0.05]
+                                        for i in range(120)]},
+                           {"source": "audio"}),
+    "gui.value.set": Message("gui.value.set",
+                             {"__from": "skill-media.jarbasai",
+                              "videos": [{"title": "video {n}".format(n=n),
+                                          "url": "https://example.com/"
+                                                 "v/{n}".format(n=n),
+                                          "duration": n * 10}
+                                         for n in range(300)]},
+                             {"source": "skills"})
+}
+
+
+def bench(codec, message, iterations):
+    frame = codec.encode(message)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        codec.encode(message)
+    encode = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(iterations):
+        codec.decode(frame)
+    decode = time.perf_counter() - start
+    return {"size": len(frame),
+            "encode_us": encode / iterations * 1e6,
+            "decode_us": decode / iterations * 1e6}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--compress-threshold", type=int, default=1024)
+    args = parser.parse_args()
+
+    codecs = [("legacy json", FrameCodec(legacy=True))]
+    for name in available_serializers():
+        codecs.append((name, FrameCodec(name)))
+        codecs.append((name + "+zlib",
+                       FrameCodec(name, args.compress_threshold)))
+
+    print("{:<15} {:<15} {:>9} {:>11} {:>11}".format(
+        "message", "serializer", "bytes", "encode us", "decode us"))
+    for sample, message in SAMPLES.items():
+        # big payloads take longer, keep the total run time reasonable
+        n = max(args.iterations // (len(message.serialize()) // 200 + 1),
+                100)
+        for name, codec in codecs:
+            r = bench(codec, message, n)
+            print("{:<15} {:<15} {:>9d} {:>11.2f} {:>11.2f}".format(
+                sample, name, r["size"], r["encode_us"], r["decode_us"]))
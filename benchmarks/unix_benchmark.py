@@ -0,0 +1,111 @@
+"""
+unix domain socket transport vs the TCP websocket, both through a local
+relay server
+
+    python benchmarks/unix_benchmark.py --messages 5000 --roundtrips 1000
+
+throughput: messages per second from emit() until the handler saw them all
+latency: ping / response round trips through the relay
+cpu: process cpu seconds used by each run, client and relay are in this
+     process so both sides are counted
+"""
+from ovos_utils.messagebus import Message, get_websocket
+from ovos_utils.messagebus.server import LocalMessageBusServer
+from ovos_utils.messagebus.unix import UnixMessageBusServer, get_unix_bus
+from tempfile import mkdtemp
+from threading import Event
+from os.path import join
+import argparse
+import time
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    k = max(0, min(len(samples) - 1, int(round(p / 100 * len(samples))) - 1))
+    return samples[k]
+
+
+def throughput(bus, n, timeout=60):
+    received = [0]
+    done = Event()
+
+    def handler(message):
+        received[0] += 1
+        if received[0] >= n:
+            done.set()
+
+    bus.on("benchmark.dispatch", handler)
+    message = Message("benchmark.dispatch", {"utterance": "hello world",
+                                             "lang": "en-us"})
+    start = time.time()
+    for _ in range(n):
+        bus.emit(message)
+    done.wait(timeout)
+    elapsed = time.time() - start
+    bus.remove("benchmark.dispatch", handler)
+    return received[0] / elapsed if elapsed else float("inf")
+
+
+def roundtrips(bus, responder, n):
+    responder.on("benchmark.ping",
+                 lambda m: responder.emit(m.response({"pong": True})))
+    latencies = []
+    for _ in range(n):
+        start = time.time()
+        if bus.wait_for_response(Message("benchmark.ping"),
+                                 "benchmark.ping.response", 5):
+            latencies.append(time.time() - start)
+    responder.remove_all_listeners("benchmark.ping")
+    return latencies
+
+
+def run(connect, messages, n_roundtrips):
+    bus = connect()
+    responder = connect()
+    cpu = time.process_time()
+    rate = throughput(bus, messages)
+    latencies = roundtrips(bus, responder, n_roundtrips)
+    cpu = time.process_time() - cpu
+    bus.close()
+    responder.close()
+    return {"msg/s": rate,
+            "p50 ms": percentile(latencies, 50) * 1000,
+            "p99 ms": percentile(latencies, 99) * 1000,
+            "cpu s": cpu}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--roundtrips", type=int, default=1000)
+    args = parser.parse_args()
+
+    ws_server = LocalMessageBusServer(port=0).start()
+
+    def connect_ws():
+        bus = get_websocket(ws_server.host, ws_server.port, "/core")
+        bus.connected_event.wait(5)
+        return bus
+
+    unix_server = UnixMessageBusServer(join(mkdtemp(), "bus.sock")).start()
+
+    def connect_unix():
+        bus = get_unix_bus(unix_server.path)
+        bus.connected_event.wait(5)
+        return bus
+
+    try:
+        results = {"websocket": run(connect_ws, args.messages,
+                                    args.roundtrips),
+                   "unix": run(connect_unix, args.messages,
+                               args.roundtrips)}
+    finally:
+        ws_server.stop()
+        unix_server.stop()
+
+    columns = ["msg/s", "p50 ms", "p99 ms", "cpu s"]
+    print("{:<10}".format("transport") +
+          "".join("{:>12}".format(c) for c in columns))
+    for name, r in results.items():
+        print("{:<10}".format(name) +
+              "".join("{:>12.2f}".format(r[c]) for c in columns))
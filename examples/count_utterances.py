@@ -1,9 +1,10 @@
-from ovos_utils.messagebus import listen_for_message
+from ovos_utils.messagebus import listen_for_message, get_topic_router
 from ovos_utils.log import LOG
 from ovos_utils import wait_for_exit_signal
 
 heard = 0
 spoken = 0
+audio_events = 0
 
 
 def handle_speak(message):
@@ -18,12 +19,22 @@ def handle_hear(message):
     LOG.info("Mycroft responded to {n} sentences since start".format(n=heard))
 
 
+def handle_audio_event(message):
+    # every recognizer_loop:* message, record_begin, record_end, sleep ...
+    global audio_events
+    audio_events += 1
+    LOG.info("{t} - {n} audio events since start".format(
+        t=message.msg_type, n=audio_events))
+
+
 bus = listen_for_message("speak", handle_speak)
-listen_for_message("recognize_loop:utterance", handle_hear, bus=bus)  # re utilize bus
+listen_for_message("recognizer_loop:utterance", handle_hear, bus=bus)  # re utilize bus
+listen_for_message("recognizer_loop:*", handle_audio_event, bus=bus)  # whole namespace
 
 wait_for_exit_signal()  # wait for ctrl+c
 
 # cleanup is a good practice!
 bus.remove_all_listeners("speak")
-bus.remove_all_listeners("recognize_loop:utterance")
+bus.remove_all_listeners("recognizer_loop:utterance")
+get_topic_router(bus).shutdown()
 bus.close()
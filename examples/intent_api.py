@@ -20,6 +20,11 @@ pprint(intents.get_intent("who are you"))  # intent that will trigger
 # skill from utterance
 pprint(intents.get_skill("who are you"))
 
+# many utterances at once, up to 16 queries in flight
+pprint(intents.get_skills(["who are you", "what time is it",
+                           "tell me a joke"], concurrency=16))
+pprint(intents.last_batch_stats)
+
 # registered intents
 pprint(intents.get_adapt_manifest())
 pprint(intents.get_padatious_manifest())
@@ -30,3 +35,6 @@ pprint(intents.get_entities_manifest())  # padatious entities / .entity files
 pprint(intents.get_vocab_manifest())  # adapt vocab / .voc files
 pprint(intents.get_regex_manifest())  # adapt regex / .rx files
 pprint(intents.get_keywords_manifest())  # all of the above
+
+# everything, queried concurrently, cached until skills change
+pprint(intents.get_manifests())
@@ -1,6 +1,7 @@
 import time
 from ovos_utils.log import LOG
 from ovos_utils.messagebus import get_mycroft_bus
+from ovos_utils.messagebus.topics import get_topic_router
 
 
 class EnclosureTemplate:
@@ -10,114 +11,92 @@ class EnclosureTemplate:
     can be sent to a Mycroft enclosure implementation.
     """
 
-    def __init__(self, bus=None, name=""):
+    def __init__(self, bus=None, name="", dispatcher=None):
+        """
+        args:
+            bus: messagebus connection, defaults to get_mycroft_bus()
+            name (str): enclosure name
+            dispatcher (BusDispatcher): optional, run the handlers on its
+                                        thread pool instead of the bus
+                                        receive thread
+        """
         self._mouth_events = False
         self._running = False
         self.bus = bus or get_mycroft_bus()
+        self.dispatcher = dispatcher
+        self.router = get_topic_router(self.bus)
         self.log = LOG
         self.name = name
 
-        self.bus.on("enclosure.reset", self.on_reset)
+        self.add_event("enclosure.reset", self.on_reset)
 
         # enclosure commands for Mycroft's Hardware.
-        self.bus.on("enclosure.system.reset", self.on_system_reset)
-        self.bus.on("enclosure.system.mute", self.on_system_mute)
-        self.bus.on("enclosure.system.unmute", self.on_system_unmute)
-        self.bus.on("enclosure.system.blink", self.on_system_blink)
+        self.add_event("enclosure.system.reset", self.on_system_reset)
+        self.add_event("enclosure.system.mute", self.on_system_mute)
+        self.add_event("enclosure.system.unmute", self.on_system_unmute)
+        self.add_event("enclosure.system.blink", self.on_system_blink)
 
         # enclosure commands for eyes
-        self.bus.on('enclosure.eyes.on', self.on_eyes_on)
-        self.bus.on('enclosure.eyes.off', self.on_eyes_off)
-        self.bus.on('enclosure.eyes.blink', self.on_eyes_blink)
-        self.bus.on('enclosure.eyes.narrow', self.on_eyes_narrow)
-        self.bus.on('enclosure.eyes.look', self.on_eyes_look)
-        self.bus.on('enclosure.eyes.color', self.on_eyes_color)
-        self.bus.on('enclosure.eyes.level', self.on_eyes_brightness)
-        self.bus.on('enclosure.eyes.volume', self.on_eyes_volume)
-        self.bus.on('enclosure.eyes.spin', self.on_eyes_spin)
-        self.bus.on('enclosure.eyes.timedspin', self.on_eyes_timed_spin)
-        self.bus.on('enclosure.eyes.reset', self.on_eyes_reset)
-        self.bus.on('enclosure.eyes.setpixel', self.on_eyes_set_pixel)
-        self.bus.on('enclosure.eyes.fill', self.on_eyes_fill)
+        self.add_event('enclosure.eyes.on', self.on_eyes_on)
+        self.add_event('enclosure.eyes.off', self.on_eyes_off)
+        self.add_event('enclosure.eyes.blink', self.on_eyes_blink)
+        self.add_event('enclosure.eyes.narrow', self.on_eyes_narrow)
+        self.add_event('enclosure.eyes.look', self.on_eyes_look)
+        self.add_event('enclosure.eyes.color', self.on_eyes_color)
+        self.add_event('enclosure.eyes.level', self.on_eyes_brightness)
+        self.add_event('enclosure.eyes.volume', self.on_eyes_volume)
+        self.add_event('enclosure.eyes.spin', self.on_eyes_spin)
+        self.add_event('enclosure.eyes.timedspin', self.on_eyes_timed_spin)
+        self.add_event('enclosure.eyes.reset', self.on_eyes_reset)
+        self.add_event('enclosure.eyes.setpixel', self.on_eyes_set_pixel)
+        self.add_event('enclosure.eyes.fill', self.on_eyes_fill)
 
         # enclosure commands for mouth
-        self.bus.on("enclosure.mouth.events.activate",
-                    self._activate_mouth_events)
-        self.bus.on("enclosure.mouth.events.deactivate",
-                    self._deactivate_mouth_events)
-        self.bus.on("enclosure.mouth.talk", self._on_mouth_talk)
-        self.bus.on("enclosure.mouth.think", self._on_mouth_think)
-        self.bus.on("enclosure.mouth.listen", self._on_mouth_listen)
-        self.bus.on("enclosure.mouth.smile", self._on_mouth_smile)
-        self.bus.on("enclosure.mouth.viseme", self._on_mouth_viseme)
+        self.add_event("enclosure.mouth.events.activate",
+                       self._activate_mouth_events)
+        self.add_event("enclosure.mouth.events.deactivate",
+                       self._deactivate_mouth_events)
+        self.add_event("enclosure.mouth.talk", self._on_mouth_talk)
+        self.add_event("enclosure.mouth.think", self._on_mouth_think)
+        self.add_event("enclosure.mouth.listen", self._on_mouth_listen)
+        self.add_event("enclosure.mouth.smile", self._on_mouth_smile)
+        self.add_event("enclosure.mouth.viseme", self._on_mouth_viseme)
         # mouth/matrix display
-        self.bus.on("enclosure.mouth.reset", self.on_display_reset)
-        self.bus.on("enclosure.mouth.text", self.on_text)
-        self.bus.on("enclosure.mouth.display", self.on_display)
-        self.bus.on("enclosure.weather.display", self.on_weather_display)
+        self.add_event("enclosure.mouth.reset", self.on_display_reset)
+        self.add_event("enclosure.mouth.text", self.on_text)
+        self.add_event("enclosure.mouth.display", self.on_display)
+        self.add_event("enclosure.weather.display", self.on_weather_display)
 
         # audio events
-        self.bus.on('recognizer_loop:record_begin', self.on_record_begin)
-        self.bus.on('recognizer_loop:record_end', self.on_record_end)
-        self.bus.on("recognizer_loop:sleep", self.on_sleep)
-        self.bus.on('recognizer_loop:audio_output_start',
-                    self.on_audio_output_start)
-        self.bus.on('recognizer_loop:audio_output_end',
-                    self.on_audio_output_end)
+        self.add_event('recognizer_loop:record_begin', self.on_record_begin)
+        self.add_event('recognizer_loop:record_end', self.on_record_end)
+        self.add_event("recognizer_loop:sleep", self.on_sleep)
+        self.add_event('recognizer_loop:audio_output_start',
+                       self.on_audio_output_start)
+        self.add_event('recognizer_loop:audio_output_end',
+                       self.on_audio_output_end)
 
         # other events
-        self.bus.on("mycroft.awoken", self.on_awake)
-        self.bus.on("speak", self.on_speak)
-        self.bus.on("enclosure.notify.no_internet", self.on_no_internet)
+        self.add_event("mycroft.awoken", self.on_awake)
+        self.add_event("speak", self.on_speak)
+        self.add_event("enclosure.notify.no_internet", self.on_no_internet)
 
         self._activate_mouth_events()
 
-    def shutdown(self):
+    def add_event(self, msg_type, handler):
+        """ listen for msg_type, removed again on shutdown
+
+        msg_type can be a wildcard pattern, eg. "enclosure.eyes.*"
         """
+        if self.dispatcher is not None:
+            handler = self.dispatcher.wrap(msg_type, handler)
+        self.router.subscribe(msg_type, handler, owner=self)
 
+    def shutdown(self):
+        """
+        remove all event handlers and stop the enclosure
         """
-        self.bus.remove("enclosure.reset", self.on_reset)
-        self.bus.remove("enclosure.system.reset", self.on_system_reset)
-        self.bus.remove("enclosure.system.mute", self.on_system_mute)
-        self.bus.remove("enclosure.system.unmute", self.on_system_unmute)
-        self.bus.remove("enclosure.system.blink", self.on_system_blink)
-
-        self.bus.remove("enclosure.eyes.on", self.on_eyes_on)
-        self.bus.remove("enclosure.eyes.off", self.on_eyes_off)
-        self.bus.remove("enclosure.eyes.blink", self.on_eyes_blink)
-        self.bus.remove("enclosure.eyes.narrow", self.on_eyes_narrow)
-        self.bus.remove("enclosure.eyes.look", self.on_eyes_look)
-        self.bus.remove("enclosure.eyes.color", self.on_eyes_color)
-        self.bus.remove("enclosure.eyes.brightness", self.on_eyes_brightness)
-        self.bus.remove("enclosure.eyes.reset", self.on_eyes_reset)
-        self.bus.remove("enclosure.eyes.timedspin", self.on_eyes_timed_spin)
-        self.bus.remove("enclosure.eyes.volume", self.on_eyes_volume)
-        self.bus.remove("enclosure.eyes.spin", self.on_eyes_spin)
-        self.bus.remove("enclosure.eyes.set_pixel", self.on_eyes_set_pixel)
-
-        self.bus.remove("enclosure.mouth.reset", self.on_display_reset)
-        self.bus.remove("enclosure.mouth.talk", self.on_talk)
-        self.bus.remove("enclosure.mouth.think", self.on_think)
-        self.bus.remove("enclosure.mouth.listen", self.on_listen)
-        self.bus.remove("enclosure.mouth.smile", self.on_smile)
-        self.bus.remove("enclosure.mouth.viseme", self.on_viseme)
-        self.bus.remove("enclosure.mouth.text", self.on_text)
-        self.bus.remove("enclosure.mouth.display", self.on_display)
-        self.bus.remove("enclosure.mouth.events.activate",
-                        self._activate_mouth_events)
-        self.bus.remove("enclosure.mouth.events.deactivate",
-                        self._deactivate_mouth_events)
-
-        self.bus.remove("enclosure.weather.display", self.on_weather_display)
-
-        self.bus.remove("mycroft.awoken", self.on_awake)
-        self.bus.remove("recognizer_loop:sleep", self.on_sleep)
-        self.bus.remove("speak", self.on_speak)
-        self.bus.remove('recognizer_loop:record_begin', self.on_record_begin)
-        self.bus.remove('recognizer_loop:record_end', self.on_record_end)
-        self.bus.remove('recognizer_loop:audio_output_start',
-                        self.on_audio_output_start)
-        self.bus.remove("enclosure.notify.no_internet", self.on_no_internet)
+        self.router.unsubscribe_owner(self)
 
         self._deactivate_mouth_events()
         self._running = False
@@ -1,17 +1,155 @@
+from collections import OrderedDict
+from functools import partial
+from queue import Empty, Full, Queue
+from threading import Lock
+from weakref import WeakKeyDictionary, proxy
+from ovos_utils import create_daemon
 from ovos_utils.log import LOG
-from ovos_utils.messagebus import get_mycroft_bus, Message
+from ovos_utils.intents.active_skills import ActiveSkillTracker
+from ovos_utils.intents.entities import get_entity_cache
+from ovos_utils.messagebus import get_mycroft_bus, Message, ReplyRouter
+from ovos_utils.messagebus.cache import SingleFlightCache
 import time
-from os.path import isfile
+
+# manifest: (query, reply), the vocab manifest has both vocab and regex
+_MANIFESTS = {
+    "skills": ("intent.service.skills.get", "intent.service.skills.reply"),
+    "adapt": ("intent.service.adapt.manifest.get",
+              "intent.service.adapt.manifest"),
+    "padatious": ("intent.service.padatious.manifest.get",
+                  "intent.service.padatious.manifest"),
+    "vocab": ("intent.service.adapt.vocab.manifest.get",
+              "intent.service.adapt.vocab.manifest"),
+    "entities": ("intent.service.padatious.entities.manifest.get",
+                 "intent.service.padatious.entities.manifest")
+}
+
+# bus event: manifests it makes outdated
+_INVALIDATED_BY = {
+    "mycroft.skills.loaded": list(_MANIFESTS),
+    "mycroft.skills.shutdown": list(_MANIFESTS),
+    "detach_skill": list(_MANIFESTS),
+    "register_intent": ["adapt"],
+    "register_vocab": ["vocab"],
+    "detach_intent": ["adapt", "padatious"],
+    "padatious:register_intent": ["padatious"],
+    "padatious:register_entity": ["entities"]
+}
+
+_manifest_caches = WeakKeyDictionary()  # bus: _ManifestCaches
+_manifest_caches_lock = Lock()
+
+
+def _query_manifest(bus, timeout, name):
+    query, reply = _MANIFESTS[name]
+    msg = Message(query, context={"destination": "intent_service",
+                                  "source": "intent_api"})
+    resp = bus.wait_for_response(msg, reply, timeout=timeout)
+    data = resp.data if resp is not None else {}
+    if not data:
+        raise TimeoutError("Intent Service timed out!")
+    return data
+
+
+class _ManifestCaches:
+    """ manifest caches of a bus connection, one per (cache_ttl, timeout)
+    and shared by every IntentQueryApi using them, the invalidating events
+    are subscribed to once for all of them """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self._caches = {}
+        self._lock = Lock()
+        for msg_type in _INVALIDATED_BY:
+            self.bus.on(msg_type, self._invalidate)
+
+    def get(self, cache_ttl, timeout):
+        with self._lock:
+            cache = self._caches.get((cache_ttl, timeout))
+            if cache is None:
+                cache = self._caches[(cache_ttl, timeout)] = \
+                    SingleFlightCache(partial(_query_manifest, self.bus,
+                                              timeout), cache_ttl)
+            return cache
+
+    def _invalidate(self, message):
+        with self._lock:
+            caches = list(self._caches.values())
+        for cache in caches:
+            for name in _INVALIDATED_BY.get(message.msg_type, []):
+                cache.invalidate(name)
+
+
+def _get_manifest_cache(bus, cache_ttl, timeout):
+    with _manifest_caches_lock:
+        caches = _manifest_caches.get(bus)
+        if caches is None:
+            # a proxy, a strong reference would keep the key alive forever
+            caches = _manifest_caches[bus] = _ManifestCaches(proxy(bus))
+        return caches.get(cache_ttl, timeout)
 
 
 class IntentQueryApi:
     """
     Query Intent Service at runtime
+
+    the get_*_intents / get_skills variants resolve many utterances at
+    once, keeping up to concurrency queries in flight instead of waiting
+    for every reply before sending the next query
+
+        api = IntentQueryApi()
+        intents = api.get_intents(["what time is it", "tell me a joke"],
+                                  concurrency=16)
+        print(api.last_batch_stats["throughput"])
+
+    manifests are cached for cache_ttl seconds and dropped as soon as a
+    skill loads, unloads or registers intents / vocab on the bus, calls
+    needing several manifests fetch them concurrently and concurrent calls
+    share one query. Instances on the same bus with the same cache_ttl and
+    timeout share their cache. cache_ttl=0 queries every time
     """
 
-    def __init__(self, bus=None, timeout=5):
+    def __init__(self, bus=None, timeout=5, cache_ttl=300):
         self.bus = bus or get_mycroft_bus()
         self.timeout = timeout
+        self.last_batch_stats = None
+        self._router = None
+        self.manifests = _get_manifest_cache(self.bus, cache_ttl, timeout)
+
+    def shutdown(self):
+        """ stop listening for batch query replies """
+        if self._router is not None:
+            self._router.shutdown()
+
+    # manifests
+    def _fetch(self, *names):
+        """ {name: manifest data}, the ones not cached are queried
+        concurrently """
+        data = {}
+
+        def load(name):
+            data[name] = self.manifests.get(name)
+
+        threads = [create_daemon(load, (name,)) for name in names[1:]]
+        load(names[0])
+        for t in threads:
+            t.join()
+        return data
+
+    def get_manifests(self):
+        """ snapshot of every manifest, all queried at the same time """
+        data = self._fetch(*_MANIFESTS)
+        return {"skills": self._field(data["skills"], "skills"),
+                "intents": {"adapt": self._field(data["adapt"], "intents"),
+                            "padatious": self._field(data["padatious"],
+                                                     "intents")},
+                "keywords": {"adapt": self._vocab(data["vocab"]),
+                             "padatious": self._entities(data["entities"]),
+                             "regex": self._regexes(data["vocab"])}}
+
+    @staticmethod
+    def _field(data, key):
+        return data[key] if data else None
 
     def get_adapt_intent(self, utterance, lang="en-us"):
         """ get best adapt intent for utterance """
@@ -61,7 +199,10 @@ class IntentQueryApi:
 
     def get_skill(self, utterance, lang="en-us"):
         """ get skill that utterance will trigger """
-        intent = self.get_intent(utterance, lang)
+        return self._skill_from_intent(self.get_intent(utterance, lang))
+
+    @staticmethod
+    def _skill_from_intent(intent):
         if not intent:
             return None
         # theoretically skill_id might be missing
@@ -74,18 +215,109 @@ class IntentQueryApi:
             return intent["intent_type"].split(":")[0]
         return None  # raise some error here maybe? this should never happen
 
+    # batch queries
+    def _batch(self, msg_type, reply_type, utterances, lang, concurrency,
+               timeout):
+        """ send one query per utterance, returns the reply data of each
+        (None if it timed out) in input order """
+        if self._router is None:
+            self._router = ReplyRouter(self.bus)
+        timeout = self.timeout if timeout is None else timeout
+        concurrency = max(1, concurrency)
+        results = [None] * len(utterances)
+        in_flight = OrderedDict()  # index: PendingReply, oldest first
+        completed = Queue()  # indexes of answered requests
+        latencies = []
+        timeouts = 0
+        start = time.time()
+        todo = iter(enumerate(utterances))
+        done = False
+        while True:
+            while not done and len(in_flight) < concurrency:
+                item = next(todo, None)
+                if item is None:
+                    done = True
+                    break
+                idx, utterance = item
+                msg = Message(msg_type, {"utterance": utterance,
+                                         "lang": lang},
+                              context={"destination": "intent_service",
+                                       "source": "intent_api"})
+                pending = self._router.request(msg, reply_type)
+                in_flight[idx] = pending
+                pending.add_done_callback(
+                    lambda p, idx=idx: completed.put(idx))
+            if not in_flight:
+                break
+            # a slot is freed by the first reply, or by the oldest request
+            # expiring, a lost reply does not hold back the others
+            oldest_idx, oldest = next(iter(in_flight.items()))
+            try:
+                idx = completed.get(timeout=max(
+                    0.0, oldest.sent_at + timeout - time.time()))
+            except Empty:
+                in_flight.pop(oldest_idx)
+                self._router.cancel(oldest)
+                timeouts += 1
+                continue
+            pending = in_flight.pop(idx, None)
+            if pending is None:
+                continue  # answered after it expired
+            results[idx] = pending.response.data
+            latencies.append(pending.latency)
+        elapsed = time.time() - start
+        self.last_batch_stats = {
+            "requests": len(utterances),
+            "answered": len(latencies),
+            "timeouts": timeouts,
+            "elapsed": elapsed,
+            "throughput": len(latencies) / elapsed if elapsed else 0.0,
+            "latency_avg": sum(latencies) / len(latencies)
+            if latencies else 0.0,
+            "latency_max": max(latencies) if latencies else 0.0}
+        if timeouts:
+            LOG.error("Intent Service timed out for {n} of {t} "
+                      "utterances!".format(n=timeouts, t=len(utterances)))
+        return results
+
+    def _batch_intents(self, msg_type, reply_type, utterances, lang,
+                       concurrency, timeout):
+        return [data.get("intent") if data else None
+                for data in self._batch(msg_type, reply_type, utterances,
+                                        lang, concurrency, timeout)]
+
+    def get_adapt_intents(self, utterances, lang="en-us", concurrency=8,
+                          timeout=None):
+        """ best adapt intent of each utterance, None where the intent
+        service did not answer within timeout seconds """
+        return self._batch_intents("intent.service.adapt.get",
+                                   "intent.service.adapt.reply",
+                                   utterances, lang, concurrency, timeout)
+
+    def get_padatious_intents(self, utterances, lang="en-us", concurrency=8,
+                              timeout=None):
+        """ best padatious intent of each utterance, None where the intent
+        service did not answer within timeout seconds """
+        return self._batch_intents("intent.service.padatious.get",
+                                   "intent.service.padatious.reply",
+                                   utterances, lang, concurrency, timeout)
+
+    def get_intents(self, utterances, lang="en-us", concurrency=8,
+                    timeout=None):
+        """ best intent of each utterance, None where the intent service
+        did not answer within timeout seconds """
+        return self._batch_intents("intent.service.intent.get",
+                                   "intent.service.intent.reply",
+                                   utterances, lang, concurrency, timeout)
+
+    def get_skills(self, utterances, lang="en-us", concurrency=8,
+                   timeout=None):
+        """ skill each utterance will trigger """
+        return [self._skill_from_intent(intent) for intent in
+                self.get_intents(utterances, lang, concurrency, timeout)]
+
     def get_skills_manifest(self):
-        msg = Message("intent.service.skills.get",
-                      context={"destination": "intent_service",
-                               "source": "intent_api"})
-        resp = self.bus.wait_for_response(msg,
-                                          'intent.service.skills.reply',
-                                          timeout=self.timeout)
-        data = resp.data if resp is not None else {}
-        if not data:
-            LOG.error("Intent Service timed out!")
-            return None
-        return data["skills"]
+        return self._field(self.manifests.get("skills"), "skills")
 
     def get_active_skills(self, include_timestamps=False):
         msg = Message("intent.service.active_skills.get",
@@ -106,48 +338,22 @@ class IntentQueryApi:
         return [s[0] for s in data["skills"]]
 
     def get_adapt_manifest(self):
-        msg = Message("intent.service.adapt.manifest.get",
-                      context={"destination": "intent_service",
-                               "source": "intent_api"})
-        resp = self.bus.wait_for_response(msg,
-                                          'intent.service.adapt.manifest',
-                                          timeout=self.timeout)
-        data = resp.data if resp is not None else {}
-        if not data:
-            LOG.error("Intent Service timed out!")
-            return None
-        return data["intents"]
+        return self._field(self.manifests.get("adapt"), "intents")
 
     def get_padatious_manifest(self):
-        msg = Message("intent.service.padatious.manifest.get",
-                      context={"destination": "intent_service",
-                               "source": "intent_api"})
-        resp = self.bus.wait_for_response(msg,
-                                          'intent.service.padatious.manifest',
-                                          timeout=self.timeout)
-        data = resp.data if resp is not None else {}
-        if not data:
-            LOG.error("Intent Service timed out!")
-            return None
-        return data["intents"]
+        return self._field(self.manifests.get("padatious"), "intents")
 
     def get_intent_manifest(self):
-        padatious = self.get_padatious_manifest()
-        adapt = self.get_adapt_manifest()
-        return {"adapt": adapt,
-                "padatious": padatious}
+        data = self._fetch("padatious", "adapt")
+        return {"adapt": self._field(data["adapt"], "intents"),
+                "padatious": self._field(data["padatious"], "intents")}
 
     def get_vocab_manifest(self):
-        msg = Message("intent.service.adapt.vocab.manifest.get",
-                      context={"destination": "intent_service",
-                               "source": "intent_api"})
-        reply_msg_type = 'intent.service.adapt.vocab.manifest'
-        resp = self.bus.wait_for_response(msg,
-                                          reply_msg_type,
-                                          timeout=self.timeout)
-        data = resp.data if resp is not None else {}
+        return self._vocab(self.manifests.get("vocab"))
+
+    @staticmethod
+    def _vocab(data):
         if not data:
-            LOG.error("Intent Service timed out!")
             return None
 
         vocab = {}
@@ -161,16 +367,11 @@ class IntentQueryApi:
                 for voc in vocab]
 
     def get_regex_manifest(self):
-        msg = Message("intent.service.adapt.vocab.manifest.get",
-                      context={"destination": "intent_service",
-                               "source": "intent_api"})
-        reply_msg_type = 'intent.service.adapt.vocab.manifest'
-        resp = self.bus.wait_for_response(msg,
-                                          reply_msg_type,
-                                          timeout=self.timeout)
-        data = resp.data if resp is not None else {}
+        return self._regexes(self.manifests.get("vocab"))
+
+    @staticmethod
+    def _regexes(data):
         if not data:
-            LOG.error("Intent Service timed out!")
             return None
 
         vocab = {}
@@ -185,52 +386,69 @@ class IntentQueryApi:
                 for voc in vocab]
 
     def get_entities_manifest(self):
-        msg = Message("intent.service.padatious.entities.manifest.get",
-                      context={"destination": "intent_service",
-                               "source": "intent_api"})
-        reply_msg_type = 'intent.service.padatious.entities.manifest'
-        resp = self.bus.wait_for_response(msg,
-                                          reply_msg_type,
-                                          timeout=self.timeout)
-        data = resp.data if resp is not None else {}
+        return self._entities(self.manifests.get("entities"))
+
+    @staticmethod
+    def _entities(data):
         if not data:
-            LOG.error("Intent Service timed out!")
             return None
 
-        entities = []
-        # read files
-        for ent in data["entities"]:
-            if isfile(ent["file_name"]):
-                with open(ent["file_name"]) as f:
-                    lines = f.read().replace("(", "").replace(")", "").split(
-                        "\n")
-                samples = []
-                for l in lines:
-                    samples += [a.strip() for a in l.split("|") if a.strip()]
-                entities.append({"name": ent["name"], "samples": samples})
-        return entities
+        # files are only parsed again when they changed
+        files = get_entity_cache().get_many(ent["file_name"]
+                                            for ent in data["entities"])
+        return [{"name": ent["name"], "samples": files[ent["file_name"]]}
+                for ent in data["entities"] if ent["file_name"] in files]
 
     def get_keywords_manifest(self):
-        padatious = self.get_entities_manifest()
-        adapt = self.get_vocab_manifest()
-        regex = self.get_regex_manifest()
-        return {"adapt": adapt,
-                "padatious": padatious,
-                "regex": regex}
+        # vocab and regex come from the same query
+        data = self._fetch("entities", "vocab")
+        return {"adapt": self._vocab(data["vocab"]),
+                "padatious": self._entities(data["entities"]),
+                "regex": self._regexes(data["vocab"])}
+
+
+class _ConverseTrackerMeta(type):
+    # ConverseTracker.active_skills used to be a plain list
+
+    @property
+    def active_skills(cls):
+        """ [[skill_id, ts], ...] most recent first """
+        return cls.tracker.active_skills
 
+    @active_skills.setter
+    def active_skills(cls, skills):
+        cls.tracker.replace(skills)
 
-class ConverseTracker:
+
+class ConverseTracker(metaclass=_ConverseTrackerMeta):
     """ Using the messagebus this class recreates/keeps track of the state
     of the converse system, it uses both passive listening and active
     queries to sync it's state, it also emits 2 new bus events
 
     Implements https://github.com/MycroftAI/mycroft-core/pull/1468
+
+    the state lives in an ActiveSkillTracker, use one directly to track
+    several buses in the same process
+
+    utterances are attributed to skills on attribution_workers background
+    threads, the bus receive thread never waits for the intent service.
+    Results are remembered for attribution_ttl seconds per (utterance,
+    lang) and applied in utterance order
     """
     bus = None
-    active_skills = []
     converse_timeout = 5  # MAGIC NUMBER  hard coded in mycroft-core
     last_conversed = None
     intent_api = None
+    tracker = ActiveSkillTracker(converse_timeout * 60)
+    # emit "converse.skill.deactivated" when the timer expires a skill
+    emit_expired = False
+    attribution_ttl = 30
+    attribution_workers = 2
+    max_pending_attributions = 256
+    _attributions = None  # Queue of (ts, utterance, lang)
+    _memo = None  # (utterance, lang): (skill_id, expires)
+    _memo_lock = Lock()
+    _memo_size = 512
 
     @classmethod
     def connect_bus(cls, mycroft_bus):
@@ -241,8 +459,18 @@ class ConverseTracker:
         if cls.bus is None and mycroft_bus is not None:
             cls.bus = mycroft_bus
             cls.intent_api = IntentQueryApi(cls.bus)
+            cls.tracker.timeout = cls.converse_timeout * 60
+            cls.tracker.on_expire = cls.handle_skill_expired
+            cls._start_attribution()
             cls.register_bus_events()
 
+    @classmethod
+    def _start_attribution(cls):
+        cls._memo = OrderedDict()
+        cls._attributions = Queue(maxsize=cls.max_pending_attributions)
+        for _ in range(cls.attribution_workers):
+            create_daemon(cls._attribution_loop)
+
     @classmethod
     def register_bus_events(cls):
         cls.bus.on('active_skill_request', cls.handle_activate_request)
@@ -254,19 +482,21 @@ class ConverseTracker:
     @classmethod
     def check_skill(cls, skill_id):
         """ Check if a skill is active """
-        cls.filter_active_skills()
-        for skill in list(cls.active_skills):
-            if skill[0] == skill_id:
-                return True
-        return False
+        return cls.tracker.check(skill_id)
 
     @classmethod
     def filter_active_skills(cls):
-        """ Removes expired skills from active skill list """
-        # filter timestamps
-        for skill in list(cls.active_skills):
-            if time.time() - skill[1] <= cls.converse_timeout * 60:
-                cls.remove_active_skill(skill[0])
+        """ Removes expired skills from active skill list
+
+        skills also expire on their own, with a timer, silently unless
+        emit_expired is set
+        """
+        expired = cls.tracker.expire()
+        if not cls.emit_expired:
+            # handle_skill_expired did not announce them
+            for skill_id in expired:
+                cls.bus.emit(Message("converse.skill.deactivated",
+                                     {"skill_id": skill_id}))
 
     @classmethod
     def sync_with_intent_service(cls):
@@ -281,7 +511,7 @@ class ConverseTracker:
         if skill_ids:
             if len(skill_ids[0]) == 2:
                 # PR was merged! hurray!
-                cls.active_skills = skill_ids
+                cls.tracker.replace(skill_ids)
             else:
                 # hoping they come sorted by timestamp....
                 # older to newer (most recently used)
@@ -290,7 +520,7 @@ class ConverseTracker:
                     if not cls.check_skill(skill_id):
                         # we missed adding this skill in our tracking
                         cls.add_active_skill(skill_id)
-                for skill in cls.active_skills:
+                for skill in cls.tracker.active_skills:
                     if skill[0] not in skill_ids:
                         # we missed removing this skill in our tracking
                         cls.remove_active_skill(skill[0])
@@ -301,24 +531,22 @@ class ConverseTracker:
         """
         Emits "converse.skill.deactivated" event, improvement of #1468
         """
-        for skill in list(cls.active_skills):
-            if skill[0] == skill_id:
-                cls.active_skills.remove(skill)
-                if not silent:
-                    cls.bus.emit(Message("converse.skill.deactivated",
-                                         {"skill_id": skill[0]}))
+        if cls.tracker.remove(skill_id) and not silent:
+            cls.bus.emit(Message("converse.skill.deactivated",
+                                 {"skill_id": skill_id}))
 
     @classmethod
-    def add_active_skill(cls, skill_id):
+    def add_active_skill(cls, skill_id, ts=None):
         """
         Emits "converse.skill.activated" event, improvement of #1468
+
+        ts is when the skill became active, default now, nothing happens
+        if the skill was already activated later than that
         """
-        # search the list for an existing entry that already contains it
-        # and remove that reference
         if skill_id != '':
-            cls.remove_active_skill(skill_id, silent=True)
-            # add skill with timestamp to start of skill_list
-            cls.active_skills.insert(0, [skill_id, time.time()])
+            # moves an existing entry to the start of the list
+            if not cls.tracker.add(skill_id, ts):
+                return
             # this might be sent more than once and it's perfectly fine
             # it's just a new info message not consumed anywhere by default
             cls.bus.emit(Message("converse.skill.activated",
@@ -327,6 +555,13 @@ class ConverseTracker:
             LOG.warning('Skill ID was empty, won\'t add to list of '
                         'active skills.')
 
+    @classmethod
+    def handle_skill_expired(cls, skill_id):
+        """ converse_timeout passed since the skill was last active """
+        if cls.emit_expired:
+            cls.bus.emit(Message("converse.skill.deactivated",
+                                 {"skill_id": skill_id}))
+
     # status tracking
     @classmethod
     def handle_activate_request(cls, message):
@@ -376,12 +611,54 @@ class ConverseTracker:
         """
         # NOTE borked in mycroft-core
         # needs https://github.com/MycroftAI/mycroft-core/pull/2786
-        skill_id = cls.intent_api.get_skill(message.data["utterances"][0])
+        utterances = message.data.get("utterances") or []
+        if not utterances:
+            return
+        # the intent service may take seconds to answer, never wait for it
+        # on the bus thread
+        item = (time.time(), utterances[0],
+                message.data.get("lang") or "en-us")
+        try:
+            cls._attributions.put_nowait(item)
+        except Full:
+            # handle_converse_response corrects the list later
+            LOG.warning("too many utterances waiting for attribution, "
+                        "skipping: " + utterances[0])
+
+    @classmethod
+    def _attribution_loop(cls):
+        while True:
+            ts, utterance, lang = cls._attributions.get()
+            try:
+                cls.attribute_utterance(utterance, lang, ts)
+            except Exception as e:
+                LOG.error("could not attribute utterance: " + str(e))
+
+    @classmethod
+    def attribute_utterance(cls, utterance, lang="en-us", ts=None):
+        """ mark the skill utterance (said at ts) triggers as active,
+        returns its skill_id """
+        key = (utterance, lang)
+        now = time.time()
+        with cls._memo_lock:
+            cached = cls._memo.get(key) if cls._memo is not None else None
+        if cached is not None and cached[1] > now:
+            skill_id = cached[0]
+        else:
+            skill_id = cls.intent_api.get_skill(utterance, lang)
+            if skill_id and cls._memo is not None:
+                with cls._memo_lock:
+                    cls._memo[key] = (skill_id, now + cls.attribution_ttl)
+                    cls._memo.move_to_end(key)
+                    while len(cls._memo) > cls._memo_size:
+                        cls._memo.popitem(last=False)
         if skill_id:
             # this skill will trigger and therefore is the last active skill
-            cls.add_active_skill(skill_id)
+            # older utterances finishing late do not reorder the list
+            cls.add_active_skill(skill_id, ts)
         # will remove expired intents from list
         cls.filter_active_skills()
+        return skill_id
 
     @classmethod
     def handle_converse_response(cls, message):
@@ -410,9 +687,7 @@ class ConverseTracker:
             # NOTE this is a failsafe and should never trigger
             # since this answered false and we don't have the real timestamp
             # let's add it to the end of the active_skills list
-            ts = time.time()
-            if len(cls.active_skills):
-                ts = cls.active_skills[-1][1]
-            cls.active_skills.append([skill_id, ts])
+            ts = cls.tracker.oldest[1] or time.time()
+            cls.tracker.add(skill_id, ts)
 
 
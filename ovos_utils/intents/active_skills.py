@@ -0,0 +1,170 @@
+from bisect import insort
+from heapq import heapify, heappop, heappush
+from threading import Lock, Timer
+import time
+
+
+class ActiveSkillTracker:
+    """
+    active skills by recency, expiring timeout seconds after their last
+    activation
+
+    skills are kept in a dict, their activations in a list sorted by
+    time (least recent first) and their expiry times in a heap. Bumps
+    append to the list, an out of order activation is inserted with
+    bisect, entries of bumped or removed skills are skipped and dropped
+    when the list is compacted. Expiry is O(log n) per expired skill, a
+    single timer removes skills as they expire, nothing is rescanned on
+    lookups
+
+        tracker = ActiveSkillTracker(timeout=300, on_expire=print)
+        tracker.add("skill-weather")
+        tracker.check("skill-weather")  # True
+        tracker.active_skills  # [["skill-weather", 1612345678.5]]
+
+    every instance is independent, eg. one per bus connection
+
+    args:
+        timeout (float): seconds a skill stays active
+        on_expire (callable): on_expire(skill_id) called from the timer
+                              thread when a skill expires
+    """
+
+    def __init__(self, timeout=300, on_expire=None):
+        self.timeout = timeout
+        self.on_expire = on_expire
+        self._skills = {}  # skill_id: activation ts
+        self._order = []  # (ts, skill_id) sorted, outdated ones skipped
+        self._heap = []  # (expires_at, skill_id, ts), outdated ones skipped
+        self._lock = Lock()
+        self._timer = None
+        self._timer_at = None
+        self._running = True
+
+    def __len__(self):
+        return len(self._skills)
+
+    def __contains__(self, skill_id):
+        return self.check(skill_id)
+
+    # queries
+    def check(self, skill_id):
+        """ is skill_id active """
+        ts = self._skills.get(skill_id)
+        return ts is not None and time.time() - ts < self.timeout
+
+    def timestamp(self, skill_id):
+        """ last activation of skill_id, None if not active """
+        return self._skills.get(skill_id)
+
+    @property
+    def active_skills(self):
+        """ [[skill_id, ts], ...] most recent first """
+        with self._lock:
+            return [[s, ts] for ts, s in reversed(self._order)
+                    if self._skills.get(s) == ts]
+
+    @property
+    def oldest(self):
+        with self._lock:
+            return next(((s, ts) for ts, s in self._order
+                         if self._skills.get(s) == ts), (None, None))
+
+    # updates
+    def add(self, skill_id, ts=None):
+        """
+        activate skill_id at ts (default now)
+
+        an older ts than the one already tracked is ignored, returns False
+        in that case
+        """
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            current = self._skills.get(skill_id)
+            if current is not None and current > ts:
+                return False
+            if current == ts:
+                return True
+            self._skills[skill_id] = ts
+            if not self._order or (ts, skill_id) >= self._order[-1]:
+                self._order.append((ts, skill_id))
+            else:
+                # out of order activation, the old entry is skipped
+                insort(self._order, (ts, skill_id))
+            expires = ts + self.timeout
+            heappush(self._heap, (expires, skill_id, ts))
+            if len(self._order) > 2 * len(self._skills) + 64:
+                self._compact()
+            self._schedule(expires)
+        return True
+
+    def remove(self, skill_id):
+        """ deactivate skill_id, returns False if it was not active """
+        with self._lock:
+            # its list and heap entries are skipped when they come up
+            return self._skills.pop(skill_id, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._skills.clear()
+            self._order = []
+            self._heap = []
+
+    def replace(self, active_skills):
+        """ replace the tracked skills with [[skill_id, ts], ...] """
+        with self._lock:
+            self._skills = {s: ts for s, ts in active_skills}
+            self._compact()
+            if self._heap:
+                self._schedule(self._heap[0][0])
+
+    # expiry
+    def _compact(self):
+        # caller holds the lock, drops entries of bumped / removed skills
+        self._order = sorted((ts, s) for s, ts in self._skills.items())
+        self._heap = [(ts + self.timeout, s, ts) for ts, s in self._order]
+        heapify(self._heap)
+
+    def expire(self, now=None):
+        """ remove expired skills, returns their ids """
+        now = time.time() if now is None else now
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, skill_id, ts = heappop(self._heap)
+                if self._skills.get(skill_id) == ts:
+                    del self._skills[skill_id]
+                    expired.append(skill_id)
+        if self.on_expire:
+            for skill_id in expired:
+                self.on_expire(skill_id)
+        return expired
+
+    def _schedule(self, at):
+        # caller holds the lock
+        if not self._running:
+            return
+        if self._timer is not None and self._timer_at <= at:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = at
+        self._timer = Timer(max(0.0, at - time.time()), self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = self._timer_at = None
+        self.expire()
+        with self._lock:
+            if self._heap:
+                self._schedule(self._heap[0][0])
+
+    def shutdown(self):
+        """ stop the expiry timer """
+        with self._lock:
+            self._running = False
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = self._timer_at = None
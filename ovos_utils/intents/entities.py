@@ -0,0 +1,113 @@
+"""
+parsed padatious .entity files
+
+    cache = get_entity_cache()
+    samples = cache.get("/opt/mycroft/skills/weather/locale/en-us/city.entity")
+    by_path = cache.get_many(paths)  # parsed concurrently
+
+files are parsed once and kept until their mtime or size changes
+"""
+from concurrent.futures import ThreadPoolExecutor
+from os import stat
+from threading import Lock
+
+_PARENS = str.maketrans("", "", "()")
+_cache = None
+_cache_lock = Lock()
+
+
+def parse_entity_file(path):
+    """ samples of a .entity file, one line at a time so big files are
+    never fully loaded, "(a|b)" alternatives become separate samples """
+    samples = []
+    with open(path) as f:
+        for line in f:
+            for sample in line.translate(_PARENS).split("|"):
+                sample = sample.strip()
+                if sample:
+                    samples.append(sample)
+    return samples
+
+
+class EntityFileCache:
+    """
+    parsed samples of entity files keyed by (path, mtime, size)
+
+    get() stats the file and only parses it again when it changed,
+    get_many() parses the changed files of a list on a thread pool
+
+    args:
+        max_workers (int): threads used by get_many
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._entries = {}  # path: ((mtime, size), samples)
+        self._lock = Lock()
+        self.stats = {"hits": 0, "parsed": 0, "missing": 0}
+
+    @staticmethod
+    def _version(path):
+        try:
+            st = stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def get(self, path):
+        """ samples of the file, None if it does not exist """
+        version = self._version(path)
+        if version is None:
+            with self._lock:
+                self._entries.pop(path, None)
+                self.stats["missing"] += 1
+            return None
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == version:
+            self._count("hits")
+            return list(entry[1])
+        try:
+            samples = tuple(parse_entity_file(path))
+        except OSError:
+            # removed between stat and open
+            self._count("missing")
+            return None
+        with self._lock:
+            self._entries[path] = (version, samples)
+            self.stats["parsed"] += 1
+        return list(samples)
+
+    def get_many(self, paths):
+        """ {path: samples} for the paths that exist """
+        paths = list(paths)
+        if len(paths) < 2 or self.max_workers < 2:
+            results = [self.get(p) for p in paths]
+        else:
+            workers = min(self.max_workers, len(paths))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(self.get, paths))
+        return {p: s for p, s in zip(paths, results) if s is not None}
+
+    def invalidate(self, path=None):
+        """ forget one file, or every file """
+        with self._lock:
+            if path is None:
+                self._entries = {}
+            else:
+                self._entries.pop(path, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_entity_cache():
+    """ the process wide EntityFileCache """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EntityFileCache()
+        return _cache
@@ -1,28 +1,310 @@
 from ovos_utils.messagebus import Message, get_mycroft_bus
 from ovos_utils.log import LOG
-from time import sleep
+from collections.abc import MutableSequence
+from itertools import count
+from threading import Event, Lock
+import time
+
+# message the intent services get when a skill disables an intent
+_DETACH_ACK = "detach_intent"
+# seconds given to detach intents that can not be acknowledged
+_UNACKED_DELAY = 0.3
+
+
+class _LayerList(MutableSequence):
+    """ IntentLayers.layers, a list of the intent names of each layer,
+    changes go through the IntentLayers so its index stays in sync """
+
+    def __init__(self, layers):
+        self._layers = layers
+
+    def __len__(self):
+        return len(self._layers._ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._layers._intents[self._layers._ids[index]]
+
+    def __setitem__(self, index, intent_list):
+        if not isinstance(index, slice):
+            if not self._layers.replace_layer(self._position(index),
+                                              intent_list):
+                raise IndexError("layer index out of range")
+            return
+        positions = range(*index.indices(len(self)))
+        intent_lists = list(intent_list)
+        if index.step not in (None, 1):
+            if len(intent_lists) != len(positions):
+                raise ValueError("attempt to assign sequence of size {n} "
+                                 "to extended slice of size {s}".format(
+                                     n=len(intent_lists), s=len(positions)))
+            for i, intents in zip(positions, intent_lists):
+                self._layers.replace_layer(i, intents)
+            return
+        for i in reversed(positions):
+            self._layers.remove_layer(i)
+        for n, intents in enumerate(intent_lists):
+            self.insert(positions.start + n, intents)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            for i in sorted(range(*index.indices(len(self))), reverse=True):
+                self._layers.remove_layer(i)
+        elif not self._layers.remove_layer(self._position(index)):
+            raise IndexError("layer index out of range")
+
+    def insert(self, index, intent_list):
+        self._layers._insert(index, intent_list)
+
+    def _position(self, index):
+        return index + len(self) if index < 0 else index
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, _LayerList)):
+            return NotImplemented
+        return [list(l) for l in self] == [list(l) for l in other]
+
+    def __repr__(self):
+        return repr([list(l) for l in self])
 
 
 class IntentLayers:
-    def __init__(self, bus=None, layers=None):
+    """
+    switch between groups of intents
+
+    only the intents whose state changes are toggled on a layer switch,
+    the layers remember what they enabled. After disabling intents the
+    layers enabled the switch waits (at most ack_timeout seconds) until
+    the skill detached them, so a detach can not arrive after the register
+    of the next layer. Enabling does not wait
+
+    every layer gets a stable id, names and the intent -> layers index
+    point at ids so removing a layer does not shift them. The intents to
+    disable / enable between two layers are computed once and reused, a
+    switch costs the number of changed intents, not the number of layers.
+    Named layers can declare which layers they lead to:
+
+        layers.add_named_layer("menu", ["OrderIntent", "HelpIntent"])
+        layers.add_named_layer("order", ["PizzaIntent", "CancelIntent"])
+        layers.add_transition("menu", "order")
+        layers.add_transition("order", "menu")
+        layers.activate_named_layer("menu")
+        layers.transition("order")
+
+    args:
+        bus: messagebus connection
+        layers (list): lists of intent names
+        batch (bool): send one mycroft.skill.enable_intents /
+                      disable_intents message per switch instead of one
+                      message per intent, only skills based on
+                      ovos_utils MycroftSkill understand them
+        ack_timeout (float): max seconds to wait for the skill to detach
+                             the disabled intents, 0 does not wait
+        skill_id (str): skill owning the intents, acknowledgements are
+                        "skill_id:intent_name" detach_intent messages.
+                        Without it only intent names that already are
+                        "skill_id:intent_name" are acknowledged, for the
+                        others the switch waits a fixed 0.3 seconds
+                        (at most ack_timeout)
+    """
+
+    def __init__(self, bus=None, layers=None, batch=False, ack_timeout=1.0,
+                 skill_id=None):
         layers = layers or []
         self.bus = bus or get_mycroft_bus()
+        self.batch = batch
+        self.ack_timeout = ack_timeout
+        self.skill_id = skill_id
+        # intents these layers enabled in enable order, None until the
+        # first switch
+        self._enabled = None
+        self._lock = Lock()
         # make intent levels for N layers
         self.layers = layers
         self.current_layer = 0
         self.activate_layer(0)
-        self.named_layers = {}
 
+    # layer storage
+    @property
+    def layers(self):
+        """ intent names of the layers in position order, a list like
+        view: appending, replacing or deleting layers in it works like
+        add_layer, replace_layer and remove_layer. The intent names of a
+        layer are a tuple, replace the layer to change them """
+        return _LayerList(self)
+
+    @layers.setter
+    def layers(self, layers):
+        layers = list(layers)  # may be a view of the layers replaced here
+        self._ids = []  # position: layer id
+        self._positions = {}  # layer id: position
+        self._intents = {}  # layer id: intent names tuple
+        self._sets = {}  # layer id: frozenset of intent names
+        self._index = {}  # intent name: {layer id}
+        self._diffs = {}  # src id: {dst id: (disable, enable)}
+        self._named = {}  # name: layer id
+        self._transitions = {}  # layer id: {layer id}
+        self._new_id = count()
+        # layer whose intents are exactly the enabled ones
+        self._active_id = None
+        # layer last activated, transitions start from it
+        self._current_id = None
+        for intent_list in layers:
+            self._add(intent_list)
+
+    @property
+    def named_layers(self):
+        """ {name: layer number} """
+        return {name: self._positions[i] for name, i in self._named.items()}
+
+    @named_layers.setter
+    def named_layers(self, named_layers):
+        self._named = {name: self._ids[n]
+                       for name, n in named_layers.items()}
+
+    def _add(self, intent_list):
+        layer_id = next(self._new_id)
+        self._positions[layer_id] = len(self._ids)
+        self._ids.append(layer_id)
+        self._store(layer_id, intent_list)
+        return layer_id
+
+    def _insert(self, layer_num, intent_list):
+        layer_num = max(0, min(len(self._ids), layer_num if layer_num >= 0
+                               else layer_num + len(self._ids)))
+        if layer_num == len(self._ids):
+            return self._add(intent_list)
+        layer_id = next(self._new_id)
+        self._ids.insert(layer_num, layer_id)
+        for i in self._ids[layer_num:]:
+            self._positions[i] = self._positions.get(i, layer_num - 1) + 1
+        self._store(layer_id, intent_list)
+        if self.current_layer >= layer_num:
+            # keep pointing at the same layer
+            self.current_layer += 1
+        return layer_id
+
+    def _store(self, layer_id, intent_list):
+        intents = tuple(dict.fromkeys(intent_list or []))
+        self._intents[layer_id] = intents
+        self._sets[layer_id] = frozenset(intents)
+        for intent_name in intents:
+            self._index.setdefault(intent_name, set()).add(layer_id)
+
+    def _discard(self, layer_id):
+        # forget the intents and every diff computed with the layer
+        for intent_name in self._intents.pop(layer_id):
+            layer_ids = self._index[intent_name]
+            layer_ids.discard(layer_id)
+            if not layer_ids:
+                del self._index[intent_name]
+        del self._sets[layer_id]
+        self._diffs.pop(layer_id, None)
+        for diffs in self._diffs.values():
+            diffs.pop(layer_id, None)
+        if self._active_id == layer_id:
+            self._active_id = None
+        if self._current_id == layer_id:
+            self._current_id = None
+
+    def _diff(self, src_id, dst_id):
+        """ (intents to disable, intents to enable) going from the
+        src layer to the dst layer, kept until one of them changes """
+        diffs = self._diffs.setdefault(src_id, {})
+        if dst_id not in diffs:
+            src, dst = self._sets[src_id], self._sets[dst_id]
+            diffs[dst_id] = (
+                tuple(i for i in self._intents[src_id] if i not in dst),
+                tuple(i for i in self._intents[dst_id] if i not in src))
+        return diffs[dst_id]
+
+    def _layer_id(self, layer_num):
+        if 0 <= layer_num < len(self._ids):
+            return self._ids[layer_num]
+        return None
+
+    # intent toggling
     def disable_intent(self, intent_name):
         """Disable a registered intent"""
-        self.bus.emit(Message("mycroft.skill.disable_intent",
-                              {"intent_name": intent_name}))
+        self.disable_intents([intent_name])
 
     def enable_intent(self, intent_name):
         """Reenable a registered self intent"""
-        self.bus.emit(Message("mycroft.skill.enable_intent",
-                              {"intent_name": intent_name}))
+        self.enable_intents([intent_name])
+
+    def disable_intents(self, intent_names):
+        """Disable registered intents, returns False if the skill did not
+        acknowledge the ones these layers enabled in time"""
+        self._active_id = None
+        return self._toggle(intent_names, False)
+
+    def enable_intents(self, intent_names):
+        """Reenable registered intents"""
+        self._active_id = None
+        return self._toggle(intent_names, True)
+
+    def _toggle(self, intent_names, enable):
+        intent_names = list(dict.fromkeys(intent_names))
+        if not intent_names:
+            return True
+        # only intents known to be enabled send a detach
+        pending = set()
+        unacked = False  # detaches nothing identifies
+        if not enable and self.ack_timeout and self._enabled:
+            for intent_name in intent_names:
+                if intent_name not in self._enabled:
+                    continue
+                if self.skill_id:
+                    pending.add(self.skill_id + ":" + intent_name)
+                elif ":" in intent_name:
+                    pending.add(intent_name)
+                else:
+                    unacked = True
+        done = Event()
+
+        def on_ack(message):
+            # intent services get "skill_id:intent_name"
+            with self._lock:
+                pending.discard(message.data.get("intent_name"))
+                if not pending:
+                    done.set()
 
+        msg_type = "mycroft.skill.enable_intent" if enable \
+            else "mycroft.skill.disable_intent"
+        waiting = bool(pending)
+        if waiting:
+            self.bus.on(_DETACH_ACK, on_ack)
+        start = time.time()
+        try:
+            if self.batch:
+                self.bus.emit(Message(msg_type + "s",
+                                      {"intent_names": intent_names}))
+            else:
+                for intent_name in intent_names:
+                    self.bus.emit(Message(msg_type,
+                                          {"intent_name": intent_name}))
+            acked = not waiting or done.wait(self.ack_timeout)
+        finally:
+            if waiting:
+                self.bus.remove(_DETACH_ACK, on_ack)
+        if unacked:
+            # no skill_id, give the skill the time the layers always waited
+            delay = start + min(self.ack_timeout, _UNACKED_DELAY) - \
+                time.time()
+            if delay > 0:
+                time.sleep(delay)
+        if self._enabled is not None:
+            for intent_name in intent_names:
+                if enable:
+                    self._enabled[intent_name] = True
+                else:
+                    self._enabled.pop(intent_name, None)
+        if not acked:
+            LOG.debug("no acknowledgement for: " + str(sorted(pending)))
+        return acked
+
+    # navigation
     def reset(self):
         LOG.info("Reseting Intent Layers")
         self.activate_layer(0)
@@ -30,7 +312,7 @@ class IntentLayers:
     def next(self):
         LOG.info("Going to next Intent Layer")
         self.current_layer += 1
-        if self.current_layer > len(self.layers):
+        if self.current_layer > len(self._ids):
             LOG.info("Already in last layer, going to layer 0")
             self.current_layer = 0
         self.activate_layer(self.current_layer)
@@ -44,44 +326,44 @@ class IntentLayers:
         else:
             self.activate_layer(self.current_layer)
 
+    # layer editing
     def add_layer(self, intent_list=None):
         intent_list = intent_list or []
-        self.layers.append(intent_list)
+        self._add(intent_list)
         LOG.info("Adding intent layer: " + str(intent_list))
 
     def add_named_layer(self, name, intent_list=None):
         intent_list = intent_list or []
-        self.named_layers[name] = len(self.layers)
-        self.layers.append(intent_list)
+        self._named[name] = self._add(intent_list)
         LOG.info("Setting layer " + name + " to: " + str(intent_list))
 
     def activate_named_layer(self, name):
-        if name in self.named_layers:
-            i = self.named_layers[name]
+        if name in self._named:
+            i = self._positions[self._named[name]]
             LOG.info("activating layer named: " + name)
             self.activate_layer(i)
         else:
             LOG.error("no layer named: " + name)
 
     def deactivate_named_layer(self, name):
-        if name in self.named_layers:
-            i = self.named_layers[name]
+        if name in self._named:
+            i = self._positions[self._named[name]]
             LOG.info("deactivating layer named: " + name)
             self.deactivate_layer(i)
         else:
             LOG.error("no layer named: " + name)
 
     def remove_named_layer(self, name):
-        if name in self.named_layers:
-            i = self.named_layers[name]
+        if name in self._named:
+            i = self._positions[self._named[name]]
             LOG.info("removing layer named: " + name)
             self.remove_layer(i)
         else:
             LOG.error("no layer named: " + name)
 
     def replace_named_layer(self, name, intent_list=None):
-        if name in self.named_layers:
-            i = self.named_layers[name]
+        if name in self._named:
+            i = self._positions[self._named[name]]
             LOG.info("replacing layer named: " + name)
             self.replace_layer(i, intent_list)
         else:
@@ -89,66 +371,135 @@ class IntentLayers:
 
     def replace_layer(self, layer_num, intent_list=None):
         intent_list = intent_list or []
+        layer_id = self._layer_id(layer_num)
+        if layer_id is None:
+            LOG.error("invalid layer number")
+            return False
         if self.current_layer == layer_num:
             self.deactivate_layer(layer_num)
         LOG.info("Adding layer" + str(intent_list) + " in position " + str(
             layer_num))
-        self.layers[layer_num] = intent_list
+        self._discard(layer_id)
+        self._store(layer_id, intent_list)
         if self.current_layer == layer_num:
             self.activate_layer(layer_num)
+        return True
 
     def remove_layer(self, layer_num):
-        if layer_num >= len(self.layers):
+        layer_id = self._layer_id(layer_num)
+        if layer_id is None:
             return False
         if self.current_layer == layer_num:
             self.deactivate_layer(layer_num)
-        self.layers.pop(layer_num)
+        elif self.current_layer > layer_num:
+            # keep pointing at the same layer
+            self.current_layer -= 1
+        self._discard(layer_id)
+        self._ids.pop(layer_num)
+        del self._positions[layer_id]
+        for i in self._ids[layer_num:]:
+            self._positions[i] -= 1
+        self._named = {name: i for name, i in self._named.items()
+                       if i != layer_id}
+        self._transitions.pop(layer_id, None)
+        for dst_ids in self._transitions.values():
+            dst_ids.discard(layer_id)
         LOG.info("Removing layer number " + str(layer_num))
         return True
 
     def find_layer(self, intent_name):
-        layer_list = []
-        for i in range(0, len(self.layers)):
-            if intent_name in self.layers[i]:
-                layer_list.append(i)
-        return layer_list
+        return sorted(self._positions[i]
+                      for i in self._index.get(intent_name, ()))
+
+    # transitions
+    def add_transition(self, src, dst):
+        """ allow transition(dst) while the named layer src is active """
+        for name in (src, dst):
+            if name not in self._named:
+                LOG.error("no layer named: " + name)
+                return False
+        src_id, dst_id = self._named[src], self._named[dst]
+        self._transitions.setdefault(src_id, set()).add(dst_id)
+        # compute the intents to toggle now, not on the switch
+        self._diff(src_id, dst_id)
+        return True
+
+    def remove_transition(self, src, dst):
+        dst_ids = self._transitions.get(self._named.get(src), set())
+        if self._named.get(dst) not in dst_ids:
+            return False
+        dst_ids.discard(self._named[dst])
+        return True
+
+    def transitions(self, name=None):
+        """ names of the layers reachable from the named layer name,
+        default the last activated one """
+        src_id = self._named.get(name) if name is not None \
+            else self._current_id
+        dst_ids = self._transitions.get(src_id, ())
+        return [n for n, i in self._named.items() if i in dst_ids]
+
+    def transition(self, name):
+        """ switch to the named layer if the last activated layer declared
+        a transition to it, also after it was deactivated """
+        dst_id = self._named.get(name)
+        if dst_id is None:
+            LOG.error("no layer named: " + name)
+            return False
+        if dst_id not in self._transitions.get(self._current_id, ()):
+            LOG.error("no transition to layer named: " + name)
+            return False
+        return self.activate_layer(self._positions[dst_id])
 
     def disable(self):
         LOG.info("Disabling layers")
         # disable all layers
-        for i in range(0, len(self.layers)):
-            self.deactivate_layer(i)
+        if self._enabled is None:
+            self.disable_intents(list(self._index))
+        else:
+            self.disable_intents(list(self._enabled))
+        self._enabled = {}
 
     def activate_layer(self, layer_num):
         # error check
-        if layer_num < 0 or layer_num > len(self.layers):
+        if layer_num < 0 or layer_num > len(self._ids):
             LOG.error("invalid layer number")
             return False
 
         self.current_layer = layer_num
+        layer_id = self._current_id = self._layer_id(layer_num)
+        target = self._sets[layer_id] if layer_id is not None \
+            else frozenset()
 
-        # disable other layers
-        self.disable()
-
-        # TODO in here we should wait for all intents to be detached
-        # sometimes detach intent from this step comes after register from next
-        # is there some bus signal we can track?
-        sleep(0.3)
+        # disable other layers, only what is enabled and not in this one
+        if self._enabled is None:
+            # first switch, the state of the intents is unknown
+            disable = [i for i in self._index if i not in target]
+            self._enabled = {}
+            enable = self._intents.get(layer_id, ())
+        elif self._active_id is not None and layer_id is not None:
+            disable, enable = self._diff(self._active_id, layer_id)
+        else:
+            disable = [i for i in self._enabled if i not in target]
+            enable = [i for i in self._intents.get(layer_id, ())
+                      if i not in self._enabled]
+        self._toggle(disable, False)
 
         # enable layer
         LOG.info("Activating Layer " + str(layer_num))
-        if layer_num < len(self.layers) and len(self.layers):
-            for intent_name in self.layers[layer_num]:
-                self.enable_intent(intent_name)
+        if layer_id is not None:
+            self._toggle(enable, True)
+            self._active_id = layer_id
             return True
+        self._active_id = None
         return False
 
     def deactivate_layer(self, layer_num):
         # error check
-        if layer_num < 0 or layer_num > len(self.layers):
+        layer_id = self._layer_id(layer_num)
+        if layer_id is None:
             LOG.error("invalid layer number")
             return False
         LOG.info("Deactivating Layer " + str(layer_num))
-        for intent_name in self.layers[layer_num]:
-            self.disable_intent(intent_name)
+        self.disable_intents(self._intents[layer_id])
         return True
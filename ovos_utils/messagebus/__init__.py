@@ -0,0 +1,977 @@
+from mycroft_bus_client import MessageBusClient, Message
+from ovos_utils.log import LOG
+from ovos_utils.configuration import read_mycroft_config
+from ovos_utils.messagebus.cache import SingleFlightCache
+from ovos_utils.messagebus.pool import BusConnectionPool
+from ovos_utils.messagebus.topics import get_topic_router, is_pattern
+from ovos_utils import create_loop
+from collections import OrderedDict
+from copy import copy
+from queue import Queue, Empty
+from threading import Event, Lock
+from urllib.parse import urlparse
+from uuid import uuid4
+import time
+import json
+
+_bus_pool = None
+_bus_pool_lock = Lock()
+
+
+def get_websocket(host, port, route='/', ssl=False, threaded=True):
+    """
+    Returns a connection to a websocket
+    """
+    client = MessageBusClient(host, port, route, ssl)
+    if threaded:
+        client.run_in_thread()
+    return client
+
+
+def get_bus_transport(config=None):
+    """
+    Returns the configured bus transport, "websocket" (default), "unix"
+    or "local"
+
+    set in mycroft.conf as {"websocket": {"transport": "local"}}, the local
+    transport is an in process bus, only components of the same process
+    can talk to each other. The unix transport talks to a
+    UnixMessageBusServer at {"websocket": {"unix_path": "..."}}, only
+    processes of the same device can talk to each other
+    """
+    if config is None:
+        config = read_mycroft_config().get("websocket") or {}
+    return config.get("transport") or "websocket"
+
+
+def get_mycroft_bus(host='0.0.0.0', port=8181, route='/core', ssl=False,
+                    threaded=True):
+    """
+    Returns a connection to the mycroft messagebus
+
+    if enabled in mycroft.conf websocket clients queue messages emitted
+    while disconnected, {"websocket": {"outbox": {"enabled": true}}},
+    send large payloads through shared memory,
+    {"websocket": {"shared_memory": {"enabled": true}}},
+    send and handle control messages ahead of bulk traffic,
+    {"websocket": {"lanes": {"enabled": true}}},
+    and clients are wrapped in an InstrumentedBus,
+    {"websocket": {"instrumentation": {"enabled": true}}}
+    """
+    config = read_mycroft_config().get("websocket") or {}
+    transport = get_bus_transport(config)
+    if transport == "local":
+        from ovos_utils.messagebus.local import get_local_bus
+        bus = get_local_bus(route)
+    else:
+        if transport == "unix":
+            from ovos_utils.messagebus.unix import get_unix_bus, \
+                DEFAULT_UNIX_PATH
+            bus = get_unix_bus(config.get("unix_path") or DEFAULT_UNIX_PATH,
+                               threaded)
+        else:
+            bus = get_websocket(host, port, route, ssl, threaded)
+        outbox = config.get("outbox") or {}
+        if outbox.get("enabled"):
+            from ovos_utils.messagebus.outbox import OutboxBus, \
+                outbox_from_config
+            bus = OutboxBus(bus, outbox_from_config(outbox, route))
+        shared_memory = config.get("shared_memory") or {}
+        if shared_memory.get("enabled"):
+            from ovos_utils.messagebus.shm import SharedMemoryBus, \
+                store_from_config
+            bus = SharedMemoryBus(bus, store_from_config(shared_memory))
+        lanes = config.get("lanes") or {}
+        if lanes.get("enabled"):
+            from ovos_utils.messagebus.lanes import lane_bus_from_config
+            bus = lane_bus_from_config(bus, lanes)
+    instrumentation = config.get("instrumentation") or {}
+    if instrumentation.get("enabled"):
+        from ovos_utils.messagebus.metrics import instrument_bus
+        bus = instrument_bus(bus, instrumentation)
+    return bus
+
+
+def get_bus_from_url(url, threaded=True):
+    """
+    Returns a bus connection for an url
+
+        ws://127.0.0.1:8181/core     websocket
+        wss://192.168.1.5:8181/core  websocket over ssl
+        unix:///tmp/mycroft/bus.sock unix domain socket
+        local:///core                in process LocalBus
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        from ovos_utils.messagebus.unix import get_unix_bus
+        return get_unix_bus(parsed.path, threaded)
+    if parsed.scheme == "local":
+        from ovos_utils.messagebus.local import get_local_bus
+        return get_local_bus(parsed.path or "/core")
+    if parsed.scheme in ("ws", "wss"):
+        return get_websocket(parsed.hostname, parsed.port or 8181,
+                             parsed.path or "/core", parsed.scheme == "wss",
+                             threaded)
+    raise ValueError("unsupported bus url: " + url)
+
+
+def get_bus_pool():
+    """
+    Returns the process wide BusConnectionPool used by the bus=None helpers
+    """
+    global _bus_pool
+    with _bus_pool_lock:
+        if _bus_pool is None:
+            _bus_pool = BusConnectionPool(get_mycroft_bus)
+        return _bus_pool
+
+
+def get_pooled_bus(host='0.0.0.0', port=8181, route='/core', ssl=False):
+    """
+    Returns a shared connection to the mycroft messagebus
+
+    NOTE: do not close this bus, call release_bus(bus) when done instead
+    """
+    return get_bus_pool().acquire(host, port, route, ssl)
+
+
+def release_bus(bus):
+    """
+    Hand a bus obtained with get_pooled_bus back to the pool,
+    connections not owned by the pool are closed
+    """
+    if not get_bus_pool().release(bus):
+        bus.close()
+
+
+def listen_for_message(msg_type, handler, bus=None, dispatcher=None):
+    """
+    Continuously listens and reacts to a specific messagetype on the mycroft messagebus
+
+    msg_type can be a wildcard pattern such as "enclosure.eyes.*" or
+    "recognizer_loop:*", see TopicRouter
+
+    if a BusDispatcher is passed the handler runs on its thread pool
+    instead of the bus receive thread
+
+    NOTE: when finished you should call bus.remove(msg_type, handler)
+          or bus.remove(msg_type, dispatcher.wrap(msg_type, handler)),
+          wildcard patterns are removed with
+          get_topic_router(bus).unsubscribe(msg_type, handler)
+    """
+    bus = bus or get_mycroft_bus()
+    if dispatcher is not None:
+        handler = dispatcher.wrap(msg_type, handler)
+    if is_pattern(msg_type):
+        get_topic_router(bus).subscribe(msg_type, handler)
+    else:
+        bus.on(msg_type, handler)
+    return bus
+
+
+def listen_once_for_message(msg_type, handler, bus=None):
+    """
+    listens and reacts once to a specific messagetype on the mycroft messagebus
+
+    NOTE: if no bus is passed a pooled connection is used, do not close it
+    """
+    auto_close = bus is None
+    bus = bus or get_pooled_bus()
+
+    def _handler(message):
+        handler(message)
+        if auto_close:
+            release_bus(bus)
+
+    bus.once(msg_type, _handler)
+    return bus
+
+
+def wait_for_reply(message, reply_type=None, timeout=None, bus=None):
+    """Send a message and wait for a response.
+
+    Args:
+        message (Message or str or dict): message object or type to send
+        reply_type (str): the message type of the expected reply.
+                          Defaults to "<message.type>.response".
+        timeout: seconds to wait before timeout, defaults to 3
+    Returns:
+        The received message or None if the response timed out
+    """
+    if isinstance(message, str):
+        try:
+            message = json.loads(message)
+        except:
+            pass
+    if isinstance(message, str):
+        message = Message(message)
+    elif isinstance(message, dict):
+        message = Message(message["type"],
+                          message.get("data"),
+                          message.get("context"))
+    elif not isinstance(message, Message):
+        raise ValueError
+    auto_close = bus is None
+    bus = bus or get_pooled_bus()
+    try:
+        response = bus.wait_for_response(message, reply_type, timeout)
+    finally:
+        if auto_close:
+            release_bus(bus)
+    return response
+
+
+def send_message(message, data=None, context=None, bus=None):
+    if isinstance(message, str):
+        if isinstance(data, dict) or isinstance(context, dict):
+            message = Message(message, data, context)
+        else:
+            try:
+                message = json.loads(message)
+            except:
+                message = Message(message)
+    if isinstance(message, dict):
+        message = Message(message["type"],
+                          message.get("data"),
+                          message.get("context"))
+    if not isinstance(message, Message):
+        raise ValueError
+    auto_close = bus is None
+    bus = bus or get_pooled_bus()
+    try:
+        bus.emit(message)
+    finally:
+        if auto_close:
+            release_bus(bus)
+
+
+def iter_replies(message, reply_type=None, timeout=3.0, min_replies=None,
+                 early_exit=None, max_timeout=None, bus=None):
+    """Send a message and yield every reply as it arrives.
+
+    Replies carrying {"searching": True} (as sent by CommonPlay skills)
+    announce that a responder is still working, they are not yielded but
+    keep the wait going past timeout, up to max_timeout, until that
+    responder sends its result or {"searching": False}.
+
+    Args:
+        message (Message): message to send
+        reply_type (str): the message type of the expected replies.
+                          Defaults to "<message.msg_type>.response".
+        timeout (float): seconds to wait for replies
+        min_replies (int): stop as soon as this many replies arrived
+        early_exit (callable): early_exit(replies) -> bool, stop as soon as
+                               it returns True
+        max_timeout (float): upper bound while responders are searching,
+                             defaults to timeout (no extensions)
+    Yields:
+        Message: each reply
+    """
+    reply_type = reply_type or message.msg_type + ".response"
+    max_timeout = max(max_timeout or timeout, timeout)
+    auto_close = bus is None
+    bus = bus or get_pooled_bus()
+
+    query_id = uuid4().hex
+    context = dict(message.context or {})
+    context[ReplyRouter.context_key] = query_id
+    outgoing = Message(message.msg_type, message.data, context)
+    queue = Queue()
+
+    def _on_reply(reply):
+        reply_id = (reply.context or {}).get(ReplyRouter.context_key)
+        if reply_id is None or reply_id == query_id:
+            queue.put(reply)
+
+    replies = []
+    searching = set()
+    start = time.time()
+    deadline = start + timeout
+    hard_deadline = start + max_timeout
+    bus.on(reply_type, _on_reply)
+    try:
+        bus.emit(outgoing)
+        while True:
+            # keep waiting while someone announced it is still searching
+            end = hard_deadline if searching else deadline
+            remaining = end - time.time()
+            if remaining <= 0:
+                break
+            try:
+                reply = queue.get(timeout=remaining)
+            except Empty:
+                break
+            data = reply.data or {}
+            responder = data.get("skill_id") or \
+                (reply.context or {}).get("source")
+            if "searching" in data:
+                if data["searching"]:
+                    searching.add(responder)
+                else:
+                    searching.discard(responder)
+                continue
+            searching.discard(responder)
+            replies.append(reply)
+            yield reply
+            if min_replies and len(replies) >= min_replies:
+                break
+            if early_exit is not None and early_exit(replies):
+                break
+    finally:
+        bus.remove(reply_type, _on_reply)
+        if auto_close:
+            release_bus(bus)
+
+
+def gather_replies(message, reply_type=None, timeout=3.0, min_replies=None,
+                   early_exit=None, max_timeout=None, callback=None,
+                   bus=None):
+    """Send a message and collect all replies (scatter-gather).
+
+    Returns when timeout expires, min_replies were received or
+    early_exit(replies) returns True, see iter_replies for details.
+
+    Args:
+        callback (callable): called with each reply as it arrives,
+                             useful to stream partial results
+    Returns:
+        list: received replies, in arrival order
+    """
+    replies = []
+    for reply in iter_replies(message, reply_type, timeout, min_replies,
+                              early_exit, max_timeout, bus):
+        replies.append(reply)
+        if callback is not None:
+            try:
+                callback(reply)
+            except Exception as e:
+                LOG.error(e)
+    return replies
+
+
+def _feed_namespace(msg_type):
+    """ "weather.request" -> "weather", base of the feed subscription types """
+    if msg_type.endswith(".request"):
+        return msg_type[:-len(".request")]
+    return msg_type
+
+
+class BusService:
+    """
+    Provide some service over the messagebus for other components
+
+    response = Message("face.recognition.reply")
+    service = BusService(response)
+    service.listen("face.recognition")
+
+    while True:
+        data = do_computation()
+        service.update_response(data)  # replaces response.data
+
+    """
+
+    def __init__(self, message, trigger_messages=None, bus=None,
+                 dispatcher=None):
+        self.bus = bus or get_mycroft_bus()
+        self.dispatcher = dispatcher
+        self.response = message
+        trigger_messages = trigger_messages or []
+        self.events = []
+        for message_type in trigger_messages:
+            self.listen(message_type)
+
+    def listen(self, message_type, callback=None):
+        if callback is None:
+            callback = self._respond
+        if self.dispatcher is not None:
+            callback = self.dispatcher.wrap(message_type, callback)
+        self.bus.on(message_type, callback)
+        self.events.append((message_type, callback))
+
+    def update_response(self, data=None):
+        if data is not None:
+            self.response.data = data
+
+    def _respond(self, message):
+        self.bus.emit(message.reply(self.response.msg_type,
+                                    self.response.data))
+
+    def shutdown(self):
+        """ remove all listeners """
+        for event, callback in self.events:
+            self.bus.remove(event, callback)
+
+
+class BusFeedProvider:
+    """
+
+    Meant to be subclassed
+
+    Besides answering trigger messages, consumers can subscribe to the feed
+    and get a versioned delta pushed every time update() changes the data,
+    see BusFeedConsumer.subscribe
+
+    versions are only meaningful within one provider instance, every push
+    carries the epoch of the instance and a started provider announces its
+    epoch so the consumers of a restarted provider subscribe again
+
+        class ClockService(BusFeedProvider):
+            def __init__(self, name="clock_transmitter", bus=None):
+                trigger_message  = Message("time.request")
+                super().__init__(trigger_message, name, bus)
+                self.set_data_gatherer(self.handle_get_time)
+
+            def handle_get_time(self, message):
+                self.update({"date": datetime.now()})
+
+
+        clock_service = ClockService()
+
+    """
+
+    def __init__(self, trigger_message, name=None, bus=None):
+        """
+           initialize responder
+
+           args:
+                name(str): name identifier for .conf settings
+                bus (WebsocketClient): mycroft messagebus websocket
+        """
+        self.trigger_message = trigger_message
+        self.name = name or self.__class__.__name__
+        self.bus = bus or get_mycroft_bus()
+        self.callback = None
+        self.service = None
+        self.cache = None
+        self._daemon = None
+        self.config = read_mycroft_config().get(self.name, {})
+        self.namespace = _feed_namespace(self.trigger_message)
+        self.version = 0
+        self.epoch = uuid4().hex
+        self.subscribers = set()
+        self._push_lock = Lock()
+
+    def update(self, data):
+        """
+        change the data of the response to be sent when queried,
+        subscribers are pushed the changed keys
+        """
+        if self.service is None:
+            return
+        with self._push_lock:
+            old = self.service.response.data
+            self.service.update_response(data)
+            if data is None or data == old:
+                return
+            self.version += 1
+            if not self.subscribers:
+                return
+            if isinstance(data, dict) and isinstance(old, dict):
+                changed = {k: v for k, v in data.items()
+                           if k not in old or old[k] != v}
+                removed = [k for k in old if k not in data]
+                push = Message(self.namespace + ".delta",
+                               {"epoch": self.epoch,
+                                "version": self.version,
+                                "base_version": self.version - 1,
+                                "changed": changed,
+                                "removed": removed},
+                               {"source": self.name})
+            else:
+                push = Message(self.namespace + ".snapshot",
+                               {"epoch": self.epoch,
+                                "version": self.version, "data": data},
+                               {"source": self.name})
+        # emit outside the lock, in process buses dispatch synchronously
+        self.bus.emit(push)
+
+    def _handle_subscribe(self, message):
+        subscriber = message.context.get("subscriber_id")
+        with self._push_lock:
+            self.subscribers.add(subscriber)
+        self._send_snapshot(message)
+
+    def _handle_unsubscribe(self, message):
+        with self._push_lock:
+            self.subscribers.discard(message.context.get("subscriber_id"))
+
+    def _send_snapshot(self, message):
+        """ full data, sent on subscribe and when a consumer is out of sync """
+        with self._push_lock:
+            data = self.service.response.data
+            version = self.version
+        self.bus.emit(message.reply(self.namespace + ".snapshot",
+                                    {"epoch": self.epoch,
+                                     "version": version, "data": data}))
+
+    def set_data_gatherer(self, callback, default_data=None, daemonic=False,
+                          interval=90, cache_ttl=None, stale_ttl=0):
+        """
+          prepare responder for sending, register answers
+
+          args:
+                cache_ttl (float): reuse gathered data for this many seconds,
+                                   concurrent requests during a gather share
+                                   its result, None disables caching
+                stale_ttl (float): keep answering with expired data for this
+                                   many extra seconds while it is refreshed,
+                                   by the daemon loop if daemonic else in the
+                                   background
+        """
+        self.bus.remove_all_listeners(self.trigger_message)
+        if ".request" in self.trigger_message:
+            response_type = self.trigger_message.replace(".request", ".reply")
+        else:
+            response_type = self.trigger_message + ".reply"
+
+        response = Message(response_type, default_data)
+        self.service = BusService(response, bus=self.bus)
+        self.callback = callback
+        if cache_ttl is not None:
+            self.cache = SingleFlightCache(self._gather, cache_ttl, stale_ttl,
+                                           background_refresh=not daemonic)
+        else:
+            self.cache = None
+        self.bus.on(self.trigger_message, self._respond)
+        self.bus.on(self.namespace + ".subscribe", self._handle_subscribe)
+        self.bus.on(self.namespace + ".unsubscribe", self._handle_unsubscribe)
+        # a consumer out of sync may come from a previous provider instance
+        self.bus.on(self.namespace + ".resync", self._handle_subscribe)
+        if daemonic:
+            self._daemon = create_loop(self._data_daemon, interval)
+        self.bus.emit(Message(self.namespace + ".announce",
+                              {"epoch": self.epoch}, {"source": self.name}))
+
+    def _data_daemon(self):
+        if self.cache is not None:
+            self.cache.refresh()
+        elif self.callback is not None:
+            self.callback(self.trigger_message)
+
+    def _gather(self, key=None):
+        """ cache loader, runs the data gatherer and snapshots the data """
+        if self.callback:
+            self.callback(self.trigger_message)
+        return copy(self.service.response.data)
+
+    def _respond(self, message):
+        """
+          gather data and emit to bus
+        """
+        if self.cache is not None:
+            data = self.cache.get()
+            self.bus.emit(message.reply(self.service.response.msg_type, data))
+            return
+        try:
+            if self.callback:
+                self.callback(message)
+        except Exception as e:
+            LOG.error(e)
+        self.service._respond(message)
+
+    def cache_stats(self):
+        """ hit/miss/latency counters of the response cache """
+        if self.cache is None:
+            return {}
+        return self.cache.get_stats()
+
+    def shutdown(self):
+        self.bus.remove_all_listeners(self.trigger_message)
+        if self.service:
+            self.bus.remove(self.namespace + ".subscribe",
+                            self._handle_subscribe)
+            self.bus.remove(self.namespace + ".unsubscribe",
+                            self._handle_unsubscribe)
+            self.bus.remove(self.namespace + ".resync",
+                            self._handle_subscribe)
+        self.subscribers = set()
+        if self._daemon:
+            self._daemon.join(0)
+            self._daemon = None
+        if self.service:
+            self.service.shutdown()
+            self.service = None
+
+
+class PendingReply:
+    """ a request sent by a ReplyRouter that is waiting for its reply """
+
+    def __init__(self, query_id, message, reply_types):
+        self.query_id = query_id
+        self.message = message
+        self.reply_types = reply_types
+        self.response = None
+        self.sent_at = time.time()
+        self.received_at = None
+        self._event = Event()
+        self._callbacks = []
+        self._lock = Lock()
+
+    @property
+    def done(self):
+        return self._event.is_set()
+
+    @property
+    def latency(self):
+        if self.received_at is None:
+            return None
+        return self.received_at - self.sent_at
+
+    def resolve(self, message):
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.response = message
+            self.received_at = time.time()
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+        return True
+
+    def add_done_callback(self, callback):
+        """ callback(pending) once the reply arrived, right away if it
+        already did """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self, timeout=None):
+        """ block until the reply arrives, returns None on timeout """
+        self._event.wait(timeout)
+        return self.response
+
+
+class ReplyRouter:
+    """
+    match replies to outstanding requests by a correlation id
+
+    every request gets a unique context["query_id"], message.reply keeps the
+    context so the reply can be routed to the correct waiter, any number of
+    threads can have requests in flight over the same router
+
+    replies from components that do not keep the message context are handed
+    to the oldest request waiting for that reply type
+
+        router = ReplyRouter(bus)
+        pending = router.request(Message("time.request"), ["time.reply"])
+        response = pending.wait(timeout=3)
+
+    """
+    context_key = "query_id"
+
+    def __init__(self, bus=None):
+        self.bus = bus or get_mycroft_bus()
+        self._pending = OrderedDict()
+        self._reply_types = []
+        self._lock = Lock()
+
+    def _listen(self, reply_type):
+        # called with the lock held
+        if reply_type not in self._reply_types:
+            self._reply_types.append(reply_type)
+            self.bus.on(reply_type, self._handle_reply)
+
+    def request(self, message, reply_types):
+        """ emit message and return a PendingReply for it """
+        if isinstance(reply_types, str):
+            reply_types = [reply_types]
+        query_id = uuid4().hex
+        context = dict(message.context or {})
+        context[self.context_key] = query_id
+        outgoing = Message(message.msg_type, message.data, context)
+        pending = PendingReply(query_id, outgoing, list(reply_types))
+        with self._lock:
+            for reply_type in reply_types:
+                self._listen(reply_type)
+            self._pending[query_id] = pending
+        self.bus.emit(outgoing)
+        return pending
+
+    def cancel(self, pending):
+        """ stop tracking a request, eg. after it timed out """
+        with self._lock:
+            self._pending.pop(pending.query_id, None)
+
+    def send(self, message, reply_types, timeout=None):
+        """ emit message and block until the reply or timeout """
+        pending = self.request(message, reply_types)
+        try:
+            return pending.wait(timeout)
+        finally:
+            self.cancel(pending)
+
+    def _handle_reply(self, message):
+        query_id = (message.context or {}).get(self.context_key)
+        with self._lock:
+            if query_id is not None:
+                pending = self._pending.pop(query_id, None)
+            else:
+                pending = None
+                for p in self._pending.values():
+                    if message.msg_type in p.reply_types:
+                        pending = self._pending.pop(p.query_id)
+                        break
+        if pending is not None:
+            pending.resolve(message)
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    def shutdown(self):
+        """ remove all listeners """
+        with self._lock:
+            for reply_type in self._reply_types:
+                self.bus.remove(reply_type, self._handle_reply)
+            self._reply_types = []
+            self._pending = OrderedDict()
+
+
+class BusQuery:
+    """
+    retrieve data from some other component over the messagebus at any time
+
+    message = Message("request.msg", {...}, {...})
+    query = BusQuery(message)
+    response = query.send()
+    # do some more stuff
+    response = query.send() # reutilize the object
+
+    send is thread safe, replies are matched to each send call by a
+    correlation id so several threads can query at the same time
+
+    """
+
+    def __init__(self, message, bus=None):
+        self.bus = bus or get_mycroft_bus()
+        self.response = Message(None, None, None)
+        self.query = message
+        self.valid_response_types = []
+        self._router = ReplyRouter(self.bus)
+
+    def add_response_type(self, response_type):
+        """ listen to a new response_type """
+        if response_type not in self.valid_response_types:
+            self.valid_response_types.append(response_type)
+
+    def send(self, response_type=None, timeout=10):
+        if response_type is None:
+            response_type = self.query.msg_type + ".reply"
+        self.add_response_type(response_type)
+        response = self._router.send(self.query, self.valid_response_types,
+                                     timeout)
+        self.response = response or Message(None, None, None)
+        return self.response
+
+    def remove_listeners(self):
+        self._router.shutdown()
+
+    def shutdown(self):
+        """ remove all listeners """
+        self.remove_listeners()
+
+
+class BusFeedConsumer:
+    """
+    this is meant to be subclassed
+
+    class Clock(BusFeedConsumer):
+        def __init__(self, name="clock_receiver", timeout=3, bus=None):
+            request_message = Message("time.request")
+            super().__init__(request_message, name, timeout, bus)
+
+    # blocking
+    clock = Clock()
+    date = clock.request()["date"]
+
+    # async
+    clock = Clock(timeout=0) # non - blocking
+    clock.request(daemonic=True, # loop on background
+                  frequency=1) # update result every second
+
+    date = clock.result["date"]
+
+    # push, the provider sends changes as they happen
+    clock = Clock()
+    clock.subscribe(callback=print)  # optional, called on every change
+
+    date = clock.result["date"]
+
+    """
+
+    def __init__(self, query_message, name=None, timeout=5, bus=None):
+        self.name = name or self.__class__.__name__
+        self.query_message = query_message
+        self.query_message.context["source"] = self.name
+        self.bus = bus or get_mycroft_bus()
+        self.config = read_mycroft_config().get(self.name, {})
+        self.timeout = timeout
+        self.query = None
+        self.valid_responses = []
+        self._daemon = None
+        self.namespace = _feed_namespace(self.query_message.msg_type)
+        self.subscriber_id = None
+        self.epoch = None
+        self.version = None
+        self._feed_data = None
+        self._feed_callback = None
+        self._feed_lock = Lock()
+        self._synced = Event()
+        self._resyncing = False
+
+    def subscribe(self, callback=None):
+        """
+          register with the provider and receive updates as they happen
+          instead of polling, blocks until the initial data arrives or
+          timeout
+
+          callback(data) is called every time the data changes
+        """
+        if self.subscriber_id is None:
+            self.subscriber_id = uuid4().hex
+            self.bus.on(self.namespace + ".snapshot", self._handle_snapshot)
+            self.bus.on(self.namespace + ".delta", self._handle_delta)
+            self.bus.on(self.namespace + ".announce", self._handle_announce)
+        self._feed_callback = callback
+        self._synced.clear()
+        self.bus.emit(self._feed_message("subscribe"))
+        self._synced.wait(self.timeout)
+        return self._feed_data
+
+    def unsubscribe(self):
+        if self.subscriber_id is None:
+            return
+        self.bus.emit(self._feed_message("unsubscribe"))
+        self.bus.remove(self.namespace + ".snapshot", self._handle_snapshot)
+        self.bus.remove(self.namespace + ".delta", self._handle_delta)
+        self.bus.remove(self.namespace + ".announce", self._handle_announce)
+        self.subscriber_id = None
+        self.epoch = None
+        self.version = None
+
+    def _feed_message(self, action):
+        return Message(self.namespace + "." + action,
+                       context={"source": self.name,
+                                "subscriber_id": self.subscriber_id})
+
+    def _handle_snapshot(self, message):
+        # snapshots are replies, unless the provider data is not a dict
+        subscriber = message.context.get("subscriber_id")
+        if subscriber is not None and subscriber != self.subscriber_id:
+            return
+        with self._feed_lock:
+            self.epoch = message.data.get("epoch")
+            self.version = message.data["version"]
+            self._feed_data = message.data["data"]
+            self._resyncing = False
+            data = self._feed_data
+        self._synced.set()
+        self._notify(data)
+
+    def _handle_delta(self, message):
+        resync = False
+        with self._feed_lock:
+            version = message.data["version"]
+            same_epoch = message.data.get("epoch") == self.epoch
+            if same_epoch and self.version is not None and \
+                    version <= self.version:
+                return  # already applied
+            if not same_epoch or \
+                    message.data["base_version"] != self.version or \
+                    not isinstance(self._feed_data, dict):
+                # missed an update or provider restarted, ask for all data
+                resync = not self._resyncing
+                self._resyncing = True
+                data = None
+            else:
+                data = dict(self._feed_data)
+                data.update(message.data["changed"])
+                for k in message.data["removed"]:
+                    data.pop(k, None)
+                self._feed_data = data
+                self.version = version
+        if resync:
+            self.bus.emit(self._feed_message("resync"))
+        elif data is not None:
+            self._notify(data)
+
+    def _handle_announce(self, message):
+        # the provider (re)started, its versions start over
+        if message.data.get("epoch") != self.epoch:
+            self.bus.emit(self._feed_message("subscribe"))
+
+    def _notify(self, data):
+        if self._feed_callback is not None:
+            try:
+                self._feed_callback(data)
+            except Exception as e:
+                LOG.error(e)
+
+    def request(self, response_messages=None, daemonic=False, interval=90):
+        """
+          prepare query for sending, add several possible kinds of
+          response message automatically
+                "message_type.reply" ,
+                "message_type.response",
+                "message_type.result"
+        """
+        response_messages = response_messages or []
+
+        # generate valid reply message types
+        self.valid_responses = response_messages
+        if ".request" in self.query_message.msg_type:
+            response = self.query_message.msg_type.replace(".request", ".reply")
+            if response not in self.valid_responses:
+                self.valid_responses.append(response)
+            response = self.query_message.msg_type.replace(".request", ".response")
+            if response not in self.valid_responses:
+                self.valid_responses.append(response)
+            response = self.query_message.msg_type.replace(".request", ".result")
+            if response not in self.valid_responses:
+                self.valid_responses.append(response)
+        else:
+            response = self.query_message.msg_type + ".reply"
+            if response not in self.valid_responses:
+                self.valid_responses.append(response)
+            response = self.query_message.msg_type + ".response"
+            if response not in self.valid_responses:
+                self.valid_responses.append(response)
+            response = self.query_message.msg_type + ".result"
+            if response not in self.valid_responses:
+                self.valid_responses.append(response)
+
+        # update message context
+        self.query_message.context["valid_responses"] = self.valid_responses
+
+        self._query()
+        if daemonic:
+            self._daemon = create_loop(self._request_daemon, interval)
+        return self.result
+
+    def _request_daemon(self):
+        self.query.send(self.valid_responses[0], self.timeout)
+
+    def _query(self):
+        if self.query is None:
+            self.query = BusQuery(self.query_message, bus=self.bus)
+        for message in self.valid_responses[1:]:
+            self.query.add_response_type(message)
+        self.query.send(self.valid_responses[0], self.timeout)
+
+    @property
+    def result(self):
+        if self.subscriber_id is not None:
+            return self._feed_data
+        return self.query.response.data
+
+    def shutdown(self):
+        """ remove all listeners """
+        self.unsubscribe()
+        if self._daemon:
+            self._daemon.join(0)
+            self._daemon = None
+        if self.query:
+            self.query.shutdown()
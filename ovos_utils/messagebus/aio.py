@@ -0,0 +1,333 @@
+"""
+asyncio interface to the messagebus
+
+the underlying bus client keeps its own receive thread, messages are handed
+over to the event loop with call_soon_threadsafe so a single loop can keep
+thousands of requests in flight without a thread per request
+
+    async def main():
+        bus = AsyncBusClient()
+        reply = await bus.wait_for_reply(Message("time.request"),
+                                         "time.reply")
+        async for message in bus.on("speak"):
+            print(message.data["utterance"])
+
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from ovos_utils.log import LOG
+from ovos_utils.messagebus import Message, get_mycroft_bus
+
+
+class AsyncSubscription:
+    """ async iterator over every message of a type, see AsyncBusClient.on """
+
+    def __init__(self, client, msg_type, maxsize=0, handler=None):
+        self.client = client
+        self.msg_type = msg_type
+        self.handler = handler
+        self._queue = asyncio.Queue(maxsize)
+        self._closed = False
+
+    def _put(self, message):
+        # runs in the event loop
+        if self._closed:
+            return
+        if self.handler is not None:
+            result = self.handler(message)
+            if asyncio.iscoroutine(result):
+                self.client.loop.create_task(result)
+            return
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            LOG.warning("dropping {t} message, subscription queue "
+                        "full".format(t=self.msg_type))
+
+    async def get(self, timeout=None):
+        """ next message or None on timeout """
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        message = await self._queue.get()
+        if message is None:  # closed while waiting
+            raise StopAsyncIteration
+        return message
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.client._unsubscribe(self)
+            try:
+                self._queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+
+class AsyncBusClient:
+    """
+    awaitable wrapper around a (threaded) bus client
+
+    args:
+        bus: bus client to wrap, defaults to get_mycroft_bus()
+        loop: event loop messages are delivered to, defaults to the running
+              loop the first time the client listens or sends, so that
+              has to happen in the loop
+    """
+    context_key = "query_id"
+
+    def __init__(self, bus=None, loop=None):
+        self.bus = bus or get_mycroft_bus()
+        self._loop = loop
+        # single worker keeps emit order and never blocks the loop
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._subscriptions = {}
+        self._pending = {}
+        self._reply_types = {}  # reply type: requests waiting for it
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            # raises outside of a running loop, the bus thread callbacks
+            # use _loop and rely on on() / wait_for_reply having set it
+            self._loop = asyncio.get_running_loop()
+        return self._loop
+
+    # sending
+    async def emit(self, message):
+        """ send a message, returns when it was handed to the bus client """
+        await self.loop.run_in_executor(self._executor, self.bus.emit,
+                                        message)
+
+    async def wait_for_reply(self, message, reply_type=None, timeout=3.0):
+        """ send a message and await the reply, None on timeout
+
+        replies are matched by a context["query_id"] correlation id, replies
+        that dropped the context go to the oldest request for that type
+        """
+        if isinstance(reply_type, str) or reply_type is None:
+            reply_types = [reply_type or message.msg_type + ".response"]
+        else:
+            reply_types = list(reply_type)
+        query_id = uuid4().hex
+        context = dict(message.context or {})
+        context[self.context_key] = query_id
+        outgoing = Message(message.msg_type, message.data, context)
+
+        future = self.loop.create_future()
+        future.reply_types = reply_types
+        self._pending[query_id] = future
+        for t in reply_types:
+            if t not in self._reply_types:
+                self._reply_types[t] = 0
+                self.bus.on(t, self._on_reply)
+            self._reply_types[t] += 1
+        try:
+            await self.emit(outgoing)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._pending.pop(query_id, None)
+            for t in reply_types:
+                self._release_reply_type(t)
+
+    def _release_reply_type(self, reply_type):
+        # stop listening once no request waits for the type
+        if reply_type not in self._reply_types:
+            return  # closed
+        self._reply_types[reply_type] -= 1
+        if not self._reply_types[reply_type]:
+            del self._reply_types[reply_type]
+            self.bus.remove(reply_type, self._on_reply)
+
+    # wait_for_response naming from MessageBusClient
+    wait_for_response = wait_for_reply
+
+    def _on_reply(self, message):
+        # bus thread
+        self._loop.call_soon_threadsafe(self._resolve, message)
+
+    def _resolve(self, message):
+        # event loop
+        query_id = (message.context or {}).get(self.context_key)
+        future = None
+        if query_id is not None:
+            future = self._pending.pop(query_id, None)
+        else:
+            for key, f in self._pending.items():
+                if message.msg_type in f.reply_types:
+                    future = self._pending.pop(key)
+                    break
+        if future is not None and not future.done():
+            future.set_result(message)
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    # receiving
+    def on(self, msg_type, handler=None, maxsize=0):
+        """ listen to a message type
+
+        with a handler (plain function or coroutine function) the handler
+        is called in the event loop for every message, without one an
+        AsyncSubscription is returned to be used with `async for`
+        """
+        # take the running loop now, the bus thread delivering the
+        # messages has none
+        self._loop = self.loop
+        sub = AsyncSubscription(self, msg_type, maxsize, handler)
+        subs = self._subscriptions.setdefault(msg_type, [])
+        if not subs:
+            self.bus.on(msg_type, self._dispatch)
+        subs.append(sub)
+        return sub
+
+    async def once(self, msg_type, timeout=None):
+        """ await the next message of a type, None on timeout """
+        sub = self.on(msg_type)
+        try:
+            return await sub.get(timeout)
+        finally:
+            sub.close()
+
+    def _dispatch(self, message):
+        # bus thread
+        self._loop.call_soon_threadsafe(self._deliver, message)
+
+    def _deliver(self, message):
+        # event loop
+        for sub in list(self._subscriptions.get(message.msg_type, [])):
+            try:
+                sub._put(message)
+            except Exception as e:
+                LOG.exception(e)
+
+    def _unsubscribe(self, sub):
+        subs = self._subscriptions.get(sub.msg_type, [])
+        if sub in subs:
+            subs.remove(sub)
+        if not subs:
+            self._subscriptions.pop(sub.msg_type, None)
+            self.bus.remove(sub.msg_type, self._dispatch)
+
+    def remove_all_listeners(self, msg_type):
+        for sub in list(self._subscriptions.get(msg_type, [])):
+            sub.close()
+
+    def close(self, close_bus=False):
+        for msg_type in list(self._subscriptions):
+            self.remove_all_listeners(msg_type)
+        for reply_type in self._reply_types:
+            self.bus.remove(reply_type, self._on_reply)
+        self._reply_types = {}
+        for future in self._pending.values():
+            future.cancel()
+        self._pending = {}
+        self._executor.shutdown(wait=False)
+        if close_bus:
+            self.bus.close()
+
+
+class AsyncBusService:
+    """
+    async version of BusService
+
+    response = Message("face.recognition.reply")
+    service = AsyncBusService(response, bus=AsyncBusClient())
+    service.listen("face.recognition")
+
+    while True:
+        data = await do_computation()
+        service.update_response(data)  # replaces response.data
+    """
+
+    def __init__(self, message, trigger_messages=None, bus=None):
+        self.bus = bus or AsyncBusClient()
+        self.response = message
+        self.events = []
+        for message_type in trigger_messages or []:
+            self.listen(message_type)
+
+    def listen(self, message_type, callback=None):
+        if callback is None:
+            callback = self._respond
+        self.events.append(self.bus.on(message_type, callback))
+
+    def update_response(self, data=None):
+        if data is not None:
+            self.response.data = data
+
+    async def _respond(self, message):
+        await self.bus.emit(message.reply(self.response.msg_type,
+                                          self.response.data))
+
+    def shutdown(self):
+        """ remove all listeners """
+        for sub in self.events:
+            sub.close()
+        self.events = []
+
+
+class AsyncBusQuery:
+    """
+    async version of BusQuery, any number of send() calls can be awaited
+    concurrently on the same object
+
+    query = AsyncBusQuery(Message("request.msg", {...}, {...}))
+    response = await query.send()
+    """
+
+    def __init__(self, message, bus=None):
+        self.bus = bus or AsyncBusClient()
+        self.response = Message(None, None, None)
+        self.query = message
+        self.valid_response_types = []
+        self._sending = set()
+        self._cancelled = set()
+
+    def add_response_type(self, response_type):
+        if response_type not in self.valid_response_types:
+            self.valid_response_types.append(response_type)
+
+    async def send(self, response_type=None, timeout=10):
+        if response_type is None:
+            response_type = self.query.msg_type + ".reply"
+        self.add_response_type(response_type)
+        task = asyncio.ensure_future(self.bus.wait_for_reply(
+            self.query, list(self.valid_response_types), timeout))
+        self._sending.add(task)
+        try:
+            response = await task
+        except asyncio.CancelledError:
+            if task not in self._cancelled:
+                raise  # send() itself was cancelled
+            response = None
+        finally:
+            self._sending.discard(task)
+            self._cancelled.discard(task)
+        self.response = response or Message(None, None, None)
+        return self.response
+
+    def shutdown(self):
+        """ cancel the sends in flight, they return an empty response and
+        the client stops listening for their reply types """
+        for task in list(self._sending):
+            self._cancelled.add(task)
+            task.cancel()
@@ -0,0 +1,164 @@
+from threading import Event, Lock
+from ovos_utils import create_daemon
+from ovos_utils.log import LOG
+import time
+
+
+class _Entry:
+    def __init__(self):
+        self.value = None
+        self.updated = None
+        self.loading = None  # Event while a load is in flight
+        self.outdated = False  # invalidated while loading
+        self.error = None
+
+
+class SingleFlightCache:
+    """
+    TTL cache with stale-while-revalidate and single-flight loading
+
+    only one load per key runs at a time, concurrent get() calls during a
+    load wait for it and share its result instead of loading again
+
+        cache = SingleFlightCache(gather_weather, ttl=60, stale_ttl=600)
+        data = cache.get()
+
+    args:
+        loader (callable): loader(key) returning the value to cache
+        ttl (float): seconds a value is served as fresh
+        stale_ttl (float): extra seconds an expired value is still served
+                           while it is refreshed in the background,
+                           0 disables stale-while-revalidate
+        background_refresh (bool): refresh stale values in a new daemon
+                                   thread, disable when some other loop
+                                   calls refresh() periodically
+    """
+
+    def __init__(self, loader, ttl=60, stale_ttl=0, background_refresh=True):
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl or 0
+        self.background_refresh = background_refresh
+        self._entries = {}
+        self._lock = Lock()
+        self.stats = {"hits": 0,
+                      "stale_hits": 0,
+                      "misses": 0,
+                      "coalesced": 0,
+                      "loads": 0,
+                      "errors": 0,
+                      "load_time_total": 0.0,
+                      "load_time_max": 0.0,
+                      "load_time_last": 0.0}
+
+    def _entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        return entry
+
+    def age(self, key=None):
+        entry = self._entries.get(key)
+        if entry is None or entry.updated is None:
+            return None
+        return time.time() - entry.updated
+
+    def get(self, key=None):
+        """ cached value for key, loading it if needed """
+        with self._lock:
+            entry = self._entry(key)
+            age = None if entry.updated is None \
+                else time.time() - entry.updated
+            if age is not None and age < self.ttl:
+                self.stats["hits"] += 1
+                return entry.value
+            if age is not None and age < self.ttl + self.stale_ttl:
+                self.stats["stale_hits"] += 1
+                if self.background_refresh and entry.loading is None:
+                    entry.loading = Event()
+                    create_daemon(self._load, (key, entry))
+                return entry.value
+            if entry.loading is not None:
+                # somebody else is loading, share their result
+                self.stats["coalesced"] += 1
+                loading = entry.loading
+                owner = False
+            else:
+                self.stats["misses"] += 1
+                loading = entry.loading = Event()
+                owner = True
+        if owner:
+            self._load(key, entry)
+        else:
+            loading.wait()
+        return entry.value
+
+    def refresh(self, key=None):
+        """ reload a value now, unless a load is already in flight """
+        with self._lock:
+            entry = self._entry(key)
+            if entry.loading is not None:
+                return False
+            entry.loading = Event()
+        self._load(key, entry)
+        return True
+
+    def _load(self, key, entry):
+        start = time.time()
+        try:
+            value = self.loader(key)
+            error = None
+        except TimeoutError as e:
+            # nobody answered, not a bug in the loader
+            LOG.warning(str(e))
+            value = None
+            error = e
+        except Exception as e:
+            LOG.error("cache loader failed: " + str(e))
+            value = None
+            error = e
+        elapsed = time.time() - start
+        with self._lock:
+            self.stats["loads"] += 1
+            self.stats["load_time_total"] += elapsed
+            self.stats["load_time_last"] = elapsed
+            self.stats["load_time_max"] = max(self.stats["load_time_max"],
+                                              elapsed)
+            if error is None:
+                entry.value = value
+                # the value may predate an invalidation, use it but load
+                # again on the next get
+                entry.updated = None if entry.outdated else time.time()
+            else:
+                # keep serving the previous value
+                self.stats["errors"] += 1
+            entry.error = error
+            entry.outdated = False
+            loading, entry.loading = entry.loading, None
+        loading.set()
+
+    def invalidate(self, key=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.updated = None
+                entry.outdated = entry.loading is not None
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                entry.updated = None
+                entry.outdated = entry.loading is not None
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        requests = stats["hits"] + stats["stale_hits"] + \
+            stats["misses"] + stats["coalesced"]
+        stats["requests"] = requests
+        stats["hit_rate"] = (stats["hits"] + stats["stale_hits"] +
+                             stats["coalesced"]) / requests \
+            if requests else 0.0
+        stats["load_time_avg"] = stats["load_time_total"] / stats["loads"] \
+            if stats["loads"] else 0.0
+        return stats
@@ -0,0 +1,267 @@
+from collections import deque
+from threading import Condition, Lock
+from ovos_utils import create_daemon
+from ovos_utils.log import LOG
+import time
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEW = "drop_new"
+UNBOUNDED = "unbounded"
+_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEW, UNBOUNDED)
+
+
+class _TypeQueue:
+    def __init__(self, limit, overflow):
+        self.limit = limit
+        self.overflow = overflow
+        self.items = deque()
+        self.running = 0
+        self.scheduled = 0  # entries in the ready queue
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+
+class BusDispatcher:
+    """
+    Runs bus handlers on a bounded thread pool instead of the receive thread
+
+    every message type gets its own bounded queue, by default handlers of
+    the same message type run one at a time in arrival order while
+    different message types run in parallel, so one slow handler does not
+    stall the rest of the bus
+
+        dispatcher = BusDispatcher(max_workers=4,
+                                   type_limits={"enclosure.eyes.setpixel": 2})
+        listen_for_message("recognizer_loop:utterance", handler,
+                           dispatcher=dispatcher)
+
+    a message type with a limit above 1 runs its handlers concurrently and
+    loses the ordering guarantee
+
+    with lanes (see ovos_utils.messagebus.lanes) queued control messages
+    run before interactive ones and those before bulk traffic
+
+        dispatcher = BusDispatcher(lanes=LaneMap())
+
+    args:
+        max_workers (int): worker threads shared by all message types
+        max_queue (int): queued messages per message type
+        overflow (str): what to do when a queue is full
+                        "block" - wait for space, slows down the receive
+                                  thread until the handlers catch up
+                        "drop_oldest" - discard the oldest queued message
+                        "drop_new" - discard the incoming message
+                        "unbounded" - never full, max_queue is ignored
+        concurrency (int): default concurrent handlers per message type
+        type_limits (dict): concurrency per message type, overrides
+                            concurrency
+        lanes (LaneMap): run message types in lane priority order instead
+                         of arrival order
+        starvation_limit (int): see LaneQueue, only used with lanes
+        lane_overflow (dict): {lane: overflow policy} for the message types
+                              of a lane, overrides overflow, only used with
+                              lanes
+    """
+
+    def __init__(self, max_workers=4, max_queue=100, overflow=BLOCK,
+                 concurrency=1, type_limits=None, lanes=None,
+                 starvation_limit=16, lane_overflow=None):
+        self.lane_overflow = lane_overflow or {}
+        for policy in [overflow] + list(self.lane_overflow.values()):
+            if policy not in _POLICIES:
+                raise ValueError("invalid overflow policy: " + str(policy))
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.concurrency = concurrency
+        self.type_limits = type_limits or {}
+        self.lanes = lanes
+        self._queues = {}
+        if lanes is not None:
+            from ovos_utils.messagebus.lanes import LaneQueue
+            self._ready = LaneQueue(lanes, starvation_limit)
+        else:
+            self._ready = deque()
+        lock = Lock()
+        # workers wait for ready entries on _not_empty, blocked producers
+        # and join() wait for progress on _cond, a wakeup meant for a
+        # worker never goes to a producer
+        self._cond = Condition(lock)
+        self._not_empty = Condition(lock)
+        self._wrappers = {}
+        self._workers = []
+        self._running = True
+
+    def _queue(self, msg_type):
+        queue = self._queues.get(msg_type)
+        if queue is None:
+            limit = self.type_limits.get(msg_type, self.concurrency)
+            overflow = self.overflow
+            if self.lanes is not None and self.lane_overflow:
+                overflow = self.lane_overflow.get(self.lanes.lane(msg_type),
+                                                  overflow)
+            queue = self._queues[msg_type] = _TypeQueue(max(1, limit),
+                                                        overflow)
+        return queue
+
+    def _schedule(self, msg_type, queue):
+        # one ready entry per runnable item, never above the type limit
+        while queue.scheduled < len(queue.items) and \
+                queue.running + queue.scheduled < queue.limit:
+            self._ready.append(msg_type)
+            queue.scheduled += 1
+            self._not_empty.notify()
+
+    def _start_workers(self):
+        while len(self._workers) < self.max_workers:
+            self._workers.append(create_daemon(self._work))
+
+    # handlers
+    def wrap(self, msg_type, handler):
+        """ returns a bus handler that queues messages for handler
+
+        the same wrapper is returned for the same (msg_type, handler), use
+        it to remove the handler from the bus again
+
+            bus.on(msg_type, dispatcher.wrap(msg_type, handler))
+            bus.remove(msg_type, dispatcher.wrap(msg_type, handler))
+        """
+        key = (msg_type, handler)
+        wrapper = self._wrappers.get(key)
+        if wrapper is None:
+            def wrapper(message=None):
+                self.submit(msg_type, handler, message)
+
+            self._wrappers[key] = wrapper
+        return wrapper
+
+    def submit(self, msg_type, handler, message=None):
+        """ queue handler(message), returns False if it was dropped """
+        with self._cond:
+            if not self._running:
+                return False
+            if not self._workers:
+                self._start_workers()
+            queue = self._queue(msg_type)
+            queue.submitted += 1
+            if self.max_queue and queue.overflow != UNBOUNDED and \
+                    len(queue.items) >= self.max_queue:
+                if queue.overflow == DROP_NEW:
+                    queue.dropped += 1
+                    return False
+                elif queue.overflow == DROP_OLDEST:
+                    queue.items.popleft()
+                    queue.dropped += 1
+                else:
+                    while self._running and \
+                            len(queue.items) >= self.max_queue:
+                        self._cond.wait()
+                    if not self._running:
+                        return False
+            queue.items.append((handler, message, time.time()))
+            queue.max_depth = max(queue.max_depth, len(queue.items))
+            self._schedule(msg_type, queue)
+            return True
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while self._running and not self._ready:
+                    self._not_empty.wait()
+                if not self._ready:
+                    return
+                msg_type = self._ready.popleft()
+                queue = self._queues[msg_type]
+                queue.scheduled -= 1
+                if not queue.items:
+                    # dropped while waiting to run
+                    continue
+                handler, message, queued_at = queue.items.popleft()
+                queue.running += 1
+                waited = time.time() - queued_at
+                queue.wait_time_total += waited
+                queue.wait_time_max = max(queue.wait_time_max, waited)
+                # a blocked producer may be waiting for this slot
+                self._cond.notify_all()
+            try:
+                handler(message)
+                failed = False
+            except Exception as e:
+                LOG.exception("error in {t} handler: {e}".format(t=msg_type,
+                                                                 e=e))
+                failed = True
+            with self._cond:
+                queue.running -= 1
+                queue.processed += 1
+                if failed:
+                    queue.errors += 1
+                self._schedule(msg_type, queue)
+                self._cond.notify_all()
+
+    # metrics
+    def queue_depth(self, msg_type=None):
+        """ messages waiting to run, for one message type or in total """
+        with self._cond:
+            if msg_type is not None:
+                queue = self._queues.get(msg_type)
+                return len(queue.items) if queue else 0
+            return sum(len(q.items) for q in self._queues.values())
+
+    def get_stats(self):
+        """ per message type counters and queue depths """
+        with self._cond:
+            stats = {}
+            for msg_type, q in self._queues.items():
+                done = q.processed or 1
+                stats[msg_type] = {"depth": len(q.items),
+                                   "max_depth": q.max_depth,
+                                   "running": q.running,
+                                   "limit": q.limit,
+                                   "submitted": q.submitted,
+                                   "processed": q.processed,
+                                   "dropped": q.dropped,
+                                   "errors": q.errors,
+                                   "wait_time_avg": q.wait_time_total / done,
+                                   "wait_time_max": q.wait_time_max}
+            return stats
+
+    def get_lane_stats(self):
+        """ per lane counters of the ready queue, None without lanes """
+        with self._cond:
+            if not hasattr(self._ready, "get_stats"):
+                return None
+            return self._ready.get_stats()
+
+    def join(self, timeout=None):
+        """ wait until every queued message was handled,
+        returns False on timeout """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while any(q.items or q.running for q in self._queues.values()):
+                remaining = None if deadline is None \
+                    else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def shutdown(self, wait=True):
+        """ stop the workers, with wait=True queued messages are handled
+        first, otherwise they are discarded """
+        if wait:
+            self.join()
+        with self._cond:
+            self._running = False
+            self._ready.clear()
+            for queue in self._queues.values():
+                queue.items.clear()
+                queue.scheduled = 0
+            self._cond.notify_all()
+            self._not_empty.notify_all()
+        self._workers = []
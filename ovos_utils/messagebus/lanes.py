@@ -0,0 +1,347 @@
+"""
+priority lanes for bus traffic
+
+a "mycroft.stop" should not wait behind hundreds of "gui.value.set" or
+"enclosure.eyes.setpixel" messages. Message types are mapped to one of
+three lanes, in priority order
+
+    control      stop, mute, volume, ... handled before anything else
+    interactive  everything not configured otherwise
+    bulk         gui updates, eyes / mouth animations, ...
+
+higher lanes always go first, but after starvation_limit messages of
+higher lanes passed a waiting lower lane message, the lower lane message
+goes next, so bulk traffic slows down instead of stopping
+
+    bus = LaneBus(get_websocket("0.0.0.0", 8181, "/core"))
+    bus.emit(Message("enclosure.eyes.setpixel", {...}))  # bulk lane
+    bus.emit(Message("mycroft.stop"))  # sent before queued bulk messages
+
+LaneBus sends through a queue per lane and runs handlers on a
+BusDispatcher whose ready queue is split in lanes the same way. Messages
+of the same lane keep their order, messages of different lanes do not
+
+get_mycroft_bus adds the lanes when enabled in mycroft.conf, message
+types may be patterns, see ovos_utils.messagebus.topics
+
+    "websocket": {
+        "lanes": {
+            "enabled": true,
+            "control": ["mycroft.stop", "mycroft.volume.*"],
+            "bulk": ["gui.value.set", "enclosure.eyes.*"],
+            "starvation_limit": 16,
+            "max_workers": 4,
+            "dispatch_queue": 100,
+            "overflow": {"bulk": "drop_oldest"}
+        }
+    }
+
+the bus receive thread never waits for the handlers: queued bulk messages
+above dispatch_queue per message type are dropped oldest first, the
+other lanes are not bounded unless "overflow" says otherwise
+"""
+from collections import deque
+from threading import Condition, Event
+from ovos_utils import create_daemon
+from ovos_utils.log import LOG
+from ovos_utils.messagebus.dispatch import BusDispatcher, DROP_OLDEST, \
+    UNBOUNDED
+from ovos_utils.messagebus.topics import TopicTrie
+import time
+
+CONTROL = "control"
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (CONTROL, INTERACTIVE, BULK)
+
+DEFAULT_LANES = {
+    CONTROL: ["mycroft.stop",
+              "mycroft.audio.speech.stop",
+              "mycroft.mic.mute",
+              "mycroft.mic.unmute",
+              "mycroft.volume.mute",
+              "mycroft.volume.unmute",
+              "enclosure.system.mute",
+              "enclosure.system.unmute",
+              "mycroft.audio.service.stop"],
+    BULK: ["gui.value.set",
+           "enclosure.eyes.setpixel",
+           "enclosure.eyes.fill",
+           "enclosure.mouth.viseme_list",
+           "enclosure.mouth.display",
+           "enclosure.weather.display",
+           "ovos.bus.stats.response"]
+}
+
+# client events, not messages, never queued
+_EVENTS = ("open", "close", "error", "reconnecting", "message")
+
+
+class LaneMap:
+    """
+    message type -> lane
+
+    args:
+        lanes (dict): {lane: [message types or patterns]},
+                      default DEFAULT_LANES
+        default (str): lane of unlisted message types
+    """
+
+    def __init__(self, lanes=None, default=INTERACTIVE):
+        if default not in LANES:
+            raise ValueError("unknown lane: " + str(default))
+        self.default = default
+        self._trie = TopicTrie()
+        lanes = DEFAULT_LANES if lanes is None else lanes
+        for lane, msg_types in lanes.items():
+            if lane not in LANES:
+                raise ValueError("unknown lane: " + str(lane))
+            for msg_type in msg_types:
+                self._trie.add(msg_type, LANES.index(lane))
+
+    def index(self, msg_type):
+        """ position of the lane of msg_type in LANES, 0 goes first """
+        matches = self._trie.match(msg_type)
+        # a type matched by several lanes goes to the highest one
+        return min(matches) if matches else LANES.index(self.default)
+
+    def lane(self, msg_type):
+        return LANES[self.index(msg_type)]
+
+
+class LaneQueue:
+    """
+    deque-like queue split in lanes, not thread safe
+
+    append() puts an item in the lane of its message type, popleft()
+    takes from the highest non empty lane unless a lower lane was passed
+    over starvation_limit times, then its oldest item goes first
+
+    args:
+        lanes (LaneMap): default LaneMap()
+        starvation_limit (int): higher lane items a waiting item lets pass
+        key (callable): message type of an item, default the item itself
+    """
+
+    def __init__(self, lanes=None, starvation_limit=16, key=None):
+        self.lanes = lanes if lanes is not None else LaneMap()
+        self.starvation_limit = starvation_limit
+        self.key = key
+        self._queues = [deque() for _ in LANES]
+        self._passed = [0 for _ in LANES]
+        self._served = [0 for _ in LANES]
+        self._starved = [0 for _ in LANES]
+        self._max_depth = [0 for _ in LANES]
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues)
+
+    def append(self, item):
+        i = self.lanes.index(self.key(item) if self.key else item)
+        queue = self._queues[i]
+        queue.append(item)
+        self._max_depth[i] = max(self._max_depth[i], len(queue))
+
+    def popleft(self):
+        chosen = None
+        starved = False
+        for i, queue in enumerate(self._queues):
+            if not queue:
+                continue
+            if chosen is None:
+                chosen = i
+            elif self._passed[i] >= self.starvation_limit:
+                chosen, starved = i, True
+                break
+        if chosen is None:
+            raise IndexError("pop from an empty LaneQueue")
+        for i, queue in enumerate(self._queues):
+            if queue and i != chosen:
+                self._passed[i] += 1
+        item = self._queues[chosen].popleft()
+        self._passed[chosen] = 0
+        self._served[chosen] += 1
+        if starved:
+            self._starved[chosen] += 1
+        return item
+
+    def clear(self):
+        for queue in self._queues:
+            queue.clear()
+        self._passed = [0 for _ in LANES]
+
+    def depth(self, lane=None):
+        if lane is None:
+            return len(self)
+        return len(self._queues[LANES.index(lane)])
+
+    def get_stats(self):
+        """ per lane depth and counters, "starved" counts the items served
+        ahead of higher lanes by the starvation protection """
+        return {lane: {"depth": len(self._queues[i]),
+                       "max_depth": self._max_depth[i],
+                       "served": self._served[i],
+                       "starved": self._starved[i]}
+                for i, lane in enumerate(LANES)}
+
+
+class LaneBus:
+    """
+    Wraps a bus client, emitted messages are sent and received messages
+    are handled in lane priority order
+
+    emit() only queues the message, a sender thread hands it to the
+    wrapped client. wait_for_response sends its request through the lane
+    queue as well so it does not overtake messages of its lane,
+    wait_for_message only listens and is passed through
+
+    args:
+        bus: MessageBusClient or compatible
+        lanes (LaneMap): default LaneMap()
+        dispatcher (BusDispatcher): runs the handlers, default a
+                                    BusDispatcher using the same lanes
+        starvation_limit (int): see LaneQueue
+        max_queue (int): queued messages per lane before emit blocks,
+                         None for no limit
+    """
+
+    def __init__(self, bus, lanes=None, dispatcher=None, starvation_limit=16,
+                 max_queue=None):
+        self.bus = bus
+        self.lanes = lanes if lanes is not None else LaneMap()
+        self.dispatcher = dispatcher if dispatcher is not None else \
+            BusDispatcher(lanes=self.lanes,
+                          starvation_limit=starvation_limit)
+        self.max_queue = max_queue
+        self._outgoing = LaneQueue(self.lanes, starvation_limit,
+                                   key=lambda m: m.msg_type)
+        self._cond = Condition()
+        self._sending = False
+        self._closed = False
+        self._sender = create_daemon(self._send_loop)
+
+    def __getattr__(self, item):
+        return getattr(self.bus, item)
+
+    # sending
+    def emit(self, message):
+        with self._cond:
+            if self._closed:
+                LOG.warning("Could not send {t} message because the bus "
+                            "is closed".format(t=message.msg_type))
+                return
+            if self.max_queue:
+                lane = self.lanes.lane(message.msg_type)
+                while not self._closed and \
+                        self._outgoing.depth(lane) >= self.max_queue:
+                    self._cond.wait()
+            self._outgoing.append(message)
+            self._cond.notify_all()
+
+    def wait_for_response(self, message, reply_type=None, timeout=3.0):
+        """ send a message and wait for a response, None on timeout """
+        reply_type = reply_type or message.msg_type + ".response"
+        received = []
+        event = Event()
+
+        def handler(response):
+            received.append(response)
+            event.set()
+
+        self.bus.once(reply_type, handler)
+        self.emit(message)
+        if not event.wait(timeout):
+            self.bus.remove(reply_type, handler)
+            return None
+        return received[0]
+
+    def _send_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._outgoing:
+                    self._sending = False
+                    self._cond.notify_all()
+                    self._cond.wait()
+                if not self._outgoing:
+                    return
+                message = self._outgoing.popleft()
+                self._sending = True
+                # an emit may be waiting for space in this lane
+                self._cond.notify_all()
+            try:
+                self.bus.emit(message)
+            except Exception as e:
+                LOG.error("could not send {t}: {e}".format(
+                    t=message.msg_type, e=e))
+
+    def flush(self, timeout=None):
+        """ wait until every queued message was handed to the client,
+        returns False on timeout """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._outgoing or self._sending:
+                remaining = None if deadline is None \
+                    else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # listeners
+    def _wrap(self, event_name, func):
+        if event_name in _EVENTS:
+            return func
+        return self.dispatcher.wrap(event_name, func)
+
+    def on(self, event_name, func):
+        self.bus.on(event_name, self._wrap(event_name, func))
+
+    def once(self, event_name, func):
+        self.bus.once(event_name, self._wrap(event_name, func))
+
+    def remove(self, event_name, func):
+        self.bus.remove(event_name, self._wrap(event_name, func))
+
+    def get_stats(self):
+        with self._cond:
+            return {"send": self._outgoing.get_stats(),
+                    "dispatch": self.dispatcher.get_lane_stats()}
+
+    def close(self, timeout=5):
+        """ sends what is still queued, for at most timeout seconds """
+        if not self.flush(timeout):
+            LOG.warning("closing bus with {n} unsent messages".format(
+                n=len(self._outgoing)))
+        with self._cond:
+            self._closed = True
+            self._outgoing.clear()
+            self._cond.notify_all()
+        self.dispatcher.shutdown(wait=False)
+        self.bus.close()
+
+
+def lanes_from_config(config):
+    """ LaneMap from the "lanes" section of the websocket config, lanes
+    not listed there keep their defaults """
+    lanes = {lane: config.get(lane, DEFAULT_LANES.get(lane, []))
+             for lane in LANES}
+    return LaneMap(lanes, config.get("default", INTERACTIVE))
+
+
+def lane_bus_from_config(bus, config):
+    """ LaneBus around bus from the "lanes" section of the websocket
+    config """
+    lanes = lanes_from_config(config)
+    starvation_limit = config.get("starvation_limit", 16)
+    # handlers run off the receive thread, which must never block on them
+    lane_overflow = {CONTROL: UNBOUNDED,
+                     INTERACTIVE: UNBOUNDED,
+                     BULK: DROP_OLDEST}
+    lane_overflow.update(config.get("overflow") or {})
+    dispatcher = BusDispatcher(max_workers=config.get("max_workers", 4),
+                               max_queue=config.get("dispatch_queue", 100),
+                               lanes=lanes,
+                               starvation_limit=starvation_limit,
+                               lane_overflow=lane_overflow)
+    return LaneBus(bus, lanes, dispatcher, starvation_limit,
+                   config.get("max_queue"))
@@ -0,0 +1,468 @@
+"""
+synthetic load for the voice pipeline
+
+injects "recognizer_loop:utterance" messages from a corpus file and
+measures, per utterance, the time until the first "speak" and until
+"mycroft.skill.handler.complete" (or "complete_intent_failure")
+
+replies are matched to the utterance that caused them by the
+"loadgen_id" context key, skills keep the context of the message they
+answer (message.reply / message.forward)
+
+    generator = LoadGenerator(bus, load_corpus("utterances.txt"), rate=20)
+    report = generator.run(duration=60)
+    print(report.summary())
+
+open loop (rate) sends at a fixed pace whether or not the pipeline keeps
+up, closed loop (concurrency) keeps a fixed number of utterances in
+flight. Utterances without handler.complete after timeout seconds count
+as dropped
+
+sizing hardware without a full stack, a ScriptedResponder plays skills
+with configurable delays on a local websocket stand-in
+
+    python -m ovos_utils.messagebus.loadgen utterances.txt --standin \\
+        --rate 50 --duration 30 --intent-delay 0.05 --handler-delay 0.2
+
+or against a running core
+
+    python -m ovos_utils.messagebus.loadgen utterances.txt \\
+        --concurrency 4 --count 500
+"""
+from collections import deque
+from heapq import heappop, heappush
+from itertools import count as counter
+from threading import Condition, Lock
+from uuid import uuid4
+from ovos_utils import create_daemon
+from ovos_utils.log import LOG
+from ovos_utils.messagebus import Message
+import json
+import math
+import random
+import time
+
+UTTERANCE = "recognizer_loop:utterance"
+SPEAK = "speak"
+COMPLETE = "mycroft.skill.handler.complete"
+FAILURE = "complete_intent_failure"
+CONTEXT_KEY = "loadgen_id"
+
+
+def load_corpus(path):
+    """ one utterance per line, blank lines and "#" comments are skipped,
+    lines can also be json objects {"utterance": ..., "lang": ...} """
+    corpus = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                corpus.append(json.loads(line))
+            else:
+                corpus.append({"utterance": line})
+    if not corpus:
+        raise ValueError("empty corpus: " + path)
+    return corpus
+
+
+def percentile(samples, p):
+    """ nearest-rank percentile of a list of numbers """
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    k = max(0, min(len(samples) - 1, math.ceil(p / 100 * len(samples)) - 1))
+    return samples[k]
+
+
+class _Scheduler:
+    """ runs callbacks at a given time on one thread, so thousands of
+    pending replies do not need a Timer thread each """
+
+    def __init__(self):
+        self._heap = []
+        self._cond = Condition()
+        self._seq = counter()
+        self._running = True
+        create_daemon(self._loop)
+
+    def call_later(self, delay, func, *args):
+        with self._cond:
+            heappush(self._heap, (time.monotonic() + delay, next(self._seq),
+                                  func, args))
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    if self._heap:
+                        wait = self._heap[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                if not self._running:
+                    return
+                _, _, func, args = heappop(self._heap)
+            try:
+                func(*args)
+            except Exception as e:
+                LOG.error("scheduled call failed: " + str(e))
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._heap = []
+            self._cond.notify()
+
+
+class ScriptedResponder:
+    """
+    stands in for the intent service and skills
+
+    every utterance is answered with a "speak" after intent_delay and
+    "mycroft.skill.handler.complete" handler_delay later, both keep the
+    utterance context. A failure_rate share of the utterances gets a
+    "complete_intent_failure" instead, a drop_rate share no answer at all
+
+    args:
+        bus: bus to answer on
+        intent_delay (float): seconds until the "speak"
+        handler_delay (float): seconds from "speak" to handler.complete
+        jitter (float): up to this share of each delay is added at random
+        failure_rate (float): 0-1, utterances no intent matches
+        drop_rate (float): 0-1, utterances never answered
+        seed (int): random seed, for repeatable runs
+    """
+
+    def __init__(self, bus, intent_delay=0.05, handler_delay=0.2,
+                 jitter=0.2, failure_rate=0.0, drop_rate=0.0, seed=None):
+        self.bus = bus
+        self.intent_delay = intent_delay
+        self.handler_delay = handler_delay
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+        self._scheduler = _Scheduler()
+        self.bus.on(UTTERANCE, self.handle_utterance)
+
+    def _delay(self, delay):
+        return delay * (1 + self._random.random() * self.jitter)
+
+    def handle_utterance(self, message):
+        roll = self._random.random()
+        if roll < self.drop_rate:
+            return
+        if roll < self.drop_rate + self.failure_rate:
+            self._scheduler.call_later(self._delay(self.intent_delay),
+                                       self._emit, message, FAILURE, {})
+            return
+        utterance = (message.data.get("utterances") or [""])[0]
+        intent_delay = self._delay(self.intent_delay)
+        self._scheduler.call_later(intent_delay, self._emit, message, SPEAK,
+                                   {"utterance": "you said " + utterance})
+        self._scheduler.call_later(
+            intent_delay + self._delay(self.handler_delay), self._emit,
+            message, COMPLETE, {"name": "LoadgenSkill.handle_utterance"})
+
+    def _emit(self, message, msg_type, data):
+        self.bus.emit(message.forward(msg_type, data))
+
+    def shutdown(self):
+        self.bus.remove(UTTERANCE, self.handle_utterance)
+        self._scheduler.stop()
+
+
+class _Request:
+    __slots__ = ("sent", "first_speak", "completed", "failed", "expired")
+
+    def __init__(self, sent):
+        self.sent = sent
+        self.first_speak = None
+        self.completed = None
+        self.failed = False
+        self.expired = False  # gave up waiting, the slot was freed
+
+
+class LoadReport:
+    """ results of a LoadGenerator run, times in seconds
+
+    utterances answered later than timeout count as dropped
+    """
+
+    def __init__(self, requests, elapsed, schedule_lag, timeout):
+        self.elapsed = elapsed
+        self.sent = len(requests)
+        done = [r for r in requests if r.completed is not None and
+                r.completed - r.sent <= timeout]
+        self.completed = len([r for r in done if not r.failed])
+        self.failed = len([r for r in done if r.failed])
+        self.dropped = self.sent - len(done)
+        self.time_to_speak = [r.first_speak - r.sent for r in requests
+                              if r.first_speak is not None]
+        self.time_to_complete = [r.completed - r.sent for r in done
+                                 if not r.failed]
+        self.schedule_lag = schedule_lag
+
+    @property
+    def throughput(self):
+        """ completed utterances per second """
+        return self.completed / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def drop_rate(self):
+        return self.dropped / self.sent if self.sent else 0.0
+
+    @property
+    def failure_rate(self):
+        return self.failed / self.sent if self.sent else 0.0
+
+    @staticmethod
+    def _latency(samples):
+        return {"p50": percentile(samples, 50),
+                "p90": percentile(samples, 90),
+                "p99": percentile(samples, 99),
+                "max": max(samples) if samples else 0.0}
+
+    def as_dict(self):
+        return {"elapsed": self.elapsed,
+                "sent": self.sent,
+                "completed": self.completed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "throughput": self.throughput,
+                "drop_rate": self.drop_rate,
+                "failure_rate": self.failure_rate,
+                "time_to_speak": self._latency(self.time_to_speak),
+                "time_to_complete": self._latency(self.time_to_complete),
+                "schedule_lag_max": max(self.schedule_lag)
+                if self.schedule_lag else 0.0}
+
+    def summary(self):
+        """ human readable report, latencies in milliseconds """
+        d = self.as_dict()
+        lines = ["sent {sent}  completed {completed}  failed {failed}  "
+                 "dropped {dropped} ({rate:.1%})".format(
+                     rate=self.drop_rate, **d),
+                 "throughput {t:.1f} utterances/s over {e:.1f}s".format(
+                     t=self.throughput, e=self.elapsed),
+                 "{:<18}{:>9}{:>9}{:>9}{:>9}".format("ms", "p50", "p90",
+                                                     "p99", "max")]
+        for name in ("time_to_speak", "time_to_complete"):
+            lines.append("{:<18}".format(name) + "".join(
+                "{:>9.1f}".format(d[name][p] * 1000)
+                for p in ("p50", "p90", "p99", "max")))
+        if d["schedule_lag_max"] > 0.05:
+            lines.append("WARNING: sending fell {l:.0f}ms behind the target "
+                         "rate, the generator itself is saturated".format(
+                             l=d["schedule_lag_max"] * 1000))
+        return "\n".join(lines)
+
+
+class LoadGenerator:
+    """
+    drives the pipeline with utterances from a corpus
+
+    args:
+        bus: bus to inject into and listen on
+        corpus (list): utterance dicts, see load_corpus
+        rate (float): utterances per second, open loop
+        concurrency (int): utterances in flight, closed loop, used when
+                           rate is not set
+        timeout (float): seconds after which an utterance is dropped
+        lang (str): lang of utterances that do not set one
+    """
+
+    def __init__(self, bus, corpus, rate=None, concurrency=1, timeout=10,
+                 lang="en-us"):
+        if not rate and not concurrency:
+            raise ValueError("set rate or concurrency")
+        self.bus = bus
+        self.corpus = corpus
+        self.rate = rate
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.lang = lang
+        self._requests = {}
+        self._pending = deque()  # in send order, answered ones are skipped
+        self._lock = Lock()
+        self._cond = Condition(self._lock)
+        self._in_flight = 0
+
+    # replies
+    def _request(self, message):
+        ident = message.context.get(CONTEXT_KEY)
+        return self._requests.get(ident) if ident else None
+
+    def _on_speak(self, message):
+        now = time.monotonic()
+        with self._lock:
+            request = self._request(message)
+            if request is not None and request.first_speak is None:
+                request.first_speak = now
+
+    def _done(self, message, failed):
+        now = time.monotonic()
+        with self._cond:
+            request = self._request(message)
+            if request is None or request.completed is not None:
+                return
+            request.completed = now
+            request.failed = failed
+            if not request.expired:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def _on_complete(self, message):
+        self._done(message, False)
+
+    def _on_failure(self, message):
+        self._done(message, True)
+
+    # sending
+    def _send(self, n):
+        item = self.corpus[n % len(self.corpus)]
+        ident = uuid4().hex
+        message = Message(UTTERANCE,
+                          {"utterances": [item["utterance"]],
+                           "lang": item.get("lang") or self.lang},
+                          {CONTEXT_KEY: ident, "source": "loadgen",
+                           "destination": ["skills"]})
+        with self._lock:
+            request = self._requests[ident] = _Request(time.monotonic())
+            self._pending.append(request)
+            self._in_flight += 1
+        self.bus.emit(message)
+
+    def _expire(self, now):
+        """ give up on utterances older than timeout, caller holds _lock """
+        pending = self._pending
+        while pending:
+            request = pending[0]
+            if request.completed is None:
+                if now - request.sent <= self.timeout:
+                    break  # the rest was sent later
+                request.expired = True
+                self._in_flight -= 1
+            pending.popleft()
+
+    def run(self, duration=None, count=None):
+        """
+        inject utterances until duration seconds passed or count were
+        sent, then wait up to timeout for the last replies
+
+        returns a LoadReport
+        """
+        if duration is None and count is None:
+            count = len(self.corpus)
+        handlers = [(SPEAK, self._on_speak), (COMPLETE, self._on_complete),
+                    (FAILURE, self._on_failure)]
+        for msg_type, handler in handlers:
+            self.bus.on(msg_type, handler)
+        self._requests = {}
+        self._pending = deque()
+        self._in_flight = 0
+        lag = []
+        start = time.monotonic()
+        n = 0
+        try:
+            while (count is None or n < count) and \
+                    (duration is None or time.monotonic() - start < duration):
+                if self.rate:
+                    target = start + n / self.rate
+                    delay = target - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        lag.append(-delay)
+                else:
+                    with self._cond:
+                        while self._in_flight >= self.concurrency:
+                            self._expire(time.monotonic())
+                            if self._in_flight >= self.concurrency:
+                                self._cond.wait(0.05)
+                self._send(n)
+                n += 1
+            sent = time.monotonic()
+            deadline = time.monotonic() + self.timeout
+            with self._cond:
+                while self._in_flight > 0:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(min(remaining, 0.05))
+                # waiting for replies that never came is not run time
+                end = max([sent] + [r.completed for r in
+                                    self._requests.values() if r.completed])
+            elapsed = end - start
+        finally:
+            for msg_type, handler in handlers:
+                self.bus.remove(msg_type, handler)
+        with self._lock:
+            requests = list(self._requests.values())
+        return LoadReport(requests, elapsed, lag, self.timeout)
+
+
+if __name__ == "__main__":
+    import argparse
+    from ovos_utils.messagebus import get_mycroft_bus, get_websocket, \
+        get_bus_from_url
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus")
+    parser.add_argument("--rate", type=float,
+                        help="utterances per second (open loop)")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="utterances in flight (closed loop)")
+    parser.add_argument("--duration", type=float)
+    parser.add_argument("--count", type=int)
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--lang", default="en-us")
+    parser.add_argument("--url", help="bus url, default from mycroft.conf")
+    parser.add_argument("--standin", action="store_true",
+                        help="run against a local websocket bus with a "
+                             "ScriptedResponder")
+    parser.add_argument("--intent-delay", type=float, default=0.05)
+    parser.add_argument("--handler-delay", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="also save the report here")
+    args = parser.parse_args()
+
+    server = responder = responder_bus = None
+    if args.standin:
+        from ovos_utils.messagebus.server import LocalMessageBusServer
+        server = LocalMessageBusServer().start()
+        bus = get_websocket(server.host, server.port, "/core")
+        responder_bus = get_websocket(server.host, server.port, "/core")
+        for client in (bus, responder_bus):
+            client.connected_event.wait(5)
+    elif args.url:
+        bus = get_bus_from_url(args.url)
+    else:
+        bus = get_mycroft_bus()
+    if args.standin or (args.url or "").startswith("local:"):
+        responder = ScriptedResponder(responder_bus or bus,
+                                      args.intent_delay, args.handler_delay,
+                                      failure_rate=args.failure_rate,
+                                      drop_rate=args.drop_rate)
+    try:
+        generator = LoadGenerator(bus, load_corpus(args.corpus), args.rate,
+                                  args.concurrency, args.timeout, args.lang)
+        report = generator.run(args.duration, args.count)
+    finally:
+        if responder is not None:
+            responder.shutdown()
+        for client in (bus, responder_bus):
+            if client is not None:
+                client.close()
+        if server is not None:
+            server.stop()
+    print(report.summary())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report.as_dict(), f, indent=2)
@@ -0,0 +1,133 @@
+from threading import Event, Lock
+from ovos_utils.log import LOG
+
+_local_buses = {}
+_local_buses_lock = Lock()
+
+
+def get_local_bus(route="/core"):
+    """
+    Returns the process wide LocalBus for a route, every component asking
+    for the same route talks over the same in memory bus
+    """
+    with _local_buses_lock:
+        if route not in _local_buses:
+            _local_buses[route] = LocalBus()
+        return _local_buses[route]
+
+
+class LocalBus:
+    """
+    In process messagebus, API compatible with MessageBusClient
+
+    messages are dispatched in memory to the handlers of the emitting
+    process, synchronously in the thread calling emit. There is no
+    serialization, handlers receive the emitted Message object itself so
+    they must not modify it.
+
+    The raw "message" event (serialized message string) is still provided,
+    messages are only serialized if something listens to it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # accepts (and ignores) the MessageBusClient connection arguments
+        self._handlers = {}
+        self._lock = Lock()
+        self.connected_event = Event()
+        self.connected_event.set()
+        self.started_running = True
+
+    # MessageBusClient compat, there is no connection to manage
+    def run_forever(self):
+        self.started_running = True
+
+    def run_in_thread(self):
+        self.started_running = True
+        return None
+
+    def close(self):
+        """ handlers stay registered, same as MessageBusClient.close """
+        pass
+
+    # listeners
+    def on(self, event_name, func):
+        with self._lock:
+            self._handlers.setdefault(event_name, []).append((func, False))
+
+    def once(self, event_name, func):
+        with self._lock:
+            self._handlers.setdefault(event_name, []).append((func, True))
+
+    def remove(self, event_name, func):
+        with self._lock:
+            handlers = self._handlers.get(event_name, [])
+            for entry in handlers:
+                if entry[0] == func:
+                    handlers.remove(entry)
+                    break
+            if not handlers:
+                self._handlers.pop(event_name, None)
+
+    def remove_all_listeners(self, event_name):
+        with self._lock:
+            self._handlers.pop(event_name, None)
+
+    def listener_count(self, event_name):
+        return len(self._handlers.get(event_name, []))
+
+    # sending
+    def emit(self, message):
+        if "message" in self._handlers:
+            self._dispatch("message", message.serialize())
+        self._dispatch(message.msg_type, message)
+
+    def _dispatch(self, event_name, payload):
+        with self._lock:
+            handlers = self._handlers.get(event_name)
+            if not handlers:
+                return
+            if any(once for _, once in handlers):
+                remaining = [h for h in handlers if not h[1]]
+                if remaining:
+                    self._handlers[event_name] = remaining
+                else:
+                    self._handlers.pop(event_name)
+            handlers = list(handlers)
+        for func, _ in handlers:
+            try:
+                func(payload)
+            except Exception as e:
+                LOG.exception("error in {t} handler: {e}".format(
+                    t=event_name, e=e))
+
+    def wait_for_message(self, message_type, timeout=3.0):
+        """ wait for a message of a specific type, None on timeout """
+        received = []
+        event = Event()
+
+        def handler(message):
+            received.append(message)
+            event.set()
+
+        self.once(message_type, handler)
+        if not event.wait(timeout):
+            self.remove(message_type, handler)
+            return None
+        return received[0]
+
+    def wait_for_response(self, message, reply_type=None, timeout=3.0):
+        """ send a message and wait for a response, None on timeout """
+        reply_type = reply_type or message.msg_type + ".response"
+        received = []
+        event = Event()
+
+        def handler(response):
+            received.append(response)
+            event.set()
+
+        self.once(reply_type, handler)
+        self.emit(message)
+        if not event.wait(timeout):
+            self.remove(reply_type, handler)
+            return None
+        return received[0]
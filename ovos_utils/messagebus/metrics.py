@@ -0,0 +1,383 @@
+"""
+per message type metrics for bus clients
+
+    bus = instrument_bus(get_websocket("0.0.0.0", 8181, "/core"))
+    ...
+    print(bus.metrics.to_prometheus())
+
+get_mycroft_bus instruments its clients when enabled in mycroft.conf
+
+    "websocket": {
+        "instrumentation": {
+            "enabled": true,
+            "dump_path": "/tmp/bus_metrics.prom",
+            "dump_format": "prometheus",
+            "dump_interval": 60
+        }
+    }
+
+every instrumented process answers "ovos.bus.stats" with its numbers in a
+"ovos.bus.stats.response"
+"""
+from bisect import bisect_left
+from threading import Event, Lock
+from ovos_utils import create_daemon
+from ovos_utils.log import LOG
+import json
+import os
+import re
+import time
+
+# handler execution time histogram buckets, seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+_TYPE_RE = re.compile(r'^\{"type": "((?:[^"\\]|\\.)*)"')
+_metrics = None
+_metrics_lock = Lock()
+
+
+def _msg_type(serialized):
+    """ message type of a serialized message, without parsing all of it """
+    match = _TYPE_RE.match(serialized)
+    if match:
+        return match.group(1)
+    try:
+        return json.loads(serialized).get("type", "")
+    except Exception:
+        return ""
+
+
+class _TypeMetrics:
+    __slots__ = ("emitted", "emitted_bytes", "received", "received_bytes",
+                 "handled", "handler_errors", "handler_time",
+                 "handler_time_max", "buckets", "requests", "timeouts",
+                 "response_time")
+
+    def __init__(self):
+        self.emitted = 0
+        self.emitted_bytes = 0
+        self.received = 0
+        self.received_bytes = 0
+        self.handled = 0
+        self.handler_errors = 0
+        self.handler_time = 0.0
+        self.handler_time_max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.requests = 0
+        self.timeouts = 0
+        self.response_time = 0.0
+
+    def as_dict(self):
+        answered = self.requests - self.timeouts
+        return {"emitted": self.emitted,
+                "emitted_bytes": self.emitted_bytes,
+                "received": self.received,
+                "received_bytes": self.received_bytes,
+                "handled": self.handled,
+                "handler_errors": self.handler_errors,
+                "handler_time_total": self.handler_time,
+                "handler_time_avg": self.handler_time / self.handled
+                if self.handled else 0.0,
+                "handler_time_max": self.handler_time_max,
+                "handler_time_buckets": dict(zip(
+                    [str(b) for b in BUCKETS], self.buckets)),
+                "requests": self.requests,
+                "timeouts": self.timeouts,
+                "timeout_rate": self.timeouts / self.requests
+                if self.requests else 0.0,
+                "response_time_avg": self.response_time / answered
+                if answered else 0.0}
+
+
+class BusMetrics:
+    """ thread safe per message type counters, shared by every
+    instrumented client of the process """
+
+    def __init__(self):
+        self._types = {}
+        self._lock = Lock()
+        self.started = time.time()
+        self._dump_stop = None
+
+    def _get(self, msg_type):
+        metrics = self._types.get(msg_type)
+        if metrics is None:
+            metrics = self._types[msg_type] = _TypeMetrics()
+        return metrics
+
+    # recording
+    def record_emit(self, msg_type, size=0):
+        with self._lock:
+            m = self._get(msg_type)
+            m.emitted += 1
+            m.emitted_bytes += size
+
+    def record_receive(self, msg_type, size=0):
+        with self._lock:
+            m = self._get(msg_type)
+            m.received += 1
+            m.received_bytes += size
+
+    def record_handler(self, msg_type, duration, failed=False):
+        with self._lock:
+            m = self._get(msg_type)
+            m.handled += 1
+            m.handler_time += duration
+            m.handler_time_max = max(m.handler_time_max, duration)
+            m.buckets[bisect_left(BUCKETS, duration)] += 1
+            if failed:
+                m.handler_errors += 1
+
+    def record_request(self, msg_type, duration, timed_out):
+        with self._lock:
+            m = self._get(msg_type)
+            m.requests += 1
+            if timed_out:
+                m.timeouts += 1
+            else:
+                m.response_time += duration
+
+    def reset(self):
+        with self._lock:
+            self._types = {}
+            self.started = time.time()
+
+    # reporting
+    def get_stats(self, msg_type=None):
+        """ metrics of one message type, or of all of them by type """
+        with self._lock:
+            if msg_type is not None:
+                m = self._types.get(msg_type)
+                return m.as_dict() if m else _TypeMetrics().as_dict()
+            return {"pid": os.getpid(),
+                    "uptime": time.time() - self.started,
+                    "types": {t: m.as_dict() for t, m in self._types.items()}}
+
+    def hot_types(self, n=10):
+        """ the n message types with most traffic """
+        with self._lock:
+            ranked = sorted(self._types.items(),
+                            key=lambda i: i[1].emitted + i[1].received,
+                            reverse=True)
+            return [t for t, _ in ranked[:n]]
+
+    def to_json(self):
+        return json.dumps(self.get_stats())
+
+    def to_prometheus(self):
+        """ prometheus text exposition format """
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append("# HELP ovos_bus_{n} {h}".format(n=name,
+                                                          h=help_text))
+            lines.append("# TYPE ovos_bus_{n} {k}".format(n=name, k=kind))
+            for labels, value in samples:
+                lines.append("ovos_bus_{n}{{{l}}} {v}".format(
+                    n=name, l=labels, v=value))
+
+        with self._lock:
+            types = sorted(self._types.items())
+            label = {t: 'type="{t}"'.format(t=t.replace('"', '\\"'))
+                     for t, _ in types}
+            for field, help_text in [
+                ("emitted", "messages emitted"),
+                ("emitted_bytes", "bytes emitted"),
+                ("received", "messages received"),
+                ("received_bytes", "bytes received"),
+                ("handler_errors", "handler exceptions"),
+                ("requests", "wait_for_response calls"),
+                ("timeouts", "wait_for_response timeouts")
+            ]:
+                metric(field + "_total", "counter", help_text,
+                       [(label[t], getattr(m, field)) for t, m in types])
+
+            lines.append("# HELP ovos_bus_handler_seconds handler "
+                         "execution time")
+            lines.append("# TYPE ovos_bus_handler_seconds histogram")
+            for t, m in types:
+                if not m.handled:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS, m.buckets):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else str(bound)
+                    lines.append('ovos_bus_handler_seconds_bucket{{{l},'
+                                 'le="{le}"}} {c}'.format(l=label[t], le=le,
+                                                          c=cumulative))
+                lines.append("ovos_bus_handler_seconds_sum{{{l}}} {v}".format(
+                    l=label[t], v=m.handler_time))
+                lines.append("ovos_bus_handler_seconds_count{{{l}}} {v}"
+                             .format(l=label[t], v=m.handled))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path, fmt="prometheus"):
+        """ write the metrics to a file, "prometheus" or "json" """
+        data = self.to_json() if fmt == "json" else self.to_prometheus()
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.replace(tmp, path)  # scrapers never see a half written file
+
+    def start_dump(self, path, interval=60, fmt="prometheus"):
+        """ dump to path every interval seconds in a daemon thread """
+        self.stop_dump()
+        stop = self._dump_stop = Event()
+
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    self.dump(path, fmt)
+                except Exception as e:
+                    LOG.error("bus metrics dump failed: " + str(e))
+
+        create_daemon(loop)
+
+    def stop_dump(self):
+        if self._dump_stop is not None:
+            self._dump_stop.set()
+            self._dump_stop = None
+
+
+class InstrumentedBus:
+    """
+    Wraps a bus client and records metrics for everything going through
+    it, the rest of the client API is passed through unchanged
+
+    args:
+        bus: MessageBusClient or compatible
+        metrics (BusMetrics): where to record, default process wide
+        measure_size (bool): count bytes, emitted messages are serialized
+                             one extra time to measure them
+        stats_query (bool): answer "ovos.bus.stats" on this connection
+    """
+
+    def __init__(self, bus, metrics=None, measure_size=True,
+                 stats_query=True):
+        self.bus = bus
+        self.metrics = metrics or get_bus_metrics()
+        self.measure_size = measure_size
+        self._wrappers = {}  # (event, func, once): wrapper
+        self._refs = {}  # (event, func, once): registrations of wrapper
+        self.bus.on("message", self._on_raw_message)
+        if stats_query:
+            self.bus.on("ovos.bus.stats", self._handle_stats_query)
+
+    def __getattr__(self, item):
+        return getattr(self.bus, item)
+
+    def _on_raw_message(self, serialized):
+        self.metrics.record_receive(_msg_type(serialized), len(serialized))
+
+    def _handle_stats_query(self, message):
+        self.emit(message.reply("ovos.bus.stats.response",
+                                self.metrics.get_stats()))
+
+    # sending
+    def emit(self, message):
+        size = len(message.serialize()) if self.measure_size else 0
+        self.metrics.record_emit(message.msg_type, size)
+        self.bus.emit(message)
+
+    def wait_for_response(self, message, reply_type=None, timeout=3.0):
+        size = len(message.serialize()) if self.measure_size else 0
+        self.metrics.record_emit(message.msg_type, size)
+        start = time.time()
+        response = self.bus.wait_for_response(message, reply_type, timeout)
+        self.metrics.record_request(message.msg_type, time.time() - start,
+                                    response is None)
+        return response
+
+    # listeners
+    def _wrap(self, event_name, func, once=False):
+        # the same handler can be registered several times, every
+        # registration uses the same wrapper and needs its own remove
+        key = (event_name, func, once)
+        wrapper = self._wrappers.get(key)
+        if wrapper is None:
+            metrics = self.metrics
+
+            def wrapper(*args, **kwargs):
+                if once:
+                    self._release(key)
+                start = time.time()
+                failed = True
+                try:
+                    result = func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    metrics.record_handler(event_name, time.time() - start,
+                                           failed)
+
+            self._wrappers[key] = wrapper
+        self._refs[key] = self._refs.get(key, 0) + 1
+        return wrapper
+
+    def _release(self, key):
+        """ one registration of a wrapper is gone, returns the wrapper """
+        wrapper = self._wrappers.get(key)
+        refs = self._refs.get(key, 0) - 1
+        if refs > 0:
+            self._refs[key] = refs
+        else:
+            self._refs.pop(key, None)
+            self._wrappers.pop(key, None)
+        return wrapper
+
+    def on(self, event_name, func):
+        self.bus.on(event_name, self._wrap(event_name, func))
+
+    def once(self, event_name, func):
+        self.bus.once(event_name, self._wrap(event_name, func, once=True))
+
+    def remove(self, event_name, func):
+        for once in (False, True):
+            if (event_name, func, once) in self._wrappers:
+                func = self._release((event_name, func, once))
+                break
+        self.bus.remove(event_name, func)
+
+    def remove_all_listeners(self, event_name):
+        for key in [k for k in self._wrappers if k[0] == event_name]:
+            self._wrappers.pop(key)
+            self._refs.pop(key, None)
+        self.bus.remove_all_listeners(event_name)
+        if event_name == "message":
+            self.bus.on("message", self._on_raw_message)
+
+
+def get_bus_metrics():
+    """ the process wide BusMetrics """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = BusMetrics()
+        return _metrics
+
+
+def instrument_bus(bus, config=None):
+    """ wrap a bus client in an InstrumentedBus, a client is only wrapped
+    once, shared clients such as the LocalBus return the same wrapper
+
+    args:
+        bus: bus client to wrap
+        config (dict): "instrumentation" section of the websocket config,
+                       starts the periodic dump if "dump_path" is set
+    """
+    if isinstance(bus, InstrumentedBus):
+        return bus
+    wrapper = getattr(bus, "_instrumented", None)
+    if wrapper is not None:
+        return wrapper
+    config = config or {}
+    metrics = get_bus_metrics()
+    path = config.get("dump_path")
+    if path and metrics._dump_stop is None:
+        metrics.start_dump(path, config.get("dump_interval", 60),
+                           config.get("dump_format", "prometheus"))
+    wrapper = InstrumentedBus(bus, metrics,
+                              measure_size=config.get("measure_size", True),
+                              stats_query=config.get("stats_query", True))
+    bus._instrumented = wrapper
+    return wrapper
@@ -0,0 +1,417 @@
+"""
+hold emitted messages while the bus is disconnected
+
+MessageBusClient.emit blocks while disconnected and silently drops the
+message if the connection closes during the send. OutboxBus queues
+messages instead and flushes them when the connection is back
+
+    bus = OutboxBus(get_websocket("0.0.0.0", 8181, "/core"),
+                    Outbox(max_size=500, spill_dir="~/.mycroft/outbox",
+                           ttl={"enclosure.eyes.blink": 2},
+                           priorities={"speak": PRIORITY_HIGH}))
+
+get_mycroft_bus adds an outbox when enabled in mycroft.conf
+
+    "websocket": {
+        "outbox": {
+            "enabled": true,
+            "max_size": 500,
+            "spill_dir": "~/.mycroft/outbox",
+            "default_ttl": 300,
+            "ttl": {"enclosure.eyes.blink": 2},
+            "priorities": {"speak": 0, "enclosure.eyes.blink": 2}
+        }
+    }
+"""
+from collections import deque
+from os import listdir, makedirs, remove, replace
+from os.path import expanduser, isfile, join
+from threading import Event, Lock
+from mycroft_bus_client import Message
+from ovos_utils import create_daemon
+from ovos_utils.log import LOG
+import json
+import re
+import time
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+_outboxes = {}
+_outboxes_lock = Lock()
+
+
+class Outbox:
+    """
+    Bounded store of messages waiting to be sent
+
+    messages are kept serialized in one queue per priority class, higher
+    priority (lower number) queues are sent first and every queue is sent
+    in the order it was filled.
+
+    When max_size messages are held in memory the oldest message of the
+    lowest priority class is moved to disk if spill_dir is set, otherwise
+    (or once max_disk is reached) it is dropped. Spilled messages survive
+    restarts and are sent with the next flush.
+
+    args:
+        max_size (int): messages kept in memory
+        spill_dir (str): directory for messages over max_size, None
+                         drops them instead
+        max_disk (int): messages kept on disk
+        default_ttl (float): seconds a message is worth sending, None
+                             keeps it until it is sent or dropped
+        ttl (dict): per message type ttl, overrides default_ttl
+        priorities (dict): per message type priority class
+        default_priority (int): priority of everything else
+    """
+
+    def __init__(self, max_size=500, spill_dir=None, max_disk=10000,
+                 default_ttl=None, ttl=None, priorities=None,
+                 default_priority=PRIORITY_NORMAL):
+        self.max_size = max_size
+        self.spill_dir = expanduser(spill_dir) if spill_dir else None
+        self.max_disk = max_disk
+        self.default_ttl = default_ttl
+        self.ttl = ttl or {}
+        self.priorities = priorities or {}
+        self.default_priority = default_priority
+        self._queues = {}  # priority: deque of (expires, queued_at, raw)
+        self._disk = {}  # priority: messages in the spill file
+        self._lock = Lock()
+        self.stats = {"queued": 0,
+                      "sent": 0,
+                      "spilled": 0,
+                      "dropped_overflow": 0,
+                      "dropped_expired": 0,
+                      "flushes": 0,
+                      "flush_failures": 0,
+                      "flush_time_last": 0.0,
+                      "latency_total": 0.0,
+                      "latency_max": 0.0}
+        if self.spill_dir:
+            makedirs(self.spill_dir, exist_ok=True)
+            self._load_spilled()
+
+    # disk
+    def _spill_path(self, priority):
+        return join(self.spill_dir, "outbox-{p}.jsonl".format(p=priority))
+
+    def _load_spilled(self):
+        """ count messages left on disk by a previous run """
+        for name in listdir(self.spill_dir):
+            match = re.match(r"^outbox-(\d+)\.jsonl$", name)
+            if match:
+                with open(join(self.spill_dir, name)) as f:
+                    self._disk[int(match.group(1))] = sum(1 for _ in f)
+
+    def _spill(self, priority, entry):
+        with open(self._spill_path(priority), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self._disk[priority] = self._disk.get(priority, 0) + 1
+        self.stats["spilled"] += 1
+
+    def _take_spilled(self, priority):
+        """ read and remove the spill file of a priority class """
+        if not self._disk.get(priority):
+            return []
+        path = self._spill_path(priority)
+        if not isfile(path):
+            self._disk[priority] = 0
+            return []
+        with open(path) as f:
+            entries = [tuple(json.loads(l)) for l in f if l.strip()]
+        remove(path)
+        self._disk[priority] = 0
+        return entries
+
+    def _restore_spilled(self, priority, entries):
+        """ put unsent spilled messages back in front of newer spills """
+        path = self._spill_path(priority)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            if isfile(path):
+                with open(path) as newer:
+                    f.write(newer.read())
+        replace(tmp, path)
+        self._disk[priority] = self._disk.get(priority, 0) + len(entries)
+
+    # queue
+    def __len__(self):
+        return sum(len(q) for q in self._queues.values()) + \
+            sum(self._disk.values())
+
+    @property
+    def depth(self):
+        return {"memory": sum(len(q) for q in self._queues.values()),
+                "disk": sum(self._disk.values())}
+
+    def _make_room(self):
+        # oldest message of the lowest priority class goes first
+        for priority in sorted(self._queues, reverse=True):
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            entry = queue.popleft()
+            if self.spill_dir and sum(self._disk.values()) < self.max_disk:
+                # spilled messages are older than the memory queue, so the
+                # per class order is kept
+                self._spill(priority, entry)
+            else:
+                self.stats["dropped_overflow"] += 1
+            return
+
+    def put(self, message):
+        """ queue a Message (or serialized message) for sending """
+        if isinstance(message, Message):
+            msg_type, raw = message.msg_type, message.serialize()
+        else:
+            msg_type, raw = json.loads(message).get("type", ""), message
+        now = time.time()
+        ttl = self.ttl.get(msg_type, self.default_ttl)
+        expires = now + ttl if ttl is not None else None
+        priority = self.priorities.get(msg_type, self.default_priority)
+        with self._lock:
+            if sum(len(q) for q in self._queues.values()) >= self.max_size:
+                self._make_room()
+            self._queues.setdefault(priority, deque()).append(
+                (expires, now, raw))
+            self.stats["queued"] += 1
+
+    def _next_priority(self):
+        for priority in sorted(set(self._queues) | set(self._disk)):
+            if self._disk.get(priority) or self._queues.get(priority):
+                return priority
+        return None
+
+    def flush(self, send):
+        """ send queued messages in order until the queue is empty or
+        send(raw) returns False / raises
+
+        returns True if everything was sent
+        """
+        start = time.time()
+        with self._lock:
+            self.stats["flushes"] += 1
+        while True:
+            with self._lock:
+                priority = self._next_priority()
+                if priority is None:
+                    break
+                batch = self._take_spilled(priority)
+                from_disk = bool(batch)
+                if not from_disk:
+                    batch = [self._queues[priority].popleft()]
+            for i, entry in enumerate(batch):
+                expires, queued_at, raw = entry
+                now = time.time()
+                if expires is not None and now > expires:
+                    with self._lock:
+                        self.stats["dropped_expired"] += 1
+                    continue
+                try:
+                    sent = send(raw) is not False
+                except Exception as e:
+                    LOG.debug("outbox flush interrupted: " + str(e))
+                    sent = False
+                if not sent:
+                    with self._lock:
+                        if from_disk:
+                            self._restore_spilled(priority, batch[i:])
+                        else:
+                            self._queues[priority].appendleft(entry)
+                        self.stats["flush_failures"] += 1
+                        self.stats["flush_time_last"] = time.time() - start
+                    return False
+                latency = now - queued_at
+                with self._lock:
+                    self.stats["sent"] += 1
+                    self.stats["latency_total"] += latency
+                    self.stats["latency_max"] = max(
+                        self.stats["latency_max"], latency)
+        with self._lock:
+            self.stats["flush_time_last"] = time.time() - start
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._queues = {}
+            for priority in list(self._disk):
+                self._take_spilled(priority)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update(self.depth)
+        stats["latency_avg"] = stats["latency_total"] / stats["sent"] \
+            if stats["sent"] else 0.0
+        return stats
+
+
+class OutboxBus:
+    """
+    Wraps a bus client, messages emitted while disconnected go to an
+    Outbox and are flushed in order when the connection comes back
+
+    while messages are waiting new ones are queued behind them, so the
+    receivers see them in the order they were emitted (per priority class)
+
+    MessageBusClient.emit only logs a send on a closed connection, the
+    socket is checked before and after every send and a message that may
+    not have gone out is kept, so a message can arrive twice but is not
+    lost
+
+    the client reconnects on its own, with its own backoff. A failed flush
+    is retried with exponential backoff, or right away when the client
+    reconnects
+
+    args:
+        bus: MessageBusClient or compatible
+        outbox (Outbox): where messages wait, default Outbox()
+        max_backoff (float): max seconds between flush retries
+    """
+
+    def __init__(self, bus, outbox=None, max_backoff=30):
+        self.bus = bus
+        self.outbox = outbox if outbox is not None else Outbox()
+        self.max_backoff = max_backoff
+        self.reconnects = 0
+        self._backoff = 0.5
+        self._wake = Event()
+        self._flush_lock = Lock()
+        self._flushing = False
+        self._closed = False
+        # MessageBusClient only clears connected_event in close(), the
+        # connection state is followed with the websocket events instead.
+        # Listen before reading the current state, a threaded client may
+        # connect meanwhile and its "open" must not be missed
+        self._connected = False
+        self.bus.on("open", self._on_open)
+        for event in ("close", "error", "reconnecting"):
+            self.bus.on(event, self._on_disconnect)
+        connected = getattr(self.bus, "connected_event", None)
+        if connected is None or connected.is_set():
+            self._connected = True
+        if len(self.outbox) and self.connected:
+            # leftovers spilled by a previous run
+            self._schedule_flush()
+
+    def __getattr__(self, item):
+        return getattr(self.bus, item)
+
+    @property
+    def connected(self):
+        return self._connected
+
+    def emit(self, message):
+        if self.connected and not self._flushing and not len(self.outbox):
+            if self._send_message(message):
+                return
+        self.outbox.put(message)
+        if self.connected:
+            self._schedule_flush()
+
+    def _link_up(self):
+        if not self._connected:
+            return False
+        connected = getattr(self.bus, "connected_event", None)
+        if connected is not None and not connected.is_set():
+            return False
+        # MessageBusClient, the websocket closes before "close" is emitted
+        client = getattr(self.bus, "client", None)
+        if client is not None and hasattr(client, "sock"):
+            return bool(client.sock and client.sock.connected)
+        return True
+
+    def _send_message(self, message):
+        """ emit message, False if it may not have been sent """
+        if not self._link_up():
+            return False
+        self.bus.emit(message)
+        return self._link_up()
+
+    def _send(self, raw):
+        return self._send_message(Message.deserialize(raw))
+
+    def _on_disconnect(self, message=None):
+        self._connected = False
+
+    def _on_open(self, message=None):
+        self._connected = True
+        self.reconnects += 1
+        self._backoff = 0.5
+        self._wake.set()  # skip the backoff of a failed flush
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        with self._flush_lock:
+            if self._flushing or self._closed:
+                return
+            self._flushing = True
+        create_daemon(self._flush_loop)
+
+    def _flush_loop(self):
+        """ the only thread sending queued messages, never runs on the bus
+        receive thread """
+        while not self._closed:
+            try:
+                done = self.outbox.flush(self._send)
+            except Exception as e:
+                LOG.error("outbox flush failed: " + str(e))
+                done = False
+            if done:
+                with self._flush_lock:
+                    # messages queued while the flush was finishing
+                    if not len(self.outbox):
+                        self._flushing = False
+                        return
+                continue
+            LOG.debug("outbox flush failed, retrying in {d}s".format(
+                d=self._backoff))
+            self._wake.wait(self._backoff)
+            self._wake.clear()
+            self._backoff = min(self._backoff * 2, self.max_backoff)
+        with self._flush_lock:
+            self._flushing = False
+
+    def get_stats(self):
+        stats = self.outbox.get_stats()
+        stats["reconnects"] = self.reconnects
+        return stats
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        if len(self.outbox):
+            LOG.warning("closing bus with {n} unsent messages".format(
+                n=len(self.outbox)))
+        self.bus.close()
+
+
+def outbox_from_config(config, route="/core"):
+    """ Outbox from the "outbox" section of the websocket config
+
+    outboxes spilling to disk are shared by all clients of the same route
+    in this process, so they never write to the same files
+    """
+    spill_dir = config.get("spill_dir")
+    if spill_dir:
+        spill_dir = join(expanduser(spill_dir), route.strip("/") or "root")
+        with _outboxes_lock:
+            if spill_dir in _outboxes:
+                return _outboxes[spill_dir]
+    outbox = Outbox(max_size=config.get("max_size", 500),
+                    spill_dir=spill_dir,
+                    max_disk=config.get("max_disk", 10000),
+                    default_ttl=config.get("default_ttl"),
+                    ttl=config.get("ttl"),
+                    priorities=config.get("priorities"),
+                    default_priority=config.get("default_priority",
+                                                PRIORITY_NORMAL))
+    if spill_dir:
+        with _outboxes_lock:
+            outbox = _outboxes.setdefault(spill_dir, outbox)
+    return outbox
@@ -0,0 +1,147 @@
+from threading import Lock, Timer
+from ovos_utils.log import LOG
+import time
+
+
+class _PooledConnection:
+    def __init__(self, key, client, thread=None):
+        self.key = key
+        self.client = client
+        self.thread = thread
+        self.refs = 0
+        self.last_used = time.time()
+        self.timer = None
+
+    @property
+    def alive(self):
+        """ the websocket thread is still running, the client handles
+        reconnects internally so a live thread means a usable connection """
+        if self.thread is None:
+            return True
+        return self.thread.is_alive()
+
+
+class BusConnectionPool:
+    """
+    Process wide registry of live bus connections
+
+    connections are keyed by (host, port, route, ssl) and reference counted,
+    a dead connection is replaced the next time it is acquired and
+    connections nobody is using are closed after idle_timeout seconds
+
+        pool = BusConnectionPool(get_websocket)
+        bus = pool.acquire("0.0.0.0", 8181, "/core", False)
+        bus.emit(Message("speak", {"utterance": "hello"}))
+        pool.release(bus)
+
+    """
+
+    def __init__(self, factory, idle_timeout=60):
+        """
+        args:
+            factory (callable): factory(host, port, route, ssl, threaded)
+                                returning a new bus client
+            idle_timeout (float): seconds an unused connection is kept open,
+                                  None keeps it open until close_all()
+        """
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self._connections = {}
+        self._lock = Lock()
+
+    def _connect(self, key):
+        host, port, route, ssl = key
+        client = self.factory(host, port, route, ssl, threaded=False)
+        thread = None
+        if hasattr(client, "run_in_thread"):
+            thread = client.run_in_thread()
+        LOG.debug("pooled bus connection opened: " + str(key))
+        return _PooledConnection(key, client, thread)
+
+    def acquire(self, host='0.0.0.0', port=8181, route='/core', ssl=False):
+        """ get a shared connection, call release(bus) when done with it """
+        key = (host, port, route, ssl)
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is not None and not conn.alive:
+                LOG.debug("pooled bus connection died, reconnecting: " +
+                          str(key))
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect(key)
+                self._connections[key] = conn
+            if conn.timer is not None:
+                conn.timer.cancel()
+                conn.timer = None
+            conn.refs += 1
+            conn.last_used = time.time()
+            return conn.client
+
+    def release(self, client):
+        """ return a connection to the pool
+
+        returns False if the client is not owned by this pool
+        """
+        with self._lock:
+            conn = self._find(client)
+            if conn is None:
+                return False
+            conn.refs = max(0, conn.refs - 1)
+            conn.last_used = time.time()
+            if conn.refs == 0 and self.idle_timeout is not None:
+                conn.timer = Timer(self.idle_timeout, self._evict, (conn,))
+                conn.timer.daemon = True
+                conn.timer.start()
+            return True
+
+    def owns(self, client):
+        with self._lock:
+            return self._find(client) is not None
+
+    def _find(self, client):
+        for conn in self._connections.values():
+            if conn.client is client:
+                return conn
+        return None
+
+    def _evict(self, conn):
+        with self._lock:
+            if conn.refs > 0 or self._connections.get(conn.key) is not conn:
+                return
+            if time.time() - conn.last_used < self.idle_timeout:
+                return
+            LOG.debug("closing idle bus connection: " + str(conn.key))
+            self._connections.pop(conn.key)
+            self._close(conn)
+
+    def evict_idle(self):
+        """ close every connection that is not currently in use """
+        with self._lock:
+            for key, conn in list(self._connections.items()):
+                if conn.refs == 0:
+                    self._connections.pop(key)
+                    self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        if conn.timer is not None:
+            conn.timer.cancel()
+            conn.timer = None
+        try:
+            conn.client.close()
+        except Exception as e:
+            LOG.warning("error closing pooled bus connection: " + str(e))
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections.values():
+                self._close(conn)
+            self._connections = {}
+
+    def stats(self):
+        with self._lock:
+            return {key: {"refs": conn.refs,
+                          "idle": time.time() - conn.last_used,
+                          "alive": conn.alive}
+                    for key, conn in self._connections.items()}
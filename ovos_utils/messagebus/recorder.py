@@ -0,0 +1,314 @@
+"""
+record messagebus traffic to disk and replay it later
+
+recordings are append only, messages are grouped in zlib compressed blocks
+and every block gets an entry in a sidecar index (time range, message types)
+so replays can seek straight to the interesting part of a long session
+
+    recorder = BusRecorder("session.bus", bus)
+    recorder.start()
+    ...
+    recorder.stop()
+
+    recording = BusRecording("session.bus")
+    BusReplayer(recording, bus, speed=10).replay(msg_types=["speak"])
+
+command line
+
+    python -m ovos_utils.messagebus.recorder record session.bus
+    python -m ovos_utils.messagebus.recorder replay session.bus --speed 0
+"""
+from threading import Lock, Timer
+from os.path import isfile, getsize
+from ovos_utils.log import LOG
+from ovos_utils.messagebus import Message, get_mycroft_bus
+import json
+import struct
+import time
+import zlib
+
+_HEADER = struct.Struct(">I")
+
+
+def _index_path(path):
+    return path + ".idx"
+
+
+class BusRecorder:
+    """
+    append every message seen on the bus to a compressed recording
+
+    args:
+        path (str): recording file, appended to if it exists
+        bus: bus to record, defaults to get_mycroft_bus()
+        block_size (int): messages per compressed block
+        flush_interval (float): max seconds a message waits in memory
+        level (int): zlib compression level
+    """
+
+    def __init__(self, path, bus=None, block_size=500, flush_interval=2.0,
+                 level=6):
+        self.path = path
+        self.bus = bus or get_mycroft_bus()
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.level = level
+        self.count = 0
+        self._buffer = []
+        self._lock = Lock()  # buffer, taken on the bus receive path
+        self._write_lock = Lock()  # keeps blocks in the order swapped out
+        self._timer = None
+        self._running = False
+
+    def start(self):
+        """ start recording, the raw "message" event carries every message
+        as it was received, before deserialization """
+        if not self._running:
+            self._running = True
+            self.bus.on("message", self.record)
+
+    def stop(self):
+        if self._running:
+            self.bus.remove("message", self.record)
+            self._running = False
+        self.flush()
+
+    def record(self, serialized_message, ts=None):
+        """ add a message to the recording
+
+        args:
+            serialized_message (str or Message): message to record
+            ts (float): reception time, defaults to now
+        """
+        if isinstance(serialized_message, Message):
+            msg_type = serialized_message.msg_type
+            serialized_message = serialized_message.serialize()
+        else:
+            msg_type = json.loads(serialized_message).get("type", "")
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            self._buffer.append((ts, msg_type, serialized_message))
+            self.count += 1
+            full = len(self._buffer) >= self.block_size
+            if not full and self._timer is None and self.flush_interval:
+                self._timer = Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """ write buffered messages as a new block """
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                records, self._buffer = self._buffer, []
+            if not records:
+                return
+            # compress and write without the buffer lock, record() keeps
+            # going meanwhile
+            payload = "".join("{ts:.6f}\t{t}\t{m}\n".format(ts=ts, t=t, m=m)
+                              for ts, t, m in records)
+            block = zlib.compress(payload.encode("utf-8"), self.level)
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(_HEADER.pack(len(block)))
+                f.write(block)
+            entry = {"offset": offset,
+                     "size": len(block),
+                     "start": records[0][0],
+                     "end": records[-1][0],
+                     "count": len(records),
+                     "types": sorted(set(t for _, t, _ in records))}
+            with open(_index_path(self.path), "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+class BusRecording:
+    """ read access to a recording made by BusRecorder """
+
+    def __init__(self, path):
+        self.path = path
+        self.blocks = self._load_index()
+
+    def _load_index(self):
+        idx = _index_path(self.path)
+        if isfile(idx):
+            with open(idx) as f:
+                blocks = [json.loads(l) for l in f if l.strip()]
+            # the index is written after its block, ignore a torn last line
+            size = getsize(self.path) if isfile(self.path) else 0
+            return [b for b in blocks
+                    if b["offset"] + _HEADER.size + b["size"] <= size]
+        return self.rebuild_index()
+
+    def rebuild_index(self):
+        """ scan the recording and rewrite its index """
+        LOG.info("indexing recording " + self.path)
+        blocks = []
+        with open(self.path, "rb") as f:
+            while True:
+                offset = f.tell()
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                size = _HEADER.unpack(header)[0]
+                data = f.read(size)
+                if len(data) < size:
+                    break  # torn write
+                records = list(self._parse(data))
+                blocks.append({"offset": offset,
+                               "size": size,
+                               "start": records[0][0],
+                               "end": records[-1][0],
+                               "count": len(records),
+                               "types": sorted(set(r[1] for r in records))})
+        with open(_index_path(self.path), "w") as f:
+            for b in blocks:
+                f.write(json.dumps(b) + "\n")
+        return blocks
+
+    @staticmethod
+    def _parse(block):
+        for line in zlib.decompress(block).decode("utf-8").splitlines():
+            ts, msg_type, serialized = line.split("\t", 2)
+            yield float(ts), msg_type, serialized
+
+    def __len__(self):
+        return sum(b["count"] for b in self.blocks)
+
+    @property
+    def start(self):
+        return self.blocks[0]["start"] if self.blocks else None
+
+    @property
+    def end(self):
+        return self.blocks[-1]["end"] if self.blocks else None
+
+    @property
+    def duration(self):
+        return self.end - self.start if self.blocks else 0
+
+    def message_types(self):
+        types = set()
+        for b in self.blocks:
+            types.update(b["types"])
+        return sorted(types)
+
+    def iter_messages(self, start=None, end=None, msg_types=None):
+        """ yield (timestamp, msg_type, serialized_message)
+
+        args:
+            start (float): skip messages older than this timestamp
+            end (float): stop at messages newer than this timestamp
+            msg_types (list): only these message types
+        """
+        msg_types = set(msg_types) if msg_types else None
+        with open(self.path, "rb") as f:
+            for b in self.blocks:
+                if start is not None and b["end"] < start:
+                    continue
+                if end is not None and b["start"] > end:
+                    break
+                if msg_types and msg_types.isdisjoint(b["types"]):
+                    continue
+                f.seek(b["offset"] + _HEADER.size)
+                for ts, msg_type, serialized in self._parse(f.read(b["size"])):
+                    if start is not None and ts < start:
+                        continue
+                    if end is not None and ts > end:
+                        return
+                    if msg_types and msg_type not in msg_types:
+                        continue
+                    yield ts, msg_type, serialized
+
+
+class BusReplayer:
+    """
+    re-emit a recording into a bus
+
+    args:
+        recording (BusRecording or str): what to replay
+        bus: destination bus, defaults to get_mycroft_bus()
+        speed (float): 1 is real time, 10 is ten times faster,
+                       0 or None emits as fast as possible
+    """
+
+    def __init__(self, recording, bus=None, speed=1.0):
+        if isinstance(recording, str):
+            recording = BusRecording(recording)
+        self.recording = recording
+        self.bus = bus or get_mycroft_bus()
+        self.speed = speed
+        self._stopped = False
+
+    def stop(self):
+        self._stopped = True
+
+    def replay(self, start=None, end=None, msg_types=None):
+        """ replay (a section of) the recording, blocks until done
+
+        returns stats about the replay, "max_lag" is the worst delay
+        between the scheduled and actual emit time
+        """
+        self._stopped = False
+        count = 0
+        max_lag = 0.0
+        first_ts = None
+        t0 = time.time()
+        for ts, _, serialized in self.recording.iter_messages(start, end,
+                                                              msg_types):
+            if self._stopped:
+                break
+            if self.speed:
+                if first_ts is None:
+                    first_ts = ts
+                due = t0 + (ts - first_ts) / self.speed
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+            self.bus.emit(Message.deserialize(serialized))
+            count += 1
+        elapsed = time.time() - t0
+        return {"messages": count,
+                "elapsed": elapsed,
+                "rate": count / elapsed if elapsed else 0.0,
+                "max_lag": max_lag}
+
+
+if __name__ == "__main__":
+    import argparse
+    from ovos_utils import wait_for_exit_signal
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("action", choices=["record", "replay", "info"])
+    parser.add_argument("path")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8181)
+    parser.add_argument("--route", default="/core")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--types", nargs="*")
+    args = parser.parse_args()
+
+    if args.action == "info":
+        rec = BusRecording(args.path)
+        print("messages:", len(rec))
+        print("duration: {:.1f}s".format(rec.duration))
+        print("types:", ", ".join(rec.message_types()))
+    else:
+        bus = get_mycroft_bus(args.host, args.port, args.route)
+        if args.action == "record":
+            recorder = BusRecorder(args.path, bus)
+            recorder.start()
+            wait_for_exit_signal()
+            recorder.stop()
+            print("recorded {n} messages".format(n=recorder.count))
+        else:
+            stats = BusReplayer(args.path, bus, args.speed).replay(
+                msg_types=args.types)
+            print(stats)
+        bus.close()
@@ -0,0 +1,171 @@
+"""
+pluggable Message serializers
+
+    codec = FrameCodec("msgpack", compress_threshold=4096)
+    frame = codec.encode(Message("enclosure.eyes.setpixel", {"idx": 3}))
+    message = codec.decode(frame)
+
+available backends, json is always there, the others when installed
+
+    json     stdlib
+    orjson   fastest json, same wire format as json
+    ujson    fast json, same wire format as json
+    msgpack  binary, smaller frames
+
+negotiated frames start with a flags byte, bit 0 marks a zlib compressed
+payload. The legacy codec (FrameCodec(legacy=True)) is plain json text
+without flags, what the websocket bus and old peers speak
+"""
+from mycroft_bus_client import Message
+import json
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FLAG_ZLIB = 0x01
+
+# negotiation order when both peers support several
+DEFAULT_PREFERENCE = ["orjson", "msgpack", "ujson", "json"]
+
+
+class JsonSerializer:
+    name = "json"
+    available = True
+
+    @staticmethod
+    def dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+
+    @staticmethod
+    def loads(payload):
+        return json.loads(payload)
+
+
+class OrjsonSerializer(JsonSerializer):
+    name = "orjson"
+    available = orjson is not None
+
+    @staticmethod
+    def dumps(obj):
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # eg. int dict keys, stdlib json converts them to strings
+            return json.dumps(obj).encode("utf-8")
+
+    @staticmethod
+    def loads(payload):
+        return orjson.loads(payload)
+
+
+class UjsonSerializer(JsonSerializer):
+    name = "ujson"
+    available = ujson is not None
+
+    @staticmethod
+    def dumps(obj):
+        return ujson.dumps(obj).encode("utf-8")
+
+    @staticmethod
+    def loads(payload):
+        return ujson.loads(payload)
+
+
+class MsgpackSerializer:
+    name = "msgpack"
+    available = msgpack is not None
+
+    @staticmethod
+    def dumps(obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    @staticmethod
+    def loads(payload):
+        return msgpack.unpackb(payload, raw=False)
+
+
+SERIALIZERS = {s.name: s for s in [JsonSerializer, OrjsonSerializer,
+                                   UjsonSerializer, MsgpackSerializer]}
+
+
+def get_serializer(name):
+    """ serializer by name, ValueError if unknown or not installed """
+    serializer = SERIALIZERS.get(name)
+    if serializer is None or not serializer.available:
+        raise ValueError("serializer not available: " + str(name))
+    return serializer
+
+
+def available_serializers(preference=None):
+    """ names of the installed serializers, in preference order """
+    preference = preference or DEFAULT_PREFERENCE
+    return [n for n in preference
+            if n in SERIALIZERS and SERIALIZERS[n].available]
+
+
+def negotiate(offered, preference=None):
+    """ first serializer of our preference the peer offered, "json" if
+    there is nothing in common """
+    for name in available_serializers(preference):
+        if name in offered:
+            return name
+    return "json"
+
+
+class FrameCodec:
+    """
+    Message <-> bytes for one connection
+
+    args:
+        serializer (str): serializer name
+        compress_threshold (int): zlib compress payloads of at least this
+                                  many bytes, None never compresses
+        level (int): zlib level, low levels are much faster
+        legacy (bool): plain json text frames without the flags byte
+    """
+
+    def __init__(self, serializer="json", compress_threshold=None, level=1,
+                 legacy=False):
+        self.serializer = get_serializer("json" if legacy else serializer)
+        self.compress_threshold = None if legacy else compress_threshold
+        self.level = level
+        self.legacy = legacy
+
+    @property
+    def wire_format(self):
+        """ codecs with the same wire format can read each other's frames """
+        return "legacy" if self.legacy else self.serializer.name
+
+    def encode(self, message):
+        obj = {"type": message.msg_type,
+               "data": message.data,
+               "context": message.context}
+        payload = self.serializer.dumps(obj)
+        if self.legacy:
+            return payload
+        if self.compress_threshold is not None and \
+                len(payload) >= self.compress_threshold:
+            return bytes([FLAG_ZLIB]) + zlib.compress(payload, self.level)
+        return b"\x00" + payload
+
+    def decode(self, frame):
+        if self.legacy:
+            obj = self.serializer.loads(frame)
+        else:
+            payload = frame[1:]
+            if frame[0] & FLAG_ZLIB:
+                payload = zlib.decompress(payload)
+            obj = self.serializer.loads(payload)
+        return Message(obj.get("type") or "", obj.get("data") or {},
+                       obj.get("context") or {})
@@ -0,0 +1,196 @@
+"""
+Minimal websocket messagebus stand-in
+
+Relays every text frame to every connected client, exactly like the
+mycroft-core messagebus service does, without any dependency besides the
+standard library. Meant for tests and benchmarks, it is NOT a replacement for
+the real messagebus service
+
+    server = LocalMessageBusServer(port=0)  # 0 picks a free port
+    server.start()
+    bus = get_websocket("127.0.0.1", server.port, route="/core")
+    ...
+    server.stop()
+"""
+from socketserver import ThreadingMixIn, TCPServer, StreamRequestHandler
+from threading import Lock
+from ovos_utils import create_daemon
+from ovos_utils.log import LOG
+import base64
+import hashlib
+import socket
+import struct
+
+_WS_MAGIC = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONT = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+def _unmask(payload, mask):
+    n = len(payload)
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, "big") ^
+            int.from_bytes(key, "big")).to_bytes(n, "big")
+
+
+def encode_frame(payload, opcode=OP_TEXT):
+    """ build an unmasked (server to client) websocket frame """
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + struct.pack(">H", length)
+    else:
+        header += bytes([127]) + struct.pack(">Q", length)
+    return header + payload
+
+
+class _WebsocketHandler(StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        # small frames, do not wait to coalesce them (tornado does the same)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._send_lock = Lock()
+
+    def _handshake(self):
+        headers = {}
+        request_line = self.rfile.readline()
+        if not request_line:
+            return False
+        while True:
+            line = self.rfile.readline().decode("latin-1").strip()
+            if not line:
+                break
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        key = headers.get("sec-websocket-key")
+        if not key:
+            return False
+        accept = base64.b64encode(
+            hashlib.sha1(key.encode("latin-1") + _WS_MAGIC).digest())
+        self.wfile.write(b"HTTP/1.1 101 Switching Protocols\r\n"
+                         b"Upgrade: websocket\r\n"
+                         b"Connection: Upgrade\r\n"
+                         b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        self.wfile.flush()
+        return True
+
+    def _read_exact(self, n):
+        data = self.rfile.read(n)
+        if data is None or len(data) < n:
+            raise ConnectionError("websocket closed")
+        return data
+
+    def _read_frame(self):
+        b1, b2 = self._read_exact(2)
+        fin = b1 & 0x80
+        opcode = b1 & 0x0F
+        length = b2 & 0x7F
+        if length == 126:
+            length = struct.unpack(">H", self._read_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", self._read_exact(8))[0]
+        mask = self._read_exact(4) if b2 & 0x80 else None
+        payload = self._read_exact(length)
+        if mask:
+            payload = _unmask(payload, mask)
+        return fin, opcode, payload
+
+    def send(self, payload, opcode=OP_TEXT):
+        with self._send_lock:
+            self.wfile.write(encode_frame(payload, opcode))
+            self.wfile.flush()
+
+    def handle(self):
+        if not self._handshake():
+            return
+        self.server.add_client(self)
+        fragments = []
+        try:
+            while True:
+                fin, opcode, payload = self._read_frame()
+                if opcode == OP_CLOSE:
+                    self.send(payload, OP_CLOSE)
+                    break
+                if opcode == OP_PING:
+                    self.send(payload, OP_PONG)
+                    continue
+                if opcode == OP_PONG:
+                    continue
+                fragments.append(payload)
+                if not fin:
+                    continue
+                message = b"".join(fragments)
+                fragments = []
+                self.server.broadcast(message)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.server.remove_client(self)
+
+
+class LocalMessageBusServer(ThreadingMixIn, TCPServer):
+    """ websocket relay, every message is sent to every client """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), _WebsocketHandler)
+        self.clients = []
+        self._clients_lock = Lock()
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def add_client(self, client):
+        with self._clients_lock:
+            self.clients.append(client)
+
+    def remove_client(self, client):
+        with self._clients_lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def broadcast(self, payload):
+        with self._clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.send(payload)
+            except OSError:
+                self.remove_client(client)
+
+    def start(self):
+        """ serve in a background daemon thread """
+        self._thread = create_daemon(self.serve_forever)
+        LOG.debug("local messagebus listening on {h}:{p}".format(
+            h=self.host, p=self.port))
+        return self
+
+    def stop(self):
+        """ stop serving and drop every client, like a bus restart """
+        self.shutdown()
+        self.server_close()
+        with self._clients_lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            try:
+                client.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._thread = None
@@ -0,0 +1,493 @@
+"""
+send large payloads through shared memory instead of the websocket
+
+message data above a size threshold is written to a segment in /dev/shm
+and only a small handle goes over the bus
+
+    {"type": "gui.value.set",
+     "data": {"__shm__": {"name": "ovos-shm-1234-...", "size": 812345,
+                          "crc32": 2821795316}}}
+
+receivers map the segment read only, check the checksum and get the
+original data back. Only works between processes of the same host, every
+client of the bus must use SharedMemoryBus if it is enabled
+
+    bus = SharedMemoryBus(get_websocket("0.0.0.0", 8181, "/core"),
+                          SharedMemoryStore(threshold=64 * 1024))
+
+get_mycroft_bus wraps its clients when enabled in mycroft.conf
+
+    "websocket": {
+        "shared_memory": {
+            "enabled": true,
+            "threshold": 65536,
+            "ttl": 30,
+            "msg_types": ["gui.value.set", "gui.page.show"]
+        }
+    }
+
+segments are reference counted when the number of readers is known,
+SharedMemoryStore.offload(message, readers=2) deletes the segment after
+two "ovos.shm.release" messages. A reader is a receiving SharedMemoryBus,
+usually one per process: it maps a segment once no matter how many
+handlers get the message and releases it once, the sender does not count
+itself for the echo of its own message. Everything else is garbage
+collected after ttl seconds, a reader that mapped a segment keeps its
+view after the file is deleted
+
+handlers that want the raw bytes register with decode=False and map the
+segment themselves, nothing is copied
+
+    def handle_frame(message):
+        with bus.open(message) as segment:
+            frame = numpy.frombuffer(segment.buffer, dtype=numpy.uint8)
+
+    bus.on("camera.frame", handle_frame, decode=False)
+"""
+from collections import OrderedDict
+from os import getpid, kill, listdir, remove, rename, stat
+from os.path import isdir, join
+from tempfile import gettempdir
+from threading import Event, Lock
+from uuid import uuid4
+from mycroft_bus_client import Message
+from ovos_utils import create_daemon
+from ovos_utils.log import LOG
+import json
+import mmap
+import time
+import zlib
+
+SHM_KEY = "__shm__"
+PREFIX = "ovos-shm-"
+
+
+def default_shm_dir():
+    return "/dev/shm" if isdir("/dev/shm") else gettempdir()
+
+
+def is_shm_handle(data):
+    return isinstance(data, dict) and SHM_KEY in data
+
+
+def _pid_alive(pid):
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedSegment:
+    """
+    read only memory mapped view of a segment
+
+    buffer is a memoryview over the mapping, valid until close(). No copy
+    is made unless the caller asks for one with bytes(), json() decodes
+    straight from the mapping
+
+        with store.open(handle) as segment:
+            audio = numpy.frombuffer(segment.buffer, dtype=numpy.int16)
+    """
+
+    def __init__(self, path, handle):
+        self.path = path
+        self.handle = handle
+        self._mmap = None
+        with open(path, "rb") as f:
+            if handle.get("size"):
+                self._mmap = mmap.mmap(f.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self._mmap if self._mmap else b"")
+        crc = handle.get("crc32")
+        if crc is not None and zlib.crc32(self.buffer) != crc:
+            self.close()
+            raise ValueError("shared memory segment corrupted: " + path)
+
+    def bytes(self):
+        """ copy of the payload, outlives the segment """
+        return self.buffer.tobytes()
+
+    def json(self):
+        return json.loads(str(self.buffer, "utf-8"))
+
+    def close(self):
+        self.buffer.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SharedMemoryStore:
+    """
+    writes, opens and garbage collects shared memory segments
+
+    args:
+        directory (str): where segments live, default /dev/shm
+        threshold (int): serialized data size in bytes above which
+                         offload() moves the data to a segment
+        ttl (float): seconds a segment lives unless all its readers
+                     released it earlier
+        msg_types (list): only offload these message types, None checks
+                          every message, which costs one extra
+                          serialization of its data
+    """
+
+    def __init__(self, directory=None, threshold=64 * 1024, ttl=30,
+                 msg_types=None):
+        self.directory = directory or default_shm_dir()
+        self.threshold = threshold
+        self.ttl = ttl
+        self.msg_types = set(msg_types) if msg_types else None
+        self._segments = {}  # name: [created, readers, releases]
+        self._lock = Lock()
+        self._gc_stop = None
+        self.stats = {"offloaded": 0,
+                      "offloaded_bytes": 0,
+                      "resolved": 0,
+                      "checksum_errors": 0,
+                      "missing": 0,
+                      "collected": 0}
+
+    # segments
+    def put(self, payload, readers=None, origin=None):
+        """ write bytes to a new segment, returns its handle
+
+        origin identifies the sender, its own echo is not counted as a
+        reader """
+        name = "{p}{pid}-{u}".format(p=PREFIX, pid=getpid(), u=uuid4().hex)
+        path = join(self.directory, name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(payload)
+        # readers never see a partially written segment
+        rename(path + ".tmp", path)
+        handle = {"name": name,
+                  "size": len(payload),
+                  "crc32": zlib.crc32(payload)}
+        if readers:
+            handle["readers"] = readers
+        if origin:
+            handle["origin"] = origin
+        with self._lock:
+            self._segments[name] = [time.time(), readers, 0]
+        return handle
+
+    def open(self, handle):
+        """ map a segment, returns a SharedSegment """
+        name = handle["name"]
+        if "/" in name or not name.startswith(PREFIX):
+            raise ValueError("invalid shared memory handle: " + name)
+        return SharedSegment(join(self.directory, name), handle)
+
+    def read(self, handle):
+        """ bytes of a segment """
+        with self.open(handle) as segment:
+            return segment.buffer.tobytes()
+
+    def release(self, name):
+        """ a reader is done, the segment is deleted once every
+        expected reader released it """
+        with self._lock:
+            segment = self._segments.get(name)
+            if segment is None:
+                return
+            segment[2] += 1
+            done = segment[1] and segment[2] >= segment[1]
+            if done:
+                self._segments.pop(name)
+        if done:
+            self._delete(name)
+
+    def _delete(self, name):
+        try:
+            remove(join(self.directory, name))
+        except FileNotFoundError:
+            pass
+        else:
+            self.stats["collected"] += 1
+
+    def collect(self):
+        """ delete expired segments, including segments left behind by
+        processes that died """
+        now = time.time()
+        with self._lock:
+            expired = [n for n, s in self._segments.items()
+                       if now - s[0] > self.ttl]
+            for name in expired:
+                self._segments.pop(name)
+        for name in expired:
+            self._delete(name)
+        pid = getpid()
+        for name in listdir(self.directory):
+            if not name.startswith(PREFIX):
+                continue
+            try:
+                owner = int(name[len(PREFIX):].split("-")[0])
+                if owner == pid or _pid_alive(owner):
+                    continue
+                if now - stat(join(self.directory, name)).st_mtime > \
+                        self.ttl:
+                    self._delete(name)
+            except (ValueError, OSError):
+                continue
+        return len(expired)
+
+    def start_gc(self, interval=None):
+        """ run collect() periodically in a daemon thread """
+        self.stop_gc()
+        stop = self._gc_stop = Event()
+        interval = interval or max(self.ttl / 2, 1)
+
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    self.collect()
+                except Exception as e:
+                    LOG.error("shared memory gc failed: " + str(e))
+
+        create_daemon(loop)
+
+    def stop_gc(self):
+        if self._gc_stop is not None:
+            self._gc_stop.set()
+            self._gc_stop = None
+
+    def close(self):
+        """ delete every segment created by this store """
+        self.stop_gc()
+        with self._lock:
+            names, self._segments = list(self._segments), {}
+        for name in names:
+            self._delete(name)
+
+    # messages
+    def offload(self, message, readers=None, origin=None):
+        """ returns message with its data moved to a segment if it is above
+        the threshold, the original message is not modified """
+        if self.msg_types is not None and \
+                message.msg_type not in self.msg_types:
+            return message
+        if is_shm_handle(message.data):
+            return message
+        payload = json.dumps(message.data).encode("utf-8")
+        if len(payload) < self.threshold:
+            return message
+        handle = self.put(payload, readers, origin)
+        self.stats["offloaded"] += 1
+        self.stats["offloaded_bytes"] += len(payload)
+        return Message(message.msg_type, {SHM_KEY: handle}, message.context)
+
+    def resolve(self, message):
+        """ returns message with the data of its segment, or message itself
+        if it carries no handle """
+        if not isinstance(message, Message) or \
+                not is_shm_handle(message.data):
+            return message
+        handle = message.data[SHM_KEY]
+        try:
+            with self.open(handle) as segment:
+                data = segment.json()
+        except FileNotFoundError:
+            self.stats["missing"] += 1
+            raise
+        except ValueError:
+            self.stats["checksum_errors"] += 1
+            raise
+        self.stats["resolved"] += 1
+        return Message(message.msg_type, data, message.context)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["segments"] = len(self._segments)
+        return stats
+
+
+class SharedMemoryBus:
+    """
+    Wraps a bus client, large messages are emitted as shared memory
+    handles and handlers receive them with their data restored
+
+    a received segment is read once and shared by every handler, and
+    released once
+
+    args:
+        bus: MessageBusClient or compatible
+        store (SharedMemoryStore): default SharedMemoryStore()
+        memo_size (int): number of resolved messages remembered
+    """
+
+    def __init__(self, bus, store=None, memo_size=64):
+        self.bus = bus
+        self.store = store if store is not None else SharedMemoryStore()
+        self.origin = uuid4().hex
+        self.memo_size = memo_size
+        self._wrappers = {}  # (event, func, once, decode): wrapper
+        self._refs = {}  # (event, func, once, decode): registrations
+        self._resolved = OrderedDict()  # segment name: resolved Message
+        self._released = OrderedDict()  # segment name: True
+        self._lock = Lock()
+        self.bus.on("ovos.shm.release", self._handle_release)
+        self.store.start_gc()
+
+    def __getattr__(self, item):
+        return getattr(self.bus, item)
+
+    def _handle_release(self, message):
+        self.store.release(message.data.get("name"))
+
+    def _release(self, handle):
+        # once per segment, never for our own messages
+        if not handle.get("readers") or handle.get("origin") == self.origin:
+            return
+        with self._lock:
+            if handle["name"] in self._released:
+                return
+            self._released[handle["name"]] = True
+            if len(self._released) > self.memo_size:
+                self._released.popitem(last=False)
+        self.bus.emit(Message("ovos.shm.release", {"name": handle["name"]}))
+
+    def _remember(self, name, message):
+        with self._lock:
+            self._resolved[name] = message
+            if len(self._resolved) > self.memo_size:
+                self._resolved.popitem(last=False)
+
+    def _offload(self, message, readers=None):
+        offloaded = self.store.offload(message, readers, self.origin)
+        if offloaded is not message:
+            # our own echo never needs the segment
+            self._remember(offloaded.data[SHM_KEY]["name"], message)
+        return offloaded
+
+    def _resolve(self, message):
+        if not isinstance(message, Message) or \
+                not is_shm_handle(message.data):
+            return message
+        handle = message.data[SHM_KEY]
+        with self._lock:
+            resolved = self._resolved.get(handle["name"])
+        if resolved is None:
+            resolved = self.store.resolve(message)
+            self._remember(handle["name"], resolved)
+            self._release(handle)
+        return resolved
+
+    def _resolve_raw(self, serialized):
+        # raw "message" listeners get the serialized string, restore the
+        # data there too, only messages carrying a handle are parsed
+        if SHM_KEY not in serialized:
+            return serialized
+        message = Message.deserialize(serialized)
+        resolved = self._resolve(message)
+        return serialized if resolved is message else resolved.serialize()
+
+    def open(self, message):
+        """ map the segment of a message received with decode=False,
+        returns a SharedSegment to close when done """
+        handle = message.data[SHM_KEY]
+        segment = self.store.open(handle)
+        self._release(handle)
+        return segment
+
+    # sending
+    def emit(self, message, readers=None):
+        """ readers: number of receiving SharedMemoryBus (processes) that
+        will release the segment, it is deleted as soon as all of them
+        did """
+        self.bus.emit(self._offload(message, readers))
+
+    def wait_for_response(self, message, reply_type=None, timeout=3.0):
+        response = self.bus.wait_for_response(self._offload(message),
+                                              reply_type, timeout)
+        return self._resolve(response) if response is not None else None
+
+    def wait_for_message(self, message_type, timeout=3.0):
+        message = self.bus.wait_for_message(message_type, timeout)
+        return self._resolve(message) if message is not None else None
+
+    # listeners
+    def _wrap(self, event_name, func, once=False, decode=True):
+        # the same handler can be registered several times, every
+        # registration uses the same wrapper and needs its own remove
+        key = (event_name, func, once, decode)
+        wrapper = self._wrappers.get(key)
+        if wrapper is None:
+            def wrapper(*args):
+                if once:
+                    self._release_wrapper(key)
+                if args and decode:
+                    try:
+                        if isinstance(args[0], str):
+                            first = self._resolve_raw(args[0])
+                        else:
+                            first = self._resolve(args[0])
+                    except (OSError, ValueError) as e:
+                        LOG.error("could not read shared memory payload of "
+                                  "{t}: {e}".format(t=event_name, e=e))
+                        return
+                    args = (first,) + args[1:]
+                return func(*args)
+
+            self._wrappers[key] = wrapper
+        self._refs[key] = self._refs.get(key, 0) + 1
+        return wrapper
+
+    def _release_wrapper(self, key):
+        """ one registration of a wrapper is gone, returns the wrapper """
+        wrapper = self._wrappers.get(key)
+        refs = self._refs.get(key, 0) - 1
+        if refs > 0:
+            self._refs[key] = refs
+        else:
+            self._refs.pop(key, None)
+            self._wrappers.pop(key, None)
+        return wrapper
+
+    def on(self, event_name, func, decode=True):
+        """ decode=False passes messages with their handle, see open()
+
+        raw "message" listeners get the serialized message with its data
+        restored, decode=False passes the handle unresolved """
+        self.bus.on(event_name, self._wrap(event_name, func, decode=decode))
+
+    def once(self, event_name, func, decode=True):
+        self.bus.once(event_name, self._wrap(event_name, func, once=True,
+                                             decode=decode))
+
+    def remove(self, event_name, func):
+        for once in (False, True):
+            for decode in (True, False):
+                if (event_name, func, once, decode) in self._wrappers:
+                    self.bus.remove(event_name, self._release_wrapper(
+                        (event_name, func, once, decode)))
+                    return
+        self.bus.remove(event_name, func)
+
+    def remove_all_listeners(self, event_name):
+        for key in [k for k in self._wrappers if k[0] == event_name]:
+            self._wrappers.pop(key)
+            self._refs.pop(key, None)
+        self.bus.remove_all_listeners(event_name)
+        if event_name == "ovos.shm.release":
+            self.bus.on("ovos.shm.release", self._handle_release)
+
+    def close(self):
+        self.store.close()
+        self.bus.close()
+
+
+def store_from_config(config):
+    """ SharedMemoryStore from the "shared_memory" websocket config """
+    return SharedMemoryStore(directory=config.get("directory"),
+                             threshold=config.get("threshold", 64 * 1024),
+                             ttl=config.get("ttl", 30),
+                             msg_types=config.get("msg_types"))
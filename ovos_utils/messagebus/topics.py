@@ -0,0 +1,238 @@
+from mycroft_bus_client import Message
+from threading import Lock
+from weakref import WeakKeyDictionary, proxy
+from ovos_utils.log import LOG
+import re
+
+_SEPARATORS = re.compile(r"([.:])")
+_routers = WeakKeyDictionary()
+_routers_lock = Lock()
+
+
+def is_pattern(msg_type):
+    return "*" in msg_type
+
+
+def _tokenize(msg_type):
+    """ "recognizer_loop:record_begin" -> ["recognizer_loop", ":",
+    "record_begin"], separators are kept so "a.*" does not match "a:b" """
+    return [t for t in _SEPARATORS.split(msg_type) if t]
+
+
+class _Node:
+    __slots__ = ("children", "values", "rest")
+
+    def __init__(self):
+        self.children = {}
+        self.values = []  # patterns ending at this node
+        self.rest = []  # patterns ending with a trailing "*" after this node
+
+
+class TopicTrie:
+    """
+    message type patterns -> values, matched segment by segment
+
+    patterns are message types split on "." and ":", a "*" matches one
+    segment, a trailing "*" matches everything below that prefix.
+    Lookups are cached, the cache is cleared whenever a pattern changes
+
+        trie = TopicTrie()
+        trie.add("enclosure.eyes.*", "bulk")
+        trie.match("enclosure.eyes.blink")  # ("bulk",)
+    """
+    cache_size = 1024
+
+    def __init__(self):
+        self._root = _Node()
+        self._lock = Lock()
+        self._cache = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _split(pattern):
+        tokens = _tokenize(pattern)
+        trailing = bool(tokens) and tokens[-1] == "*"
+        if trailing:
+            tokens = tokens[:-1]
+        return tokens, trailing
+
+    def add(self, pattern, value):
+        tokens, trailing = self._split(pattern)
+        with self._lock:
+            node = self._root
+            for token in tokens:
+                node = node.children.setdefault(token, _Node())
+            if trailing:
+                node.rest.append(value)
+            else:
+                node.values.append(value)
+            self._size += 1
+            self._cache.clear()
+
+    def discard(self, pattern, value):
+        tokens, trailing = self._split(pattern)
+        with self._lock:
+            path = [self._root]
+            for token in tokens:
+                node = path[-1].children.get(token)
+                if node is None:
+                    return
+                path.append(node)
+            values = path[-1].rest if trailing else path[-1].values
+            if value not in values:
+                return
+            values.remove(value)
+            self._size -= 1
+            self._cache.clear()
+            # prune empty branches
+            for parent, token, node in reversed(list(zip(path, tokens,
+                                                         path[1:]))):
+                if node.children or node.values or node.rest:
+                    break
+                del parent.children[token]
+
+    def _walk(self, node, tokens, i, found):
+        if node.rest and i < len(tokens):
+            found.extend(node.rest)
+        if i == len(tokens):
+            found.extend(node.values)
+            return
+        token = tokens[i]
+        child = node.children.get(token)
+        if child is not None:
+            self._walk(child, tokens, i + 1, found)
+        if token not in (".", ":"):
+            star = node.children.get("*")
+            if star is not None:
+                self._walk(star, tokens, i + 1, found)
+
+    def match(self, msg_type):
+        """ values of the patterns matching msg_type """
+        values = self._cache.get(msg_type)
+        if values is None:
+            found = []
+            with self._lock:
+                self._walk(self._root, _tokenize(msg_type), 0, found)
+                if len(self._cache) >= self.cache_size:
+                    self._cache.clear()
+                values = self._cache[msg_type] = tuple(found)
+        return values
+
+
+class TopicRouter:
+    """
+    Wildcard subscriptions for the messagebus
+
+    patterns are message types split on "." and ":", a "*" matches one
+    segment, a trailing "*" matches everything below that prefix
+
+        "enclosure.eyes.*"    enclosure.eyes.on, enclosure.eyes.color
+        "enclosure.*.reset"   enclosure.eyes.reset, enclosure.mouth.reset
+        "recognizer_loop:*"   recognizer_loop:record_begin, ...
+        "*"                   every message
+
+    patterns are kept in a trie and the handlers matching a message type
+    are cached (see TopicTrie), so dispatch does not get slower as
+    patterns are added.
+    Plain message types are passed straight to bus.on
+
+    subscriptions can be grouped by owner and removed in one call
+
+        router = get_topic_router(bus)
+        router.subscribe_many({"enclosure.eyes.*": self.handle_eyes,
+                               "recognizer_loop:*": self.handle_audio},
+                              owner=self)
+        ...
+        router.unsubscribe_owner(self)
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self._trie = TopicTrie()
+        self._lock = Lock()
+        self._subscriptions = []  # (pattern, handler, owner)
+        self._listening = False
+
+    def match(self, msg_type):
+        """ handlers of the wildcard patterns matching msg_type """
+        return self._trie.match(msg_type)
+
+    # bus
+    def _on_message(self, serialized):
+        if not len(self._trie):
+            return
+        message = Message.deserialize(serialized)
+        for handler in self.match(message.msg_type):
+            try:
+                handler(message)
+            except Exception as e:
+                LOG.exception("error in {t} handler: {e}".format(
+                    t=message.msg_type, e=e))
+
+    def _listen(self):
+        if not self._listening:
+            self.bus.on("message", self._on_message)
+            self._listening = True
+
+    def subscribe(self, pattern, handler, owner=None):
+        """ call handler(message) for every message matching pattern """
+        with self._lock:
+            self._subscriptions.append((pattern, handler, owner))
+            if is_pattern(pattern):
+                self._trie.add(pattern, handler)
+        if is_pattern(pattern):
+            self._listen()
+        else:
+            self.bus.on(pattern, handler)
+
+    def subscribe_many(self, subscriptions, owner=None):
+        """ subscribe a {pattern: handler} dict or (pattern, handler) list """
+        if isinstance(subscriptions, dict):
+            subscriptions = subscriptions.items()
+        for pattern, handler in subscriptions:
+            self.subscribe(pattern, handler, owner)
+
+    def unsubscribe(self, pattern, handler):
+        with self._lock:
+            entry = next((s for s in self._subscriptions
+                          if s[0] == pattern and s[1] == handler), None)
+            if entry is None:
+                return
+            self._subscriptions.remove(entry)
+            if is_pattern(pattern):
+                self._trie.discard(pattern, handler)
+        if not is_pattern(pattern):
+            self.bus.remove(pattern, handler)
+
+    def unsubscribe_owner(self, owner):
+        """ remove every subscription made with this owner """
+        for pattern, handler, o in list(self._subscriptions):
+            if o is owner:
+                self.unsubscribe(pattern, handler)
+
+    def unsubscribe_all(self):
+        for pattern, handler, _ in list(self._subscriptions):
+            self.unsubscribe(pattern, handler)
+
+    @property
+    def subscriptions(self):
+        return [(p, h) for p, h, _ in self._subscriptions]
+
+    def shutdown(self):
+        self.unsubscribe_all()
+        if self._listening:
+            self.bus.remove("message", self._on_message)
+            self._listening = False
+
+
+def get_topic_router(bus):
+    """ the TopicRouter of a bus connection, created on first use """
+    with _routers_lock:
+        router = _routers.get(bus)
+        if router is None:
+            # a proxy, a strong reference would keep the key alive forever
+            router = _routers[bus] = TopicRouter(proxy(bus))
+        return router
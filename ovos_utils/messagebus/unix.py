@@ -0,0 +1,433 @@
+"""
+messagebus over a unix domain socket
+
+same Message semantics as the websocket bus, every message sent by a
+client is relayed to every client (sender included), but without TCP and
+websocket framing. Messages are sent as a 4 byte big endian length
+followed by the serialized message
+
+    server = UnixMessageBusServer("/tmp/mycroft/bus.sock").start()
+    bus = UnixBusClient("/tmp/mycroft/bus.sock")
+    bus.run_in_thread()
+
+select it in mycroft.conf, get_mycroft_bus then returns UnixBusClients
+
+    "websocket": {
+        "transport": "unix",
+        "unix_path": "/tmp/mycroft/bus.sock"
+    }
+
+or by url, get_bus_from_url("unix:///tmp/mycroft/bus.sock")
+
+only processes on the same device can use it, and they only see each
+other, not websocket clients
+
+clients and server negotiate the serializer when connecting, see
+ovos_utils.messagebus.serialization. The client sends a json
+"ovos.bus.hello" listing the formats it supports and the server answers
+"ovos.bus.hello.ack" with the format to use. A client that does not say
+hello, or a legacy server that relays the hello back, means plain json
+frames. A client that gets no answer within hello_timeout reconnects. The
+server converts between formats when peers speak different ones
+
+command line
+
+    python -m ovos_utils.messagebus.unix /tmp/mycroft/bus.sock
+"""
+from concurrent.futures import ThreadPoolExecutor
+from os import makedirs, remove
+from os.path import dirname, exists, join
+from socketserver import ThreadingMixIn, UnixStreamServer, \
+    StreamRequestHandler
+from tempfile import gettempdir
+from threading import Lock
+from uuid import uuid4
+from mycroft_bus_client import Message
+from ovos_utils import create_daemon
+from ovos_utils.log import LOG
+from ovos_utils.messagebus.local import LocalBus
+from ovos_utils.messagebus.serialization import FrameCodec, \
+    available_serializers, negotiate
+import socket
+import struct
+import time
+
+DEFAULT_UNIX_PATH = join(gettempdir(), "mycroft", "bus.sock")
+MAX_FRAME = 64 * 1024 * 1024
+HELLO = "ovos.bus.hello"
+HELLO_ACK = "ovos.bus.hello.ack"
+
+_HEADER = struct.Struct(">I")
+
+
+def encode_frame(serialized):
+    if isinstance(serialized, str):
+        serialized = serialized.encode("utf-8")
+    return _HEADER.pack(len(serialized)) + serialized
+
+
+def _read_exact(rfile, n):
+    data = rfile.read(n)
+    if len(data) < n:
+        raise ConnectionError("connection closed")
+    return data
+
+
+def read_frame(rfile):
+    """ next frame payload from a buffered binary file """
+    length = _HEADER.unpack(_read_exact(rfile, _HEADER.size))[0]
+    if length > MAX_FRAME:
+        raise ConnectionError("frame too large: " + str(length))
+    return _read_exact(rfile, length)
+
+
+def _recv_exact(sock, n, deadline):
+    # unbuffered, never reads past the frame, so a file opened on the
+    # socket afterwards starts at the next frame
+    data = b""
+    while len(data) < n:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise socket.timeout("timed out")
+        sock.settimeout(remaining)
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
+
+
+def _recv_frame(sock, deadline):
+    """ next frame payload read straight from the socket, raises
+    socket.timeout after deadline """
+    length = _HEADER.unpack(_recv_exact(sock, _HEADER.size, deadline))[0]
+    if length > MAX_FRAME:
+        raise ConnectionError("frame too large: " + str(length))
+    return _recv_exact(sock, length, deadline)
+
+
+class _UnixBusHandler(StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self._send_lock = Lock()
+        self.codec = FrameCodec(legacy=True)
+
+    def send(self, frame):
+        with self._send_lock:
+            self.wfile.write(frame)
+            self.wfile.flush()
+
+    def _hello(self, payload):
+        """ negotiate the format if payload is a hello, returns False for
+        the first message of a legacy client """
+        try:
+            message = self.codec.decode(payload)
+        except ValueError:
+            return False
+        if message.msg_type != HELLO:
+            return False
+        formats = message.data.get("formats") or []
+        name = negotiate(formats, self.server.preference)
+        zlib = "zlib" in (message.data.get("compression") or [])
+        ack = encode_frame(self.codec.encode(Message(
+            HELLO_ACK, {"format": name,
+                        "compression": "zlib" if zlib else None,
+                        "nonce": message.data.get("nonce")})))
+        # the client may emit as soon as it has the ack, it must already
+        # receive broadcasts by then. Broadcasts wait for the send lock,
+        # so none goes out in the new format before the ack
+        with self._send_lock:
+            self.codec = FrameCodec(name, self.server.compress_threshold
+                                    if zlib else None)
+            self.server.add_client(self)
+            self.wfile.write(ack)
+            self.wfile.flush()
+        return True
+
+    def handle(self):
+        try:
+            payload = read_frame(self.rfile)
+            if not self._hello(payload):
+                self.server.add_client(self)
+                self.server.broadcast(payload, self.codec)
+            while True:
+                payload = read_frame(self.rfile)
+                self.server.broadcast(payload, self.codec)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.server.remove_client(self)
+
+
+class UnixMessageBusServer(ThreadingMixIn, UnixStreamServer):
+    """ relays every message to every client of the socket """
+    daemon_threads = True
+
+    def __init__(self, path=DEFAULT_UNIX_PATH, preference=None,
+                 compress_threshold=None):
+        """
+        args:
+            path (str): socket path
+            preference (list): serializer names in negotiation order
+            compress_threshold (int): compress frames of at least this
+                                      many bytes sent to clients that
+                                      support it
+        """
+        makedirs(dirname(path) or ".", exist_ok=True)
+        if exists(path):
+            remove(path)  # stale socket of a previous run
+        super().__init__(path, _UnixBusHandler)
+        self.path = path
+        self.preference = preference
+        self.compress_threshold = compress_threshold
+        self.clients = []
+        self._clients_lock = Lock()
+        self._thread = None
+
+    def add_client(self, client):
+        with self._clients_lock:
+            self.clients.append(client)
+
+    def remove_client(self, client):
+        with self._clients_lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def broadcast(self, payload, codec):
+        """ send a frame payload encoded with codec to every client, each
+        in its own format, converted at most once per format """
+        with self._clients_lock:
+            clients = list(self.clients)
+        frames = {codec.wire_format: encode_frame(payload)}
+        message = None
+        for client in clients:
+            wire_format = client.codec.wire_format
+            if wire_format not in frames:
+                if message is None:
+                    try:
+                        message = codec.decode(payload)
+                    except Exception as e:
+                        LOG.error("undecodable frame: " + str(e))
+                        return
+                try:
+                    frames[wire_format] = encode_frame(
+                        client.codec.encode(message))
+                except (TypeError, ValueError) as e:
+                    # e.g. msgpack bytes for a json client, the clients
+                    # of other formats still get the message
+                    LOG.error("can not send {t} as {f}: {e}".format(
+                        t=message.msg_type, f=wire_format, e=e))
+                    frames[wire_format] = None
+            frame = frames[wire_format]
+            if frame is None:
+                continue
+            try:
+                client.send(frame)
+            except OSError:
+                self.remove_client(client)
+
+    def start(self):
+        """ serve in a background daemon thread """
+        self._thread = create_daemon(self.serve_forever)
+        LOG.debug("unix messagebus listening on " + self.path)
+        return self
+
+    def stop(self):
+        """ stop serving and drop every client """
+        self.shutdown()
+        self.server_close()
+        with self._clients_lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            try:
+                client.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if exists(self.path):
+            remove(self.path)
+        self._thread = None
+
+
+class UnixBusClient(LocalBus):
+    """
+    MessageBusClient compatible client for UnixMessageBusServer
+
+    emitted messages go through the server, handlers run on a thread pool
+    like the websocket client so they can wait for responses themselves.
+    Reconnects with backoff and emits "open", "close" and "reconnecting"
+    like MessageBusClient
+
+    args:
+        path (str): socket path
+        max_workers (int): handler threads
+        formats (list): serializers to offer, in preference order,
+                        default every installed one
+        compress_threshold (int): compress frames of at least this many
+                                  bytes, None never compresses
+        hello_timeout (float): seconds to wait for the server to answer
+                               the hello before dropping the connection
+                               and reconnecting
+    """
+
+    def __init__(self, path=DEFAULT_UNIX_PATH, max_workers=8, formats=None,
+                 compress_threshold=None, hello_timeout=1.0):
+        super().__init__()
+        self.path = path
+        self.formats = available_serializers(formats)
+        self.compress_threshold = compress_threshold
+        self.hello_timeout = hello_timeout
+        self.codec = FrameCodec(legacy=True)
+        self.connected_event.clear()
+        self.started_running = False
+        self.retry = 1
+        self._sock = None
+        self._send_lock = Lock()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    # connection
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._negotiate(sock)
+        rfile = sock.makefile("rb")
+        self.connected_event.set()
+        self.retry = 1
+        LOG.debug("connected to {p} ({f})".format(
+            p=self.path, f=self.codec.wire_format))
+        self._dispatch_event("open")
+        return rfile
+
+    def _negotiate(self, sock):
+        legacy = FrameCodec(legacy=True)
+        self.codec = legacy
+        nonce = uuid4().hex
+        hello = Message(HELLO, {"formats": self.formats,
+                                "compression": ["zlib"],
+                                "nonce": nonce})
+        sock.sendall(encode_frame(legacy.encode(hello)))
+        deadline = time.time() + self.hello_timeout
+        try:
+            while True:
+                message = legacy.decode(_recv_frame(sock, deadline))
+                if message.data.get("nonce") == nonce:
+                    break
+                # a legacy server relays other clients' messages meanwhile
+                self._submit(self._dispatch_message, message)
+        except socket.timeout:
+            # the server may still switch formats with a late ack, json
+            # frames would then be misread, start over on a new connection
+            raise ConnectionError("no answer to the bus hello")
+        finally:
+            sock.settimeout(None)
+        if message.msg_type == HELLO_ACK:
+            zlib = message.data.get("compression") == "zlib"
+            self.codec = FrameCodec(message.data.get("format") or "json",
+                                    self.compress_threshold if zlib
+                                    else None)
+        # else a legacy server relayed our own hello back, keep json
+
+    def _disconnect(self):
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def run_forever(self):
+        self.started_running = True
+        while not self._closed:
+            try:
+                with self._connect() as rfile:
+                    while True:
+                        self._on_frame(read_frame(rfile))
+            except (ConnectionError, OSError) as e:
+                self._disconnect()
+                if self._closed:
+                    break
+                self.connected_event.clear()
+                self._dispatch_event("close")
+                LOG.warning("unix bus connection lost ({e}), reconnecting "
+                            "in {r}s".format(e=e, r=self.retry))
+                time.sleep(self.retry)
+                self.retry = min(self.retry * 2, 60)
+                self._dispatch_event("reconnecting")
+
+    def run_in_thread(self):
+        return create_daemon(self.run_forever)
+
+    def close(self):
+        self._closed = True
+        self.connected_event.clear()
+        self._disconnect()
+        self._executor.shutdown(wait=False)
+
+    # receiving
+    def _submit(self, func, *args):
+        try:
+            self._executor.submit(func, *args)
+        except RuntimeError:
+            pass  # closed, the executor does not take new work
+
+    def _dispatch_event(self, event_name):
+        if event_name in self._handlers:
+            self._submit(self._dispatch, event_name, None)
+
+    def _on_frame(self, payload):
+        try:
+            message = self.codec.decode(payload)
+        except Exception as e:
+            LOG.error("undecodable frame: " + str(e))
+            return
+        self._submit(self._dispatch_message, message)
+
+    def _dispatch_message(self, message):
+        if "message" in self._handlers:
+            self._dispatch("message", message.serialize())
+        self._dispatch(message.msg_type, message)
+
+    # sending
+    def emit(self, message):
+        if not self.connected_event.wait(10):
+            if not self.started_running:
+                raise ValueError('You must execute run_forever() '
+                                 'before emitting messages')
+            self.connected_event.wait()
+        frame = encode_frame(self.codec.encode(message))
+        try:
+            with self._send_lock:
+                self._sock.sendall(frame)
+        except OSError:
+            LOG.warning("Could not send {t} message because connection has "
+                        "been closed".format(t=message.msg_type))
+
+
+def get_unix_bus(path=DEFAULT_UNIX_PATH, threaded=True, formats=None,
+                 compress_threshold=None):
+    """ Returns a UnixBusClient connected to path """
+    client = UnixBusClient(path, formats=formats,
+                           compress_threshold=compress_threshold)
+    if threaded:
+        client.run_in_thread()
+    return client
+
+
+if __name__ == "__main__":
+    import argparse
+    from ovos_utils import wait_for_exit_signal
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default=DEFAULT_UNIX_PATH)
+    args = parser.parse_args()
+
+    server = UnixMessageBusServer(args.path).start()
+    print("unix messagebus listening on " + args.path)
+    wait_for_exit_signal()
+    server.stop()
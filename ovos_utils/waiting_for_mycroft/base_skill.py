@@ -178,6 +178,22 @@ class MycroftSkill(_MycroftSkill):
             ConverseTracker.connect_bus(self.bus)  # pull/1468
             self.add_event("converse.skill.deactivated",
                            self._deactivate_skill)
+            self.add_event("mycroft.skill.enable_intents",
+                           self._handle_enable_intents)
+            self.add_event("mycroft.skill.disable_intents",
+                           self._handle_disable_intents)
+
+    # batched mycroft.skill.enable_intent / disable_intent, sent by
+    # ovos_utils.intents.layers.IntentLayers(batch=True)
+    def _handle_enable_intents(self, message):
+        for intent_name in message.data.get("intent_names") or []:
+            self.handle_enable_intent(message.forward(
+                "mycroft.skill.enable_intent", {"intent_name": intent_name}))
+
+    def _handle_disable_intents(self, message):
+        for intent_name in message.data.get("intent_names") or []:
+            self.handle_disable_intent(message.forward(
+                "mycroft.skill.disable_intent", {"intent_name": intent_name}))
 
     def _send_public_api(self, message):
         """Respond with the skill's public api."""
@@ -4,6 +4,7 @@ setup(
     name='ovos_utils',
     version='0.0.4',
     packages=['ovos_utils',
+              'ovos_utils.messagebus',
               'ovos_utils.waiting_for_mycroft',
               'ovos_utils.misc',
               'ovos_utils.intents',
@@ -0,0 +1,499 @@
+import os
+import unittest
+from os.path import join
+from tempfile import mkdtemp
+from threading import Event, Thread
+from time import sleep, time
+from unittest.mock import patch
+from ovos_utils.intents import IntentQueryApi, ConverseTracker
+from ovos_utils.intents.active_skills import ActiveSkillTracker
+from ovos_utils.intents.entities import EntityFileCache, parse_entity_file
+from ovos_utils.intents.layers import IntentLayers
+from ovos_utils.messagebus import Message
+from ovos_utils.messagebus.local import LocalBus
+
+
+class TestIntentQueryApi(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = LocalBus()
+        self.api = IntentQueryApi(self.bus, timeout=0.5)
+
+    def test_batch_intents(self):
+        in_flight = []
+        peak = []
+
+        def answer(message):
+            utterance = message.data["utterance"]
+            if utterance == "silence":
+                return  # never answered, times out
+            in_flight.append(utterance)
+            peak.append(len(in_flight))
+            sleep(0.02 if utterance == "slow" else 0.001)
+            in_flight.remove(utterance)
+            self.bus.emit(message.reply("intent.service.intent.reply",
+                                        {"intent": {
+                                            "skill_id": utterance + ".skill",
+                                            "utterance": utterance}}))
+
+        # answer on other threads, replies may arrive out of order
+        self.bus.on("intent.service.intent.get",
+                    lambda m: Thread(target=answer, args=(m,)).start())
+        utterances = ["slow", "a", "silence", "b", "c", "d"]
+        skills = self.api.get_skills(utterances, concurrency=3)
+        self.assertEqual(skills, ["slow.skill", "a.skill", None, "b.skill",
+                                  "c.skill", "d.skill"])
+        self.assertLessEqual(max(peak), 3)
+        stats = self.api.last_batch_stats
+        self.assertEqual(stats["requests"], 6)
+        self.assertEqual(stats["answered"], 5)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertGreater(stats["throughput"], 0)
+
+    def test_lost_reply_does_not_stall_batch(self):
+        def answer(message):
+            if message.data["utterance"].startswith("lost"):
+                return
+            self.bus.emit(message.reply("intent.service.intent.reply",
+                                        {"intent": {"skill_id": "skill"}}))
+
+        self.bus.on("intent.service.intent.get", answer)
+        start = time()
+        skills = self.api.get_skills(["lost1", "a", "b", "lost2", "c"],
+                                     concurrency=2)
+        # both lost requests expire together, not one after the other
+        self.assertLess(time() - start, 0.9)
+        self.assertEqual(skills, [None, "skill", "skill", None, "skill"])
+        self.assertEqual(self.api.last_batch_stats["timeouts"], 2)
+
+    def test_single_intent(self):
+        self.bus.on("intent.service.adapt.get",
+                    lambda m: self.bus.emit(m.reply(
+                        "intent.service.adapt.reply",
+                        {"intent": {"intent_type": "Time.skill:TimeIntent"}}
+                    )))
+        self.assertEqual(self.api.get_adapt_intent("what time is it"),
+                         {"intent_type": "Time.skill:TimeIntent"})
+        self.assertEqual(self.api.get_adapt_intents(["x", "y"]),
+                         [{"intent_type": "Time.skill:TimeIntent"}] * 2)
+
+    def test_manifest_cache(self):
+        queries = []
+
+        def answer(reply_type, data):
+            def handler(message):
+                queries.append(message.msg_type)
+                self.bus.emit(message.reply(reply_type, data))
+            return handler
+
+        self.bus.on("intent.service.adapt.manifest.get",
+                    answer("intent.service.adapt.manifest",
+                           {"intents": ["TimeIntent"]}))
+        self.bus.on("intent.service.padatious.manifest.get",
+                    answer("intent.service.padatious.manifest",
+                           {"intents": ["joke.intent"]}))
+        self.bus.on("intent.service.adapt.vocab.manifest.get",
+                    answer("intent.service.adapt.vocab.manifest",
+                           {"vocab": [{"start": "time", "end": "Time"},
+                                      {"regex": "(?P<Location>.*)"}]}))
+        self.bus.on("intent.service.padatious.entities.manifest.get",
+                    answer("intent.service.padatious.entities.manifest",
+                           {"entities": []}))
+
+        keywords = self.api.get_keywords_manifest()
+        self.assertEqual(keywords["adapt"],
+                         [{"name": "Time", "samples": ["time"]}])
+        self.assertEqual(keywords["regex"],
+                         [{"name": "Location",
+                           "regexes": ["(?P<Location>.*)"]}])
+        # one shared vocab query for vocab and regex
+        self.assertEqual(sorted(queries),
+                         ["intent.service.adapt.vocab.manifest.get",
+                          "intent.service.padatious.entities.manifest.get"])
+
+        self.assertEqual(self.api.get_intent_manifest(),
+                         {"adapt": ["TimeIntent"],
+                          "padatious": ["joke.intent"]})
+        self.api.get_intent_manifest()
+        self.api.get_vocab_manifest()
+        self.assertEqual(len(queries), 4)
+
+        # only the adapt intents changed
+        self.bus.emit(Message("register_intent", {"name": "JokeIntent"}))
+        self.api.get_intent_manifest()
+        self.api.get_keywords_manifest()
+        self.assertEqual(len(queries), 5)
+        self.assertEqual(queries[-1], "intent.service.adapt.manifest.get")
+
+        self.bus.emit(Message("mycroft.skills.loaded", {"id": "joke.skill"}))
+        self.api.get_keywords_manifest()
+        self.assertEqual(len(queries), 7)
+
+        # instances on the same bus share the cache and its listeners
+        listeners = self.bus.listener_count("register_intent")
+        other = IntentQueryApi(self.bus, timeout=0.5)
+        self.assertIs(other.manifests, self.api.manifests)
+        other.get_keywords_manifest()
+        self.assertEqual(len(queries), 7)
+        IntentQueryApi(self.bus, timeout=0.5, cache_ttl=0)
+        self.assertEqual(self.bus.listener_count("register_intent"),
+                         listeners)
+
+    def test_manifest_timeout(self):
+        with patch("ovos_utils.messagebus.cache.LOG") as log:
+            self.assertIsNone(self.api.get_adapt_manifest())
+        log.warning.assert_called_once_with("Intent Service timed out!")
+        log.error.assert_not_called()
+
+
+class TestEntityFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def write(self, name, content):
+        path = join(self.dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_parse(self):
+        path = self.write("city.entity", "lisbon\n(new york|NYC)\n\n porto ")
+        self.assertEqual(parse_entity_file(path),
+                         ["lisbon", "new york", "NYC", "porto"])
+
+    def test_cache(self):
+        city = self.write("city.entity", "lisbon\nporto")
+        color = self.write("color.entity", "red|green")
+        cache = EntityFileCache()
+        self.assertEqual(cache.get(city), ["lisbon", "porto"])
+        self.assertEqual(cache.get(city), ["lisbon", "porto"])
+        self.assertEqual(cache.stats["parsed"], 1)
+        self.assertEqual(cache.stats["hits"], 1)
+
+        # changed files are parsed again
+        self.write("city.entity", "lisbon\nporto\nfaro")
+        st = os.stat(city)
+        os.utime(city, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        missing = join(self.dir, "missing.entity")
+        self.assertEqual(cache.get_many([city, color, missing]),
+                         {city: ["lisbon", "porto", "faro"],
+                          color: ["red", "green"]})
+        self.assertEqual(cache.stats["parsed"], 3)
+        self.assertEqual(cache.stats["missing"], 1)
+
+
+class TestActiveSkillTracker(unittest.TestCase):
+
+    def test_recency(self):
+        tracker = ActiveSkillTracker(timeout=300)
+        tracker.add("a", 10)
+        tracker.add("b", 20)
+        tracker.add("c", 30)
+        tracker.add("a", 40)  # bump
+        self.assertFalse(tracker.add("b", 5))  # older than tracked
+        tracker.add("d", 25)  # out of order
+        self.assertEqual([s for s, _ in tracker.active_skills],
+                         ["a", "c", "d", "b"])
+        self.assertTrue(tracker.remove("c"))
+        self.assertFalse(tracker.remove("c"))
+        self.assertEqual(tracker.oldest, ("b", 20))
+        tracker.shutdown()
+
+    def test_out_of_order(self):
+        tracker = ActiveSkillTracker(timeout=300)
+        now = time()
+        for n in range(500):
+            # shuffled timestamps, every skill bumped several times
+            tracker.add("skill{n}".format(n=n % 50), now - (n * 7919) % 500)
+        expected = sorted(((max(now - (n * 7919) % 500
+                                for n in range(i, 500, 50)),
+                            "skill{i}".format(i=i)) for i in range(50)),
+                          reverse=True)
+        self.assertEqual(tracker.active_skills,
+                         [[s, ts] for ts, s in expected])
+        self.assertEqual(tracker.oldest, (expected[-1][1], expected[-1][0]))
+        # skipped entries are compacted away
+        self.assertLessEqual(len(tracker._order), 2 * 50 + 64)
+        tracker.shutdown()
+
+    def test_timer_expiry(self):
+        expired = []
+        done = Event()
+
+        def on_expire(skill_id):
+            expired.append(skill_id)
+            if len(expired) == 2:
+                done.set()
+
+        tracker = ActiveSkillTracker(timeout=0.1, on_expire=on_expire)
+        tracker.add("a")
+        tracker.add("b")
+        tracker.add("a")  # the first "a" entry is outdated now
+        self.assertTrue(tracker.check("a"))
+        self.assertTrue(done.wait(5))
+        self.assertEqual(sorted(expired), ["a", "b"])
+        self.assertEqual(len(tracker), 0)
+        self.assertFalse(tracker.check("a"))
+        tracker.shutdown()
+
+
+class TestConverseTracker(unittest.TestCase):
+
+    def test_class_api(self):
+        class Tracker(ConverseTracker):
+            tracker = ActiveSkillTracker()
+
+        bus = LocalBus()
+        events = []
+        bus.on("converse.skill.activated", events.append)
+        bus.on("converse.skill.deactivated", events.append)
+        Tracker.connect_bus(bus)
+        Tracker.add_active_skill("weather")
+        Tracker.add_active_skill("timer")
+        self.assertTrue(Tracker.check_skill("weather"))
+        self.assertEqual([s for s, _ in Tracker.active_skills],
+                         ["timer", "weather"])
+        Tracker.remove_active_skill("weather")
+        self.assertFalse(Tracker.check_skill("weather"))
+        self.assertEqual([m.msg_type for m in events],
+                         ["converse.skill.activated"] * 2 +
+                         ["converse.skill.deactivated"])
+        now = time()
+        Tracker.active_skills = [["joke", now - 20], ["news", now - 10]]
+        self.assertEqual(Tracker.active_skills,
+                         [["news", now - 10], ["joke", now - 20]])
+        # the default tracker is untouched
+        self.assertIsNot(ConverseTracker.tracker, Tracker.tracker)
+        Tracker.tracker.shutdown()
+
+    def test_expiry_events(self):
+        class Tracker(ConverseTracker):
+            tracker = ActiveSkillTracker()
+            converse_timeout = 0.002  # minutes
+
+        bus = LocalBus()
+        events = []
+        bus.on("converse.skill.deactivated", events.append)
+        Tracker.connect_bus(bus)
+        # expired by the timer, silently
+        Tracker.add_active_skill("weather")
+        sleep(0.3)
+        self.assertFalse(Tracker.check_skill("weather"))
+        self.assertEqual(events, [])
+        # opt in
+        Tracker.emit_expired = True
+        Tracker.add_active_skill("timer")
+        sleep(0.3)
+        self.assertEqual([m.data["skill_id"] for m in events], ["timer"])
+        # filter_active_skills announces what it removes either way
+        Tracker.emit_expired = False
+        Tracker.tracker.shutdown()
+        Tracker.add_active_skill("joke")
+        sleep(0.2)
+        Tracker.filter_active_skills()
+        self.assertEqual([m.data["skill_id"] for m in events],
+                         ["timer", "joke"])
+
+    def test_async_attribution(self):
+        class Tracker(ConverseTracker):
+            tracker = ActiveSkillTracker()
+
+        bus = LocalBus()
+        queries = []
+
+        def answer(message):
+            queries.append(message.data["utterance"])
+            sleep(0.2)
+            bus.emit(message.reply("intent.service.intent.reply",
+                                   {"intent": {"skill_id": "skill-" +
+                                               message.data["utterance"]}}))
+
+        bus.on("intent.service.intent.get",
+               lambda m: Thread(target=answer, args=(m,)).start())
+        activated = Event()
+        bus.on("converse.skill.activated", lambda m: activated.set())
+        Tracker.connect_bus(bus)
+
+        start = time()
+        bus.emit(Message("recognizer_loop:utterance",
+                         {"utterances": ["joke"], "lang": "en-us"}))
+        # the bus thread does not wait for the intent service
+        self.assertLess(time() - start, 0.1)
+        self.assertTrue(activated.wait(5))
+        self.assertTrue(Tracker.check_skill("skill-joke"))
+
+        # remembered, no second query
+        self.assertEqual(Tracker.attribute_utterance("joke"), "skill-joke")
+        self.assertEqual(queries, ["joke"])
+
+        # a late result for an older utterance does not take the lead
+        Tracker.attribute_utterance("news", ts=time() - 60)
+        self.assertEqual([s for s, _ in Tracker.active_skills],
+                         ["skill-joke", "skill-news"])
+        Tracker.tracker.shutdown()
+
+
+class TestIntentLayers(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = LocalBus()
+        self.toggles = []
+
+        # a skill acknowledging like mycroft-core, the intent services
+        # get "skill_id:intent_name"
+        def enable(message):
+            self.toggles.append(("on", message.data["intent_name"]))
+            self.bus.emit(Message("register_intent", {
+                "name": "skill:" + message.data["intent_name"]}))
+
+        def disable(message):
+            self.toggles.append(("off", message.data["intent_name"]))
+            self.bus.emit(Message("detach_intent", {
+                "intent_name": "skill:" + message.data["intent_name"]}))
+
+        self.bus.on("mycroft.skill.enable_intent", enable)
+        self.bus.on("mycroft.skill.disable_intent", disable)
+
+    def test_diff_transitions(self):
+        layers = IntentLayers(self.bus, [["a", "b"], ["b", "c"], ["d"]],
+                              skill_id="skill")
+        self.assertEqual(sorted(self.toggles),
+                         [("off", "c"), ("off", "d"),
+                          ("on", "a"), ("on", "b")])
+        self.toggles.clear()
+        start = time()
+        layers.next()
+        # only the difference is toggled, nothing waits for a timeout
+        self.assertEqual(self.toggles, [("off", "a"), ("on", "c")])
+        self.assertLess(time() - start, 0.5)
+        self.toggles.clear()
+        layers.activate_layer(1)
+        self.assertEqual(self.toggles, [])
+        layers.disable()
+        self.assertEqual(self.toggles, [("off", "b"), ("off", "c")])
+
+    def test_batch(self):
+        batches = []
+        self.bus.on("mycroft.skill.disable_intents", batches.append)
+        self.bus.on("mycroft.skill.enable_intents", batches.append)
+        layers = IntentLayers(self.bus, [["a", "b"], ["c", "d"]],
+                              batch=True, ack_timeout=0.2, skill_id="skill")
+        batches.clear()
+        start = time()
+        # nobody handles the batched messages, the switch waits for the
+        # detach of a and b once, enabling does not wait
+        layers.next()
+        self.assertLess(time() - start, 0.35)
+        self.assertEqual([(m.msg_type, m.data["intent_names"])
+                          for m in batches],
+                         [("mycroft.skill.disable_intents", ["a", "b"]),
+                          ("mycroft.skill.enable_intents", ["c", "d"])])
+        self.assertEqual(self.toggles, [])
+
+    def test_ack_of_other_skill(self):
+        layers = IntentLayers(self.bus, [["stop"], ["play"]],
+                              ack_timeout=0.3, skill_id="music")
+        # only another skill owning a "stop" intent answers
+        start = time()
+        self.assertFalse(layers.disable_intents(["stop"]))
+        self.assertGreaterEqual(time() - start, 0.3)
+        # intents not enabled by the layers are not waited for
+        start = time()
+        self.assertTrue(layers.disable_intents(["play"]))
+        self.assertLess(time() - start, 0.1)
+
+    def test_no_skill_id(self):
+        layers = IntentLayers(self.bus, [["a"], ["b"]])
+        # bare names can not be matched to a detach, bounded wait
+        start = time()
+        layers.next()
+        self.assertGreaterEqual(time() - start, 0.3)
+        self.assertLess(time() - start, 0.9)
+
+        # "skill_id:intent_name" names are acknowledged as they are
+        self.bus.on("mycroft.skill.disable_intent",
+                    lambda m: self.bus.emit(Message("detach_intent", {
+                        "intent_name": m.data["intent_name"]})))
+        layers = IntentLayers(self.bus, [["skill:a"], ["skill:b"]])
+        start = time()
+        self.assertTrue(layers.disable_intents(["skill:a"]))
+        self.assertLess(time() - start, 0.2)
+
+    def test_named_layers_survive_removal(self):
+        layers = IntentLayers(self.bus, ack_timeout=0)
+        layers.add_named_layer("first", ["a"])
+        layers.add_named_layer("second", ["b", "c"])
+        layers.add_named_layer("third", ["c"])
+        layers.activate_named_layer("third")
+        layers.remove_named_layer("first")
+        self.assertEqual(layers.named_layers, {"second": 0, "third": 1})
+        self.assertEqual(layers.layers, [["b", "c"], ["c"]])
+        self.assertEqual(layers.current_layer, 1)
+        self.assertEqual(layers.find_layer("c"), [0, 1])
+        self.assertEqual(layers.find_layer("a"), [])
+        self.toggles.clear()
+        layers.activate_named_layer("second")
+        self.assertEqual(self.toggles, [("on", "b")])
+
+    def test_layers_list(self):
+        layers = IntentLayers(self.bus, [["a"], ["b"]], ack_timeout=0)
+        layers.add_named_layer("named", ["c"])
+        layers.activate_layer(1)
+        # changes through the list are indexed like add_layer & co
+        layers.layers.append(["d"])
+        layers.layers.insert(0, ["e", "b"])
+        self.assertEqual(layers.layers, [["e", "b"], ["a"], ["b"], ["c"],
+                                         ["d"]])
+        self.assertEqual(layers.current_layer, 2)
+        self.assertEqual(layers.named_layers, {"named": 3})
+        self.assertEqual(layers.find_layer("b"), [0, 2])
+        layers.layers[-1] = ["f"]
+        self.assertEqual(layers.find_layer("d"), [])
+        self.assertEqual(layers.find_layer("f"), [4])
+        del layers.layers[0]
+        self.assertEqual(layers.find_layer("e"), [])
+        self.assertEqual(layers.current_layer, 1)
+        self.assertEqual(len(layers.layers), 4)
+        self.assertEqual(layers.layers[1:3], [("b",), ("c",)])
+        with self.assertRaises(IndexError):
+            layers.layers[10] = ["x"]
+        layers.layers = layers.layers
+        self.assertEqual(layers.layers, [["a"], ["b"], ["c"], ["f"]])
+
+    def test_transitions(self):
+        layers = IntentLayers(self.bus, ack_timeout=0)
+        layers.add_named_layer("menu", ["order", "help"])
+        layers.add_named_layer("order", ["pizza", "cancel", "help"])
+        self.assertTrue(layers.add_transition("menu", "order"))
+        self.assertFalse(layers.add_transition("menu", "missing"))
+        layers.activate_named_layer("menu")
+        self.assertEqual(layers.transitions(), ["order"])
+        self.toggles.clear()
+        self.assertTrue(layers.transition("order"))
+        self.assertEqual(self.toggles, [("off", "order"), ("on", "pizza"),
+                                        ("on", "cancel")])
+        # not declared
+        self.assertFalse(layers.transition("menu"))
+        # transitions start from the last activated layer, also after it
+        # was deactivated
+        layers.add_transition("order", "menu")
+        layers.deactivate_named_layer("order")
+        self.assertTrue(layers.transition("menu"))
+        layers.disable_intents(["help"])
+        self.assertTrue(layers.transition("order"))
+        self.assertTrue(layers.remove_transition("menu", "order"))
+        self.assertEqual(layers.transitions("menu"), [])
+
+    def test_many_layers(self):
+        layers = IntentLayers(self.bus, ack_timeout=0)
+        for n in range(200):
+            layers.add_named_layer(str(n), ["shared", "intent%d" % n])
+        for n in range(199):
+            layers.add_transition(str(n), str(n + 1))
+        layers.activate_named_layer("0")
+        self.toggles.clear()
+        for n in range(1, 200):
+            self.assertTrue(layers.transition(str(n)))
+        self.assertEqual(len(self.toggles), 2 * 199)
+        self.assertEqual(layers.current_layer, 199)